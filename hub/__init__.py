@@ -11,6 +11,7 @@ from flask import Flask
 # App imports
 from .config import Config
 from hub.routes import load_routes
+from hub.commands import load_commands
 from .models import import_all_models
 from .exts import db, migrate, api, jwt, ma
 
@@ -28,8 +29,10 @@ def create_app():
         create_app.resources_added = True
 
         load_plugins(app)
+        load_commands(app)
 
-        import hub.services.middleware
+        from hub.services import middleware
+        middleware.init_app(app)
 
         handle_errors(app)
 
@@ -51,6 +54,9 @@ def load_plugins(app):
     jwt.init_app(app)
     ma.init_app(app)
 
+    from hub.services import tasks
+    tasks.init_app(app)
+
 
 def handle_errors(app):
     """
@@ -0,0 +1,165 @@
+"""
+Command line tools, run with `flask <group> <command>`.
+"""
+
+import click
+from flask.cli import AppGroup
+
+
+stub_cli = AppGroup('stub', help='Run local stand-ins for external APIs.')
+
+
+@stub_cli.command('ses')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=9001)
+@click.option('--latency', default=0.0, help='Seconds added to every call.')
+@click.option('--max-rate', default=0.0, help='Messages per second before throttling.')
+def run_ses_stub(host, port, latency, max_rate):
+    """Run a fake SES endpoint"""
+    from hub.stubs.ses import create_stub
+
+    create_stub(latency, max_rate).run(host=host, port=port, threaded=True)
+
+
+@stub_cli.command('postcodes')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=9002)
+@click.option('--latency', default=0.0, help='Seconds added to every call.')
+def run_postcodes_stub(host, port, latency):
+    """Run a fake postcodes.io"""
+    from hub.stubs.postcodes import create_stub
+
+    create_stub(latency).run(host=host, port=port, threaded=True)
+
+
+@stub_cli.command('stripe')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=9003)
+@click.option('--latency', default=0.0, help='Seconds added to every call.')
+@click.option('--max-rate', default=0.0, help='Requests per second before rate limiting.')
+def run_stripe_stub(host, port, latency, max_rate):
+    """Run a fake Stripe API"""
+    from hub.stubs.stripe import create_stub
+
+    create_stub(latency, max_rate).run(host=host, port=port, threaded=True)
+
+
+geo_cli = AppGroup('geo', help='Postcode lookups.')
+
+
+@geo_cli.command('enrich')
+def enrich():
+    """Look up codes for every address still waiting for them"""
+    from hub.services.geo import enrich_addresses
+
+    enrich_addresses()
+
+
+@geo_cli.command('load-directory')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', default=None, help='Defaults to POSTCODE_INDEX_PATH.')
+@click.option('--prefix', multiple=True, help='Only include postcodes starting with this.')
+def load_directory(csv_path, output, prefix):
+    """Build the offline postcode index from an ONS Postcode Directory CSV"""
+    from flask import current_app
+    from hub.services.postcode_index import load_directory
+
+    output = output or current_app.config['POSTCODE_INDEX_PATH']
+    if not output:
+        raise click.UsageError('Set POSTCODE_INDEX_PATH or pass --output.')
+
+    count = load_directory(csv_path, output, prefix)
+    click.echo('Indexed {:d} postcodes into {:s}'.format(count, output))
+
+
+people_cli = AppGroup('people', help='Membership records.')
+
+
+@people_cli.command('export')
+@click.option('--format', 'format', default='csv', type=click.Choice(['csv', 'ndjson']))
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', default='-', type=click.Path(dir_okay=False, allow_dash=True),
+              help='Defaults to stdout.')
+def export_people(format, compress, output):
+    """Write every person out as CSV or NDJSON"""
+    from hub.services.export import export
+
+    with click.open_file(output, 'wb') as f:
+        for chunk in export(format, 'gzip' if compress else None):
+            f.write(chunk)
+
+
+@people_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'format', default='csv', type=click.Choice(['csv', 'ndjson']))
+@click.option('--source', default='cli', help='Recorded against their email consent.')
+def import_people(path, format, source):
+    """Import people from a CSV or NDJSON file"""
+    from hub.services.importer import import_people
+
+    with click.open_file(path, 'r', encoding='utf-8-sig') as f:
+        result = import_people(f, format, 'import:' + source)
+
+    for error in result.errors:
+        click.echo('Row {:d}: {}'.format(error['row'], error['errors']), err=True)
+
+    click.echo('Imported {:d} people, {:d} rows failed'.format(result.imported, len(result.errors)))
+
+
+passwords_cli = AppGroup('passwords', help='Password hashing.')
+
+
+@passwords_cli.command('calibrate')
+@click.option('--target-ms', default=250.0, help='How long one verify should take.')
+@click.option('--memory-cost', default=None, type=int, help='KiB, defaults to ARGON2_MEMORY_COST.')
+@click.option('--parallelism', default=None, type=int, help='Defaults to ARGON2_PARALLELISM.')
+def calibrate(target_ms, memory_cost, parallelism):
+    """Pick argon2 costs that hit a target verify time on this host"""
+    from flask import current_app
+    from hub.services.passwords import calibrate
+
+    memory_cost = memory_cost or current_app.config['ARGON2_MEMORY_COST']
+    parallelism = parallelism or current_app.config['ARGON2_PARALLELISM']
+
+    time_cost, median = calibrate(target_ms, memory_cost, parallelism)
+
+    click.echo('Verify takes {:.0f}ms with these settings:'.format(median))
+    click.echo('ARGON2_TIME_COST={:d}'.format(time_cost))
+    click.echo('ARGON2_MEMORY_COST={:d}'.format(memory_cost))
+    click.echo('ARGON2_PARALLELISM={:d}'.format(parallelism))
+
+
+billing_cli = AppGroup('billing', help='Recurring membership charges.')
+
+
+@billing_cli.command('run')
+@click.option('--on', default=None, type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Price roles as on this date, and bill its month. Defaults to today.')
+@click.option('--workers', default=None, type=int, help='Defaults to BILLING_WORKERS.')
+@click.option('--batch-size', default=None, type=int, help='Defaults to BILLING_BATCH_SIZE.')
+def run_billing(on, workers, batch_size):
+    """Charge every member due for the month. Safe to run again if interrupted."""
+    import time
+    from hub.services.billing import run
+
+    started = time.monotonic()
+    result  = run(on, workers, batch_size)
+
+    for error in result.errors:
+        click.echo('{:s}: {:s}'.format(error['person_id'], error['error']), err=True)
+
+    click.echo('Billed {:s} in {:.1f}s: {:d} charged, {:d} declined, {:d} errored'.format(
+        result.period, time.monotonic() - started, result.charged, result.failed, len(result.errors)
+    ))
+
+
+def load_commands(app):
+    """
+    Load all command groups
+    """
+
+    app.cli.add_command(stub_cli)
+    app.cli.add_command(geo_cli)
+    app.cli.add_command(people_cli)
+    app.cli.add_command(passwords_cli)
+    app.cli.add_command(billing_cli)
@@ -25,10 +25,75 @@ class Config:
     SQLALCHEMY_COMMIT_ON_TEARDOWN = environ.get('SQLALCHEMY_COMMIT_ON_TEARDOWN', False)
     DATABASE_CONNECT_OPTIONS = {}
 
+    PRINCIPAL_CACHE_SIZE = int(environ.get('PRINCIPAL_CACHE_SIZE', 4096))
+    # Logged in users are cached per worker for this long (seconds)
+    PRINCIPAL_CACHE_TTL = int(environ.get('PRINCIPAL_CACHE_TTL', 60))
+    PERMISSION_CACHE_SIZE = int(environ.get('PERMISSION_CACHE_SIZE', 4096))
+    PERMISSION_CACHE_TTL = int(environ.get('PERMISSION_CACHE_TTL', 300))
+    CACHE_STAMP_INTERVAL = float(environ.get('CACHE_STAMP_INTERVAL', 2))  # seconds between checks for other workers' writes
+
+    # Pricing
+    PRICING_INDEX_TTL = int(environ.get('PRICING_INDEX_TTL', 300))  # seconds
+
+    # Responses
+    SCHEMA_CACHE_SIZE = int(environ.get('SCHEMA_CACHE_SIZE', 256))  # field sets kept per worker
+    COMPRESS_MIN_SIZE = int(environ.get('COMPRESS_MIN_SIZE', 1024))  # bytes
+
+    # Imports and exports
+    EXPORT_BATCH_SIZE = int(environ.get('EXPORT_BATCH_SIZE', 1000))  # rows fetched at a time
+    IMPORT_CHUNK_SIZE = int(environ.get('IMPORT_CHUNK_SIZE', 500))  # rows inserted at a time
+
+    # Token revocation
+    REVOCATION_CAPACITY = int(environ.get('REVOCATION_CAPACITY', 100000))
+    REVOCATION_ERROR_RATE = float(environ.get('REVOCATION_ERROR_RATE', 0.001))
+    REVOCATION_SYNC_INTERVAL = int(environ.get('REVOCATION_SYNC_INTERVAL', 5))  # seconds
+    REVOCATION_SYNC_OVERLAP = int(environ.get('REVOCATION_SYNC_OVERLAP', 60))  # seconds re-read each sync
+    REVOCATION_PRUNE_INTERVAL = int(environ.get('REVOCATION_PRUNE_INTERVAL', 60 * 60))  # seconds
+
+    # Email verification
+    VERIFY_SWEEP_INTERVAL = int(environ.get('VERIFY_SWEEP_INTERVAL', 15 * 60))  # seconds
+    VERIFY_SWEEP_BATCH_SIZE = int(environ.get('VERIFY_SWEEP_BATCH_SIZE', 1000))
+
+    # Passwords
+    # Run `flask passwords calibrate` to pick costs for the host
+    ARGON2_TIME_COST = int(environ.get('ARGON2_TIME_COST', 3))
+    ARGON2_MEMORY_COST = int(environ.get('ARGON2_MEMORY_COST', 65536))  # KiB
+    ARGON2_PARALLELISM = int(environ.get('ARGON2_PARALLELISM', 4))
+    # Keep PASSWORD_WORKERS + PASSWORD_QUEUE_DEPTH below uWSGI's threads per process
+    PASSWORD_WORKERS = int(environ.get('PASSWORD_WORKERS', 2))
+    PASSWORD_QUEUE_DEPTH = int(environ.get('PASSWORD_QUEUE_DEPTH', 2))
+
     # Email
     GLOBAL_FROM_ADDR = environ.get('GLOBAL_FROM_ADDR', 'dev@localhost.test')
     TEMPLATE_PATH = environ.get('TEMPLATE_PATH', 'hub/templates')
+    SES_REGION = environ.get('SES_REGION', 'eu-west-1')
+    SES_ENDPOINT_URL = environ.get('SES_ENDPOINT_URL')
+    SES_MAX_SEND_RATE = float(environ.get('SES_MAX_SEND_RATE', 14))
+    SES_MAX_RETRIES = int(environ.get('SES_MAX_RETRIES', 5))
+    SES_RETRY_DELAY = float(environ.get('SES_RETRY_DELAY', 0.5))
+
+    # Background tasks
+    # Set to run tasks inline instead of in the spooler or a worker thread
+    TASKS_EAGER = environ.get('TASKS_EAGER', False)
+
+    # Postcodes
+    POSTCODES_API_URL = environ.get('POSTCODES_API_URL', 'https://api.postcodes.io')
+    POSTCODES_API_TIMEOUT = float(environ.get('POSTCODES_API_TIMEOUT', 5))
+    POSTCODE_CACHE_SIZE = int(environ.get('POSTCODE_CACHE_SIZE', 4096))
+    POSTCODE_CACHE_TTL = int(environ.get('POSTCODE_CACHE_TTL', 60 * 60 * 24 * 30))  # seconds
+    POSTCODE_INDEX_PATH = environ.get('POSTCODE_INDEX_PATH')  # built by `flask geo load-directory`
+    GEO_ENRICH_INTERVAL = int(environ.get('GEO_ENRICH_INTERVAL', 30))  # seconds
 
     # Stripe
     STRIPE_SECRET = environ.get('STRIPE_SECRET')
     STRIPE_PUBLIC = environ.get('STRIPE_PUBLIC')
+    STRIPE_API_BASE = environ.get('STRIPE_API_BASE')  # `flask stub stripe` for offline runs
+    STRIPE_MAX_RATE = float(environ.get('STRIPE_MAX_RATE', 25))  # requests per second
+    STRIPE_MAX_RETRIES = int(environ.get('STRIPE_MAX_RETRIES', 3))
+    STRIPE_RETRY_DELAY = float(environ.get('STRIPE_RETRY_DELAY', 0.5))
+    STRIPE_CUSTOMER_CACHE_SIZE = int(environ.get('STRIPE_CUSTOMER_CACHE_SIZE', 1024))
+    STRIPE_CUSTOMER_CACHE_TTL = int(environ.get('STRIPE_CUSTOMER_CACHE_TTL', 300))  # seconds
+
+    # Billing
+    BILLING_WORKERS = int(environ.get('BILLING_WORKERS', 8))
+    BILLING_BATCH_SIZE = int(environ.get('BILLING_BATCH_SIZE', 200))  # payments inserted at a time
@@ -4,10 +4,19 @@ from flask_restful import Api
 from flask_jwt_extended import JWTManager
 from flask_marshmallow import Marshmallow
 
+from hub.services.representations import output_json
+
+
+def make_api():
+    """The flask_restful Api, with our JSON representation"""
+    api = Api()
+    api.representation('application/json')(output_json)
+    return api
+
 
 # Create global Libraries
 db = SQLAlchemy()
 migrate = Migrate()
-api = Api()
+api = make_api()
 jwt = JWTManager()
-ma = Marshmallow()
\ No newline at end of file
+ma = Marshmallow()
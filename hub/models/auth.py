@@ -0,0 +1,37 @@
+"""
+Models for authentication
+"""
+
+import datetime
+
+from hub.exts import db
+
+
+class RevokedToken(db.Model):
+    """
+    A JWT that must no longer be accepted, kept until it would have expired anyway
+    """
+
+    id         = db.Column(db.Integer, primary_key=True)
+    jti        = db.Column(db.String(36), nullable=False, unique=True)
+    token_type = db.Column(db.String(10), nullable=False)
+    person_id  = db.Column(db.String(10), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, jti, token_type, person_id, expires_at):
+        self.jti        = jti
+        self.token_type = token_type
+        self.person_id  = person_id
+        self.expires_at = expires_at
+        self.revoked_at = datetime.datetime.now()
+
+
+class CacheStamp(db.Model):
+    """
+    A counter bumped with every write to data each worker caches, so the
+    other workers can tell their copies are stale
+    """
+
+    name    = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
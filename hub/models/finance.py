@@ -4,6 +4,8 @@ Models for payments etc
 
 from datetime import datetime
 from hub.exts import db
+from hub.models.membership import watch_person_versions
+from hub.services.pricing import in_effect, rate_amount, band_amount, watch_prices
 
 
 class Band(db.Model):
@@ -24,17 +26,11 @@ class Band(db.Model):
 
     @property
     def is_active(self):
-        if (self.starts_on < datetime.today()) and (self.ends_on is None):
-            return True
-
-        if (self.starts_on < datetime.today()) and (self.ends_on > datetime.today()):
-            return True
-
-        return False
+        return in_effect(self.starts_on, self.ends_on)
 
     @property
     def net_amount(self):
-        return ( (self.rate.amount * self.multiplier) * self.rate.multiplier ) + self.rate.charge
+        return band_amount(self.rate.amount, self.rate.multiplier, self.rate.charge, self.multiplier)
 
 
 class Rate(db.Model):
@@ -56,17 +52,11 @@ class Rate(db.Model):
 
     @property
     def net_amount(self):
-        return (self.amount * self.multiplier) + self.charge
+        return rate_amount(self.amount, self.multiplier, self.charge)
 
     @property
     def is_active(self):
-        if (self.starts_on < datetime.today()) and (self.ends_on is None):
-            return True
-
-        if (self.starts_on < datetime.today()) and (self.ends_on > datetime.today()):
-            return True
-
-        return False
+        return in_effect(self.starts_on, self.ends_on)
 
 
 class Payment(db.Model):
@@ -80,8 +70,15 @@ class Payment(db.Model):
     amount    = db.Column(db.Numeric(5,3), nullable=False, default=0)
     status    = db.Column(db.String(15), nullable=False, default='CREATED')
     
+    period    = db.Column(db.String(7), nullable=True)  # YYYY-MM, for recurring charges
+
     payment_intent_id = db.Column(db.String(100), unique=True)
 
+    # At most one recurring charge per person a month
+    __table_args__ = (
+        db.UniqueConstraint('person_id', 'period', name='uq_payment_person_id_period'),
+    )
+
     def __init__(self, person, amount):
         self.timestamp = datetime.now()
         self.person    = person
@@ -89,3 +86,7 @@ class Payment(db.Model):
 
     def collect(self):
         self.timestamp = datetime.now()
+
+
+watch_person_versions(Payment)
+watch_prices(Rate, Band)
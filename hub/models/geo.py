@@ -0,0 +1,46 @@
+"""
+Models for geographic lookups
+"""
+
+import datetime
+
+from hub.exts import db
+
+
+class PostCode(db.Model):
+    """
+    Stored postcode lookups, so each postcode is only fetched from the API once
+    """
+
+    post_code       = db.Column(db.String(10), primary_key=True)
+    ward_id         = db.Column(db.String(10), nullable=True)
+    district_id     = db.Column(db.String(10), nullable=True)
+    constituency_id = db.Column(db.String(10), nullable=True)
+    fetched_at      = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, post_code, codes):
+        self.post_code = post_code
+        self.codes     = codes
+
+    @property
+    def codes(self):
+        if self.ward_id is None and self.district_id is None and self.constituency_id is None:
+            return None
+
+        return {
+            'admin_ward': self.ward_id,
+            'admin_district': self.district_id,
+            'parliamentary_constituency': self.constituency_id
+        }
+
+    @codes.setter
+    def codes(self, codes):
+        codes = codes or {}
+
+        self.ward_id         = codes.get('admin_ward')
+        self.district_id     = codes.get('admin_district')
+        self.constituency_id = codes.get('parliamentary_constituency')
+        self.fetched_at      = datetime.datetime.now()
+
+    def is_fresh(self, ttl):
+        return self.fetched_at > datetime.datetime.now() - datetime.timedelta(seconds=ttl)
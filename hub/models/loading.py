@@ -0,0 +1,33 @@
+"""
+Named relationship loading profiles.
+
+Relationships load lazily by default. Code that knows which part of the
+graph it is going to use picks a profile by name, which loads exactly that:
+
+    Person.query.options(*profile('person.detail')).get(person_id)
+"""
+
+# Profile name: function returning the query options
+_profiles = {}
+
+# Options built so far, by profile name
+_built = {}
+
+
+def register_profile(name, options):
+    """
+    Register a profile. options is a function returning a list of query options,
+    so it is only called once every mapper (and backref) has been set up.
+    """
+    _profiles[name] = options
+    _built.pop(name, None)
+
+
+def profile(name):
+    if name not in _built:
+        try:
+            _built[name] = tuple(_profiles[name]())
+        except KeyError:
+            raise ValueError('Unknown loading profile: {:s}'.format(name))
+
+    return _built[name]
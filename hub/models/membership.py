@@ -1,15 +1,59 @@
 """
 Models for everything relating to people (users, members, etc)
 """
-import datetime, hashlib
+import datetime, hashlib, hmac
 from string import ascii_uppercase
-from passlib.hash import argon2
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 
 from hub.exts import db
+from hub.models.loading import register_profile
 from hub.services.time import months_to_days
-from hub.services.geo import post_code_check
-from hub.services.permissions import person_has, Gate
-from hub.services.errors import InvalidValueError
+from hub.services.geo import cached_post_code
+from hub.services.cache import MISSING
+from hub.services.passwords import hash_password, verify_password
+from hub.services.permissions import person_has, watch_permissions, Gate
+from hub.services.errors import InvalidValueError, ConflictError
+
+
+def normalise_email(email):
+    """The form emails are matched in, so lookups ignore case and stray spaces"""
+    return email.strip().lower()
+
+
+def bump_person_version(connection, person_id):
+    """Bump a person's version from inside a flush"""
+    if person_id is None:
+        return
+
+    table = Person.__table__
+    connection.execute(
+        table.update().where(table.c.id == person_id).values(version=table.c.version + 1)
+    )
+
+
+def watch_person_versions(model, column='person_id'):
+    """Bump a person's version whenever a row of model belonging to them is written"""
+    def bump(mapper, connection, target):
+        bump_person_version(connection, getattr(target, column))
+
+    for event in ('after_insert', 'after_update', 'after_delete'):
+        db.event.listen(model, event, bump)
+
+
+def _bump_own_version(mapper, connection, target):
+    # Done in SQL, so it can't undo a bump made by another row's write
+    if db.object_session(target).is_modified(target, include_collections=False):
+        target.version = Person.version + 1
+
+
+def id_checksum(id):
+    checksum = 0
+    for char in id:
+        checksum = checksum + ord(char)
+
+    checksum = checksum ** 2
+    return checksum % 99
 
 
 class Person(db.Model):
@@ -21,7 +65,7 @@ class Person(db.Model):
     first_name = db.Column(db.String(255), nullable=False)
     last_name = db.Column(db.String(255), nullable=False)
     date_of_birth = db.Column(db.Date, nullable=True)
-    created_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False)
     ward_id = db.Column(db.String(10), nullable=True)
     district_id = db.Column(db.String(10), nullable=True)
     constituency_id = db.Column(db.String(10), nullable=True)
@@ -35,19 +79,31 @@ class Person(db.Model):
 
     password_hash = db.Column(db.String(300), nullable=True)
 
-    addresses = db.relationship('Address', backref='person', lazy=False)
+    # Bumped by every write to the person or their rows in other tables,
+    # see watch_person_versions
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    # Use a loading profile (hub.models.loading) to load these up front
+    addresses = db.relationship('Address', backref='person', lazy=True)
     phone_numbers = db.relationship('PhoneNumber', backref='person', lazy=True)
-    email_addresses = db.relationship('EmailAddress', backref='person', lazy=False)
-    email_sub = db.relationship('EmailSubscription', backref='person', lazy=False)
-    roles = db.relationship('Role', backref='person', lazy=False)
+    email_addresses = db.relationship('EmailAddress', backref='person', lazy=True)
+    email_sub = db.relationship('EmailSubscription', backref='person', lazy=True)
+    roles = db.relationship('Role', backref='person', lazy=True)
     payments = db.relationship('Payment', backref='person', lazy=True)
 
-    def __init__(self, first_name, last_name):
+    # Pages of people are keyed on (created_at, id), see Person.page
+    __table_args__ = (
+        db.Index('ix_person_created_at_id', 'created_at', 'id'),
+        db.Index('ix_person_ward_id_created_at_id', 'ward_id', 'created_at', 'id'),
+        db.Index('ix_person_district_id_created_at_id', 'district_id', 'created_at', 'id'),
+    )
+
+    def __init__(self, first_name, last_name, id=None):
         self.first_name = first_name.title()
         self.last_name = last_name.title()
         self.created_at = datetime.datetime.now()
 
-        self.set_id()
+        self.set_id(id)
 
     def __repr__(self):
         return '<Person [{:s}]>'.format(self.id)
@@ -110,32 +166,98 @@ class Person(db.Model):
         # @TODO Password verification required
         if password_raw is None:
             return
-        self.password_hash = argon2.hash(password_raw)
+        self.password_hash = hash_password(password_raw)
 
     def check_password(self, password_raw):
+        """
+        Check a password, upgrading the stored hash if the password
+        policy has changed since it was made.
+        """
         if password_raw is None or self.password_hash is None:
             return False
-        return argon2.verify(password_raw, self.password_hash)
 
-    def set_id(self):
-        today = datetime.date.today()
+        matches, new_hash = verify_password(password_raw, self.password_hash)
 
-        month = ascii_uppercase[today.month]
-        count = Person.query.filter(
-            Person.id.startswith('{:s}{:s}'.format(month, today.strftime('%y')))
-        ).count()
+        if new_hash is not None:
+            self.password_hash = new_hash
 
-        self.id = '{:s}{:s}{:02d}'.format(month, today.strftime('%y'), count + 1)
-        checksum = str(self.calculate_id_checksum())
-        self.id = '{:s}{:s}{:d}'.format(self.id, checksum, len(checksum))
+        return matches
 
-    def calculate_id_checksum(self):
-        checksum = 0
-        for char in self.id:
-            checksum = checksum + ord(char)
+    @staticmethod
+    def id_prefix(on=None):
+        """The prefix for ids issued in a month, e.g. 'L20' for November 2020"""
+        if on is None:
+            on = datetime.date.today()
+
+        return '{:s}{:s}'.format(ascii_uppercase[on.month], on.strftime('%y'))
+
+    @staticmethod
+    def format_id(prefix, number):
+        id = '{:s}{:02d}'.format(prefix, number)
+
+        checksum = str(id_checksum(id))
+        return '{:s}{:s}{:d}'.format(id, checksum, len(checksum))
+
+    @classmethod
+    def reserve_ids(cls, count):
+        """
+        Reserve a block of ids for this month, e.g. for a bulk import.
+        Takes constant time however many people already signed up.
+        """
+        prefix = cls.id_prefix()
+        first  = PersonIdSequence.allocate(prefix, count)
 
-        checksum = checksum ** 2
-        return checksum % 99
+        return [cls.format_id(prefix, number) for number in range(first, first + count)]
+
+    def set_id(self, id=None):
+        if id is None:
+            id = self.reserve_ids(1)[0]
+
+        self.id = id
+
+    def calculate_id_checksum(self):
+        return id_checksum(self.id)
+
+    @classmethod
+    def page(cls, limit, after=None, ward_id=None, district_id=None, role_type_id=None,
+             created_from=None, created_to=None):
+        """
+        Query a page of people in signup order, starting after the
+        (created_at, id) key given. Seeks through the index, so later pages
+        cost the same as the first.
+        """
+        query = cls.query
+
+        if after is not None:
+            created_at, id = after
+            query = query.filter(db.or_(
+                cls.created_at > created_at,
+                db.and_(cls.created_at == created_at, cls.id > id)
+            ))
+
+        if ward_id is not None:
+            query = query.filter(cls.ward_id == ward_id)
+
+        if district_id is not None:
+            query = query.filter(cls.district_id == district_id)
+
+        if created_from is not None:
+            query = query.filter(cls.created_at >= created_from)
+
+        if created_to is not None:
+            query = query.filter(cls.created_at < created_to)
+
+        if role_type_id is not None:
+            today = datetime.date.today()
+            query = query.filter(
+                Role.query.filter(Role.person_id == cls.id)
+                          .filter(Role.role_type_id == role_type_id)
+                          .filter(Role.starts_on <= today)
+                          .filter(db.or_(Role.ends_on == None, Role.ends_on >= today))
+                          .exists()
+            )
+
+        return query.order_by(cls.created_at, cls.id).limit(limit)
 
     @property
     def primary_email(self):
@@ -171,6 +293,74 @@ class Person(db.Model):
         return outer_wrapper
 
 
+class PersonIdSequence(db.Model):
+    """
+    The last id number handed out for each month's prefix
+    """
+
+    prefix = db.Column(db.String(3), primary_key=True)
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def allocate(cls, prefix, count=1):
+        """
+        Atomically take the next `count` numbers for a prefix, returning the first.
+        The numbers are taken in a short transaction of their own, so the counter
+        row is only locked for the update and not for the rest of the request
+        (e.g. while a password is hashed). Numbers taken by a transaction that
+        later rolls back are skipped, like a database sequence.
+        """
+        if db.engine.dialect.name == 'sqlite' and db.session.info.get('written'):
+            # SQLite locks the whole database for the session's writes, so
+            # another connection would wait on them: take the numbers here
+            return cls._take(db.session, prefix, count)
+
+        try:
+            with db.engine.begin() as connection:
+                return cls._take(connection, prefix, count)
+        except IntegrityError as e:
+            # Another registration created the row first
+            return cls.allocate(prefix, count)
+
+    @classmethod
+    def _take(cls, connection, prefix, count):
+        table  = cls.__table__
+        person = Person.__table__
+
+        result = connection.execute(
+            table.update()
+                 .where(table.c.prefix == prefix)
+                 .values(last_value=table.c.last_value + count)
+        )
+
+        if result.rowcount == 0:
+            # First id for this prefix: carry on from people who already have one
+            existing = connection.execute(
+                db.select([db.func.count()]).where(person.c.id.startswith(prefix))
+            ).scalar()
+
+            connection.execute(table.insert().values(prefix=prefix, last_value=existing + count))
+
+        last_value = connection.execute(
+            db.select([table.c.last_value]).where(table.c.prefix == prefix)
+        ).scalar()
+
+        return last_value - count + 1
+
+
+def _session_written(session, flush_context):
+    session.info['written'] = True
+
+
+def _session_ended(session):
+    session.info.pop('written', None)
+
+
+db.event.listen(Session, 'after_flush', _session_written)
+db.event.listen(Session, 'after_commit', _session_ended)
+db.event.listen(Session, 'after_rollback', _session_ended)
+
+
 class Address(db.Model):
     """
     Addresses
@@ -189,6 +379,7 @@ class Address(db.Model):
     district = db.Column(db.String(1024))
     city = db.Column(db.String(1024))
     post_code = db.Column(db.String(13))
+    geo_pending = db.Column(db.Boolean, nullable=False, default=True)
 
     def __init__(self, person, line_1, post_code, type):
         self.person = person
@@ -196,7 +387,16 @@ class Address(db.Model):
         self.post_code = post_code
         self.type = type
 
-        codes = post_code_check(self.post_code)
+        # Codes are filled in by hub.services.geo.enrich_addresses, unless
+        # this worker already knows them.
+        self.geo_pending = True
+
+        codes = cached_post_code(self.post_code)
+
+        if codes is MISSING:
+            return
+
+        self.geo_pending = False
 
         if codes is None:
             return
@@ -227,12 +427,23 @@ class EmailAddress(db.Model):
         'BACKUP'
     )
 
+    # Resolve chunks of this many emails per query
+    RESOLVE_CHUNK_SIZE = 500
+
     person_id = db.Column(db.String(10), db.ForeignKey('person.id'), primary_key=True)
     type_code = db.Column(db.String(10), primary_key=True)
     email = db.Column(db.String(1024), unique=True, nullable=False)
+    canonical_email = db.Column(db.String(1024), nullable=False)
     verified = db.Column(db.Boolean, nullable=False, default=False)
     hard_bounce = db.Column(db.Boolean, nullable=False, default=False)
 
+    # Covers lookups by email, so finding a person id never reads the table,
+    # and stops case variants of an address belonging to different people
+    __table_args__ = (
+        db.Index('ix_email_address_canonical_email', 'canonical_email', 'type_code', 'person_id'),
+        db.Index('uq_email_address_canonical_email', 'canonical_email', unique=True),
+    )
+
     def __init__(self, person, email, type_code='PRIMARY'):
         self.person = person
         self.email = email
@@ -244,6 +455,68 @@ class EmailAddress(db.Model):
         except:
             pass
 
+    @db.validates('email')
+    def validate_email(self, key, email):
+        canonical_email = None if email is None else normalise_email(email)
+
+        # Case variants are the same address, so they can't belong to anyone else
+        if canonical_email is not None and canonical_email != self.canonical_email:
+            with db.session.no_autoflush:
+                taken = db.session.query(EmailAddress.person_id) \
+                                  .filter(EmailAddress.canonical_email == canonical_email) \
+                                  .first()
+
+            if taken is not None:
+                raise ConflictError('email')
+
+        self.canonical_email = canonical_email
+        return email
+
+    @classmethod
+    def find(cls, email, type_code=None):
+        """Query for addresses matching email, whatever its case"""
+        query = cls.query.filter(cls.canonical_email == normalise_email(email))
+
+        if type_code is not None:
+            query = query.filter(cls.type_code == type_code)
+
+        return query
+
+    @classmethod
+    def resolve(cls, email, type_code='PRIMARY'):
+        """Get the id of the person with an email, or None"""
+        return db.session.query(cls.person_id) \
+                         .filter(cls.canonical_email == normalise_email(email)) \
+                         .filter(cls.type_code == type_code) \
+                         .limit(1) \
+                         .scalar()
+
+    @classmethod
+    def resolve_many(cls, emails, type_code=None):
+        """
+        Map emails to person ids, for any type of address unless type_code is given.
+        Emails nobody has are left out.
+        """
+        by_canonical = {}
+        for email in emails:
+            by_canonical.setdefault(normalise_email(email), []).append(email)
+
+        keys   = list(by_canonical)
+        result = {}
+
+        for i in range(0, len(keys), cls.RESOLVE_CHUNK_SIZE):
+            query = db.session.query(cls.canonical_email, cls.person_id) \
+                              .filter(cls.canonical_email.in_(keys[i:i + cls.RESOLVE_CHUNK_SIZE]))
+
+            if type_code is not None:
+                query = query.filter(cls.type_code == type_code)
+
+            for canonical_email, person_id in query:
+                for email in by_canonical[canonical_email]:
+                    result[email] = person_id
+
+        return result
+
     @property
     def type(self):
         return self.type_code.lower()
@@ -256,11 +529,7 @@ class EmailAddress(db.Model):
         self.type_code = code.upper()
 
     def verify(self, code):
-        test_token = self.email + str(code)
-        test_token = hashlib.sha512(test_token.encode('UTF-8')).hexdigest()
-        token = VerifyToken.query.get(test_token)
-
-        if token is None:
+        if not VerifyToken.check(self.email, code):
             return False
 
         self.verified = True
@@ -362,11 +631,106 @@ class PhoneNumber(db.Model):
 
 
 class VerifyToken(db.Model):
-    token = db.Column(db.String(300), primary_key=True)
+    """
+    A code emailed to check someone owns an address. Codes expire, a few
+    wrong guesses use them up, and only the latest few per address are kept.
+    """
+
+    TTL = datetime.timedelta(hours=1)
+    MAX_ATTEMPTS = 5
+    MAX_ACTIVE = 3
+
+    id         = db.Column(db.Integer, primary_key=True)
+    email      = db.Column(db.String(1024), nullable=False)
+    token      = db.Column(db.String(128), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    attempts   = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_verify_token_email_expires_at', 'email', 'expires_at'),
+    )
+
+    def __init__(self, email, code, attempts=0):
+        self.email      = normalise_email(email)
+        self.token      = self.hash(self.email, code)
+        self.created_at = datetime.datetime.now()
+        self.expires_at = self.created_at + self.TTL
+        self.attempts   = attempts
+
+    @staticmethod
+    def hash(email, code):
+        raw_token = email + str(code)
+        return hashlib.sha512(raw_token.encode('UTF-8')).hexdigest()
+
+    @classmethod
+    def active(cls, email):
+        """Query the tokens for an email that can still be used"""
+        return cls.query.filter(cls.email == normalise_email(email)) \
+                        .filter(cls.expires_at > datetime.datetime.now()) \
+                        .filter(cls.attempts < cls.MAX_ATTEMPTS)
+
+    @classmethod
+    def unexpired(cls, email):
+        """Query the tokens for an email that haven't expired, used up or not"""
+        return cls.query.filter(cls.email == normalise_email(email)) \
+                        .filter(cls.expires_at > datetime.datetime.now())
+
+    @classmethod
+    def issue(cls, email, code):
+        """
+        Make a token for a new code, dropping all but the newest few for the email.
+        Wrong guesses carry over from every unexpired token, used up ones
+        included, so asking for a new code doesn't reset them.
+        """
+        tokens = cls.unexpired(email).order_by(cls.created_at.desc()).all()
+
+        token = cls(email, code, max([t.attempts for t in tokens], default=0))
+        db.session.add(token)
+
+        for old in tokens[cls.MAX_ACTIVE - 1:]:
+            db.session.delete(old)
+
+        return token
+
+    @classmethod
+    def check(cls, email, code):
+        """
+        Check a code for an email. A right code uses up every token for the
+        email, a wrong one counts as an attempt against all of them.
+        """
+        email  = normalise_email(email)
+        tokens = cls.active(email).all()
+        token  = cls.hash(email, code)
+
+        if any(hmac.compare_digest(t.token, token) for t in tokens):
+            cls.query.filter(cls.email == email).delete(synchronize_session=False)
+            return True
+
+        for t in tokens:
+            t.attempts = t.attempts + 1
+
+        return False
+
+    @classmethod
+    def sweep(cls, batch_size=1000):
+        """
+        Delete expired tokens, a batch at a time. Returns how many.
+        Used up tokens are kept until they expire, as they hold the guess count.
+        """
+        deleted = 0
 
-    def __init__(self, user_id, code):
-        raw_token = user_id + str(code)
-        self.token = hashlib.sha512(raw_token.encode('UTF-8')).hexdigest()
+        while True:
+            ids = [id for id, in db.session.query(cls.id)
+                                         .filter(cls.expires_at <= datetime.datetime.now())
+                                         .limit(batch_size)]
+
+            if len(ids) == 0:
+                return deleted
+
+            cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
 
 
 class Role(db.Model):
@@ -389,7 +753,8 @@ class Role(db.Model):
             self.ends_on = starts_on + datetime.timedelta(days=days)
 
     def is_active(self):
-        return self.starts_on < datetime.date() < self.ends_on
+        today = datetime.date.today()
+        return self.starts_on <= today and (self.ends_on is None or today <= self.ends_on)
 
     @property
     def abilities(self):
@@ -412,7 +777,7 @@ class RoleType(db.Model):
     elected = db.Column(db.Boolean, nullable=False, default=False)
 
     rates = db.relationship('Rate', backref='role_type', lazy=False)
-    roles = db.relationship('Role', backref='type', lazy=False)
+    roles = db.relationship('Role', backref='type', lazy=True)
 
     def __init__(self, title, expires_after=None, auto_renews=False):
         self.title = title.title()
@@ -444,9 +809,41 @@ class Ability(db.Model):
         self.role_type_id = role.id
         self.key = key
 
-    def run_gate(self):
+    def run_gate(self, person, context=None):
         if self.gate_func is None:
             return True
 
-        person = self.role.person
-        return Gate.run(self)
+        return Gate.run(self.gate_func, person, context)
+
+
+watch_permissions(Person, Role, Ability)
+
+db.event.listen(Person, 'before_update', _bump_own_version)
+
+for model in (Address, PhoneNumber, EmailAddress, EmailSubscription, Role):
+    watch_person_versions(model)
+
+
+# Everything PersonSchema dumps
+register_profile('person.detail', lambda: [
+    db.selectinload(Person.addresses),
+    db.selectinload(Person.phone_numbers),
+    db.selectinload(Person.email_addresses),
+    db.selectinload(Person.email_sub),
+    db.selectinload(Person.roles),
+    db.selectinload(Person.payments),
+    db.selectinload(Person.emails_received),
+    db.selectinload(Person.emails_sent),
+])
+
+# Columns only, e.g. for names and ids. Touching a relationship raises,
+# rather than quietly running a query per row.
+register_profile('person.summary', lambda: [
+    db.raiseload('*'),
+])
+
+# Looking up a person by email to log in
+register_profile('email.login', lambda: [
+    db.joinedload(EmailAddress.person).raiseload('*'),
+    db.raiseload('*'),
+])
@@ -2,8 +2,10 @@ from markdown import markdown
 import chevron, datetime
 
 from hub.exts import db
-from hub.models.membership import Person, EmailSubscription, EmailAddress
+from hub.models.loading import profile
+from hub.models.membership import Person, EmailSubscription, EmailAddress, watch_person_versions
 from hub.services import email
+from hub.services.tasks import task
 
 
 email_recipients = db.Table('email_recipients', 
@@ -11,8 +13,31 @@ email_recipients = db.Table('email_recipients',
     db.Column('person_id', db.String(10), db.ForeignKey('person.id'), primary_key=True)
 )
 
+# Used in templates when an email has no sending person
+DEFAULT_SENDER = {
+    'first_name': 'Peterborough Tenants',
+    'last_name': 'Union',
+    'full_name': 'Peterborough Tenants Union'
+}
+
+
+class TemplateTags(dict):
+    """
+    Template data that renders every key as a tag, e.g. {{to.first_name}}.
+    Used to leave per-recipient fields for the email provider to fill in.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __missing__(self, key):
+        return '{{' + '{:s}.{:s}'.format(self.prefix, key) + '}}'
+
 
 class Email(db.Model):
+
+    # Sends to at least this many people use stored provider templates
+    BULK_THRESHOLD = 10
     
     id             = db.Column(db.Integer, primary_key=True)
     subject        = db.Column(db.String(1024))
@@ -41,15 +66,40 @@ class Email(db.Model):
         self.body       = body
         self.created_at = datetime.datetime.now()
 
-    def get_text(self, to, extra_data=None):
-        sender = self.sender
-        if sender is None:
-            sender = Person('Peterborough Tenants', 'Union')
+    def compile(self):
+        """
+        Parse the body once per email rather than once per recipient.
+        Markdown is converted once, before substitution, so rendering for each
+        recipient only has to fill in the mustache tags. Field values are
+        inserted as text: markdown in them isn't formatted.
+        Returns the (html, text) body templates.
+        """
+        compiled = getattr(self, '_compiled', None)
+
+        if compiled is None or compiled[0] != self.body:
+            compiled = (
+                self.body,
+                email.compile_template(markdown(self.body)),
+                email.compile_template(self.body)
+            )
+            self._compiled = compiled
+
+        return compiled[1], compiled[2]
 
+    def get_sender_data(self):
+        if self.sender is None:
+            return DEFAULT_SENDER
+
+        return {
+            **self.sender.__dict__,
+            'full_name': self.sender.full_name
+        }
+
+    def get_data(self, to, extra_data=None):
         data = {
             'email': self.__dict__,
-            'to': to.__dict__,
-            'from': sender.__dict__
+            'to': to if isinstance(to, dict) else to.__dict__,
+            'from': self.get_sender_data()
         }
 
         if extra_data is not None:
@@ -58,39 +108,27 @@ class Email(db.Model):
                 **extra_data
             }
 
-        text = chevron.render(
-            template=self.body, 
-            data=data
-        )
+        return data
 
-        return text
+    def get_text(self, to, extra_data=None):
+        html_body, text_body = self.compile()
+
+        return chevron.render(
+            template=text_body, 
+            data=self.get_data(to, extra_data)
+        )
 
     def get_html(self, to, extra_data=None):
         template = email.get_email_template('base.html.mustache')
+        html_body, text_body = self.compile()
 
-        sender = self.sender
-        if sender is None:
-            sender = Person('Peterborough Tenants', 'Union')
-
-        data = {
-            'email': self.__dict__,
-            'to': to.__dict__,
-            'from': sender.__dict__
-        }
-
-        if extra_data is not None:
-            data = {
-                **data,
-                **extra_data
-            }
+        data = self.get_data(to, extra_data)
 
         html = chevron.render(
-            template=self.body, 
+            template=html_body, 
             data=data
         )
 
-        html = markdown(html)
-
         main = chevron.render(
             template=template,
             data={
@@ -101,45 +139,241 @@ class Email(db.Model):
 
         return main
 
+    def get_bulk_template(self):
+        """
+        Render the email once, leaving recipient fields as {{to.*}} tags.
+        Returns (subject, html, text) and the set of recipient fields used.
+        """
+        html_body, text_body = self.compile()
+        template = email.get_email_template('base.html.mustache')
+
+        fields = set()
+        for tokens in (html_body, text_body, template):
+            for tag, key in tokens:
+                if tag != 'literal' and key.startswith('to.'):
+                    fields.add(key[3:])
+
+        data = self.get_data(TemplateTags('to'))
+
+        html = chevron.render(template=html_body, data=data)
+        html = chevron.render(template=template, data={'body': html, **data})
+        text = chevron.render(template=text_body, data=data)
+
+        return (self.subject, html, text), fields
+
+    def resolve_recipients(self, chunk_size=500):
+        """
+        Yield chunks of ready-to-send (person, address) pairs.
+
+        Primary addresses and subscriptions are resolved for the whole audience
+        with one query per chunk, paging through people by id.
+        """
+
+        query = db.session.query(Person, EmailAddress.email) \
+                          .join(EmailAddress, EmailAddress.person_id == Person.id) \
+                          .join(EmailSubscription, EmailSubscription.person_id == Person.id) \
+                          .filter(EmailAddress.type_code == 'PRIMARY') \
+                          .filter(EmailAddress.verified == True) \
+                          .filter(EmailAddress.hard_bounce != True) \
+                          .filter(EmailSubscription.type_code == self.type_code) \
+                          .options(*profile('person.summary'))
+
+        if not self.to_all_members:
+            query = query.join(email_recipients, email_recipients.c.person_id == Person.id) \
+                         .filter(email_recipients.c.email_id == self.id)
+
+        last_id = None
+        while True:
+            page = query
+            if last_id is not None:
+                page = page.filter(Person.id > last_id)
+
+            chunk = page.order_by(Person.id).limit(chunk_size).all()
+            if len(chunk) == 0:
+                return
+
+            yield chunk
+
+            if len(chunk) < chunk_size:
+                return
+
+            last_id = chunk[-1][0].id
+
+    def get_sender_name(self):
+        return '"{:s} (PeTU)"'.format(self.get_sender_data()['full_name'])
+
+    def get_message(self, recipient, address):
+        return {
+            'recipient': address,
+            'subject': self.subject,
+            'body_html': self.get_html(recipient),
+            'body_text': self.get_text(recipient),
+            'sender_name': self.get_sender_name()
+        }
+
+    def send_to(self, recipient, address):
+        """
+        Send to one address of a recipient, whether or not it's verified,
+        e.g. to verify it
+        """
+        email.send_email(**self.get_message(recipient, address))
+
     def send(self):
+        """
+        Send off-request. The email has to be committed first, so the task
+        can load it.
+        """
+        if self.status in ('SENT', 'DRAFT', 'DELETED', 'ARCHIVED'):
+            return
+
+        send_email_task.delay(self.id)
+
+    def dispatch(self):
+        """
+        Send to every recipient. Small audiences get an email each, larger
+        ones are split into chunks, each sent as its own task from a stored template.
+        Either way each recipient's result is recorded as an EmailDelivery.
+        """
         if self.status in ('SENT', 'DRAFT', 'DELETED', 'ARCHIVED'):
             return
 
-        if self.to_all_members:
-            subs = Person.query.all()
-        else:
-            subs = self.recipients
+        chunks = 0
+
+        for chunk in self.resolve_recipients():
+            if chunks == 0 and len(chunk) < self.BULK_THRESHOLD:
+                # Already off-request, so send now and keep the results
+                results = [email.deliver(**self.get_message(recipient, address)) for recipient, address in chunk]
+                self.record_deliveries(chunk, results)
+                break
+
+            chunks += 1
+            send_email_chunk.delay(self.id, chunks, [(recipient.id, address) for recipient, address in chunk])
+
+        self.status = 'SENT'
+
+    def send_chunk(self, number, recipients):
+        """
+        Send to a chunk of (person id, address) pairs with a template stored
+        for the chunk. Refused addresses are kept as dead letters.
+        """
+        people = Person.query.filter(Person.id.in_([person_id for person_id, address in recipients])) \
+                             .options(*profile('person.summary'))
+        people = {person.id: person for person in people}
+        chunk  = [(people[person_id], address) for person_id, address in recipients if person_id in people]
+
+        sender_name      = self.get_sender_name()
+        template, fields = self.get_bulk_template()
+        template_name    = 'hub-email-{:d}-{:d}'.format(self.id, number)
+
+        destinations = []
+        for recipient, address in chunk:
+            data = {f: str(getattr(recipient, f, None) or '') for f in fields}
+            destinations.append((address, {'to': data}))
+
+        email.create_template(template_name, *template)
 
-        sender = self.sender
-        if sender is None:
-            sender = Person('Peterborough Tenants', 'Union')
+        try:
+            results = email.send_bulk_email(template_name, destinations, sender_name)
+        finally:
+            email.delete_template(template_name)
 
-        for recipient in subs:
-            r_email = EmailAddress.query \
-                                  .with_parent(recipient) \
-                                  .filter(EmailAddress.type_code == 'PRIMARY') \
-                                  .filter(EmailAddress.verified == True) \
-                                  .filter(EmailAddress.hard_bounce != True) \
-                                  .first()
+        self.record_deliveries(chunk, results)
 
-            if r_email is None:
+        for (recipient, address), result in zip(chunk, results):
+            if result['status'] == 'Success':
                 continue
 
-            subscription = EmailSubscription.query \
-                                            .with_parent(recipient) \
-                                            .filter(EmailSubscription.type_code == self.type_code) \
-                                            .first()
-            if subscriptions is None:
-                continue 
-            
-            email.send_email(
-                recipient   = recipient.primary_email,
-                subject     = self.subject,
-                body_html   = self.get_html(recipient),
-                body_text   = self.get_text(recipient),
-                sender_name = '"{:s} (PeTU)"'.format(sender.full_name)
+            # A refused batch is 'Failed' with the SES error code, a refused address has its own status
+            failed = result['status'] == 'Failed'
+            email.dead_letter(
+                address, self.subject, self.get_html(recipient), self.get_text(recipient), sender_name,
+                result['error'] if failed else result['status'],
+                None if failed else result['error']
             )
 
-        self.status = 'SENT'
+    def record_deliveries(self, recipients, results):
+        """Store the provider's result for each (person, address) pair"""
+        now = datetime.datetime.now()
+
+        db.session.bulk_insert_mappings(EmailDelivery, [
+            {
+                'email_id': self.id,
+                'person_id': recipient.id,
+                'address': result['recipient'],
+                'status': result['status'].upper(),
+                'message_id': result['message_id'],
+                'error': result['error'],
+                'created_at': now
+            } for (recipient, address), result in zip(recipients, results)
+        ])
+
+
+class EmailDelivery(db.Model):
+    """
+    The result of sending an email to a single address
+    """
+
+    id         = db.Column(db.Integer, primary_key=True)
+    email_id   = db.Column(db.Integer, db.ForeignKey('email.id'), nullable=False)
+    person_id  = db.Column(db.String(10), db.ForeignKey('person.id'), nullable=False)
+    address    = db.Column(db.String(1024), nullable=False)
+    status     = db.Column(db.String(10), nullable=False)
+    message_id = db.Column(db.String(100), nullable=True)
+    error      = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    email = db.relationship('Email', backref=db.backref('deliveries', lazy=True), lazy=True)
+
+
+class DeadLetter(db.Model):
+    """
+    An email the provider refused, kept so it can be checked and resent
+    """
+
+    id            = db.Column(db.Integer, primary_key=True)
+    recipient     = db.Column(db.String(1024), nullable=False)
+    subject       = db.Column(db.String(1024))
+    body_html     = db.Column(db.Text)
+    body_text     = db.Column(db.Text)
+    sender_name   = db.Column(db.String(255), nullable=True)
+    error_code    = db.Column(db.String(100), nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    created_at    = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, recipient, subject, body_html, body_text, sender_name=None):
+        self.recipient   = recipient
+        self.subject     = subject
+        self.body_html   = body_html
+        self.body_text   = body_text
+        self.sender_name = sender_name
+        self.created_at  = datetime.datetime.now()
+
+
+@task
+def send_email_task(email_id):
+    message = Email.query.get(email_id)
+
+    if message is not None:
+        message.dispatch()
+        db.session.commit()
+
+
+@task
+def send_email_chunk(email_id, number, recipients):
+    message = Email.query.get(email_id)
+
+    if message is not None:
+        message.send_chunk(number, recipients)
+        db.session.commit()
+
+
+def _bump_recipient_version(email, person, initiator):
+    # New people get their first version when they're inserted
+    if db.inspect(person).persistent:
+        person.version = Person.version + 1
+
 
+watch_person_versions(Email, 'from_person_id')
 
+for event in ('append', 'remove'):
+    db.event.listen(Email.recipients, event, _bump_recipient_version)
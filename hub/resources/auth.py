@@ -1,11 +1,14 @@
 from flask import Response, request, current_app
 from flask_restful import Resource
-from passlib.hash import argon2
-from flask_jwt_extended import create_access_token, create_refresh_token
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token, get_raw_jwt, current_user
 
+from hub.exts import db
+from hub.models.loading import profile
 from hub.models.membership import Person, EmailAddress
+from hub.schemas.cache import dump
 from hub.schemas.membership import PersonSchema
-from hub.services.errors import InvalidValueError
+from hub.services.errors import InvalidValueError, TokenError
+from hub.services.revocation import revoke
 
 
 class LoginApi(Resource):
@@ -24,7 +27,7 @@ class LoginApi(Resource):
             raise InvalidValueError("password", "field is blank")
 
         person = None
-        email = EmailAddress.query.filter(EmailAddress.email == data["email"]).filter(EmailAddress.type_code == 'PRIMARY').first()
+        email = EmailAddress.find(data["email"], 'PRIMARY').options(*profile('email.login')).first()
 
         if email is not None:
             person = email.person
@@ -35,13 +38,51 @@ class LoginApi(Resource):
         if not person.check_password(data["password"]):
             raise InvalidValueError("email", "user not found")
 
+        # Save the hash if it was upgraded to the current policy
+        db.session.commit()
+
         token         = create_access_token(identity=person.id)
         refresh_token = create_refresh_token(identity=person.id)
 
         return {
             "auth_token": token,
             "refresh_token": refresh_token,
-            "person": PersonSchema(only=("full_name", "id")).dump(person)
+            "person": dump(PersonSchema, person, only=("full_name", "id"))
         }, 200
 
-        
\ No newline at end of file
+        
+
+
+class RefreshApi(Resource):
+
+    def post(self):
+        """
+        Exchange a refresh token for a new auth token.
+        The token is checked before the request, see middleware.get_user_from_token
+        """
+
+        return {
+            "auth_token": create_access_token(identity=current_user.id)
+        }, 200
+
+    def delete(self):
+        """
+        Revoke the refresh token, and the auth token if one is given, to log out
+        """
+
+        data = request.get_json(silent=True) or {}
+
+        if "auth_token" in data:
+            try:
+                token = decode_token(data["auth_token"])
+            except:
+                raise TokenError
+
+            if token.get(current_app.config["JWT_IDENTITY_CLAIM"]) != current_user.id:
+                raise TokenError
+
+            revoke(token)
+
+        revoke(get_raw_jwt())
+
+        return Response(status=204)
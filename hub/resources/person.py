@@ -2,29 +2,171 @@
 APIs for registering and becoming a member.
 """
 
-import datetime
+import base64, datetime, hashlib, io, json
 
-from flask import Response, request, current_app
+from flask import Response, request, current_app, stream_with_context
 from flask_restful import Resource
 from flask_jwt_extended import create_access_token
-from passlib.hash import argon2
 
 from hub.exts import db, jwt
+from hub.models.loading import profile
 from hub.models.membership import Person
+from hub.schemas.cache import get_schema, dump, requested_fields
 from hub.schemas.membership import PersonSchema
+from hub.services import export, importer
+from hub.services.compression import negotiate, strip_encoding
 from hub.services.permissions import Gate
-from hub.services.errors import NotFoundError
+from hub.services.errors import NotFoundError, InvalidValueError, PreconditionFailedError
+
+
+# Fields listed when ?fields= isn't given
+LIST_FIELDS = ('id', 'full_name', 'email')
+
+# Fields that need a relationship loaded, by field name
+FIELD_RELATIONSHIPS = {
+    'email': 'email_addresses',
+    'addresses': 'addresses',
+    'phone_numbers': 'phone_numbers',
+    'email_addresses': 'email_addresses',
+    'email_sub': 'email_sub',
+    'roles': 'roles',
+    'payments': 'payments',
+    'emails_received': 'emails_received',
+    'emails_sent': 'emails_sent',
+}
+
+
+def encode_cursor(person):
+    key = json.dumps([person.created_at.isoformat(), person.id])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.datetime.fromisoformat(created_at), id
+    except:
+        raise InvalidValueError('after', 'cursor not recognised')
+
+
+def parse_int(name, default=None):
+    value = request.args.get(name)
+
+    if value is None:
+        return default
+
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidValueError(name, 'must be a number')
+
+
+def parse_date(name):
+    value = request.args.get(name)
+
+    if value is None:
+        return None
+
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidValueError(name, 'must be an ISO 8601 date')
+
+
+def field_options(fields):
+    """Loader options for just the relationships the fields need"""
+    if fields is None:
+        return profile('person.detail')
+
+    options = [db.lazyload('*')]
+
+    for field in fields:
+        if field in FIELD_RELATIONSHIPS:
+            options.append(db.selectinload(getattr(Person, FIELD_RELATIONSHIPS[field])))
+
+    return options
+
+
+def person_etag(version, fields=None):
+    """
+    ETag for a person at a version, e.g. 'v3', or 'v3-1a2b3c4d' with ?fields=
+    """
+    if fields is None:
+        return 'v{:d}'.format(version)
+
+    key = ','.join(sorted(fields)).encode('utf-8')
+    return 'v{:d}-{:s}'.format(version, hashlib.sha1(key).hexdigest()[:8])
+
+
+def matches_version(etags, version):
+    """Check If-Match etags against a version, for any set of fields or encoding"""
+    if etags.star_tag:
+        return True
+
+    return any(tag.split('-')[0] == person_etag(version) for tag in etags)
+
+
+def matching_etag(etags, etag):
+    """The If-None-Match tag that matches etag, in any encoding, or None"""
+    if etags.star_tag:
+        return etag
+
+    for tag in etags:
+        if strip_encoding(tag) == etag:
+            return tag
+
+    return None
 
 
 class PeopleApi(Resource):
 
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 200
+
+    def get(self):
+        """
+        List people in signup order, a page at a time.
+        Pass the 'next' cursor back as ?after= to get the next page.
+        """
+
+        Gate.check(abilities=['people.list'])
+
+        limit = parse_int('limit', self.DEFAULT_LIMIT)
+
+        if limit < 1 or limit > self.MAX_LIMIT:
+            raise InvalidValueError('limit', 'must be between 1 and {:d}'.format(self.MAX_LIMIT))
+
+        after  = request.args.get('after')
+        fields = requested_fields(PersonSchema, LIST_FIELDS)
+
+        # Get one extra to see if there's another page
+        people = Person.page(
+            limit + 1,
+            after=None if after is None else decode_cursor(after),
+            ward_id=request.args.get('ward'),
+            district_id=request.args.get('district'),
+            role_type_id=parse_int('role_type'),
+            created_from=parse_date('created_from'),
+            created_to=parse_date('created_to')
+        ).options(*field_options(fields)).all()
+
+        next_cursor = None
+        if len(people) > limit:
+            people = people[:limit]
+            next_cursor = encode_cursor(people[-1])
+
+        return {
+            "people": dump(PersonSchema, people, only=fields, many=True),
+            "next": next_cursor
+        }
+
     def post(self):
         """
         Create a new person.
         Only requires a name but can handle various other properties.
         """
 
-        schema = PersonSchema()
+        schema = get_schema(PersonSchema)
 
         json_data = request.get_json()
         data = schema.load(json_data)
@@ -40,41 +182,116 @@ class PeopleApi(Resource):
         token = create_access_token(identity=person.id)
         
         return {
-            "person": schema.dump(person),
+            "person": dump(PersonSchema, person),
             "auth_code": token
         }
 
 
+class PeopleExportApi(Resource):
+
+    def get(self):
+        """
+        Stream every person as CSV or NDJSON (?format=ndjson).
+        Compressed on the fly if the client accepts it.
+        """
+
+        Gate.check(abilities=['people.export'])
+
+        format = request.args.get('format', 'csv')
+
+        if format not in export.FORMATS:
+            raise InvalidValueError('format', 'must be one of ' + ', '.join(export.FORMATS))
+
+        encoding = negotiate(request.accept_encodings)
+        filename = 'people-{:s}.{:s}'.format(datetime.date.today().isoformat(), format)
+
+        response = Response(
+            stream_with_context(export.export(format, encoding)),
+            mimetype=export.FORMATS[format],
+            headers={'Content-Disposition': 'attachment; filename=' + filename}
+        )
+
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+
+        return response
+
+
+class PeopleImportApi(Resource):
+
+    def post(self):
+        """
+        Import people from a CSV or NDJSON body (?format=ndjson).
+        Bad rows are reported and skipped, the rest are imported.
+        """
+
+        Gate.check(abilities=['people.import'])
+
+        format = request.args.get('format', 'csv')
+
+        if format not in importer.FORMATS:
+            raise InvalidValueError('format', 'must be one of ' + ', '.join(importer.FORMATS))
+
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        source = 'import:' + request.args.get('source', 'api')
+
+        return importer.import_people(stream, format, source).dump(), 200
+
+
 class PersonApi(Resource):
     
     def get(self, person_id):
         """
-        Get a single person
+        Get a single person, with just the fields given by ?fields= if set
         """
 
-        person = Person.query.get(person_id)
+        fields = requested_fields(PersonSchema)
 
-        gc = Gate.check('user_is_person', person=person)
+        # Check the version first, so an unchanged person is never loaded
+        probe = db.session.query(Person.id, Person.version).filter(Person.id == person_id).first()
 
-        if person is None:
+        Gate.check('user_is_person', person=probe)
+
+        if probe is None:
             raise NotFoundError(Person)
 
-        return {"person":PersonSchema().dump(person)}
+        etag    = person_etag(probe.version, fields)
+        headers = {
+            'ETag': '"{:s}"'.format(etag),
+            'Cache-Control': 'private, no-cache',
+            'Vary': 'Accept-Encoding'  # The ETag depends on the encoding
+        }
+
+        # Answer with the client's tag, which says which encoding it has
+        matched = matching_etag(request.if_none_match, etag)
+        if matched is not None:
+            return Response(status=304, headers={**headers, 'ETag': '"{:s}"'.format(matched)})
+
+        # Reloaded even if this session already has them, so the fields' loads apply
+        person = Person.query.options(*field_options(fields)).populate_existing().get(person_id)
+
+        return {"person":dump(PersonSchema, person, only=fields)}, 200, headers
 
 
     def patch(self, person_id):
         """
-        Update a person
+        Update a person.
+        Send If-Match with the ETag from a GET to only update an unchanged person.
         """
 
-        schema = PersonSchema()
-        person = Person.query.get(person_id)
+        schema = get_schema(PersonSchema)
+        person = Person.query.options(*profile('person.detail')).with_for_update(of=Person).get(person_id)
 
         Gate.check('user_is_person', person=person)
 
         if person is None:
             raise NotFoundError(Person)
 
+        # Optimistic locking: refuse if it changed since the client's copy
+        if request.if_match and not matches_version(request.if_match, person.version):
+            raise PreconditionFailedError()
+
         json_data = request.get_json()
         data = schema.load(json_data)
 
@@ -86,4 +303,4 @@ class PersonApi(Resource):
         except:
             raise Exception('There was a problem making the requested change')
 
-        return {"person":schema.dump(person)}
\ No newline at end of file
+        return {"person":dump(PersonSchema, person)}, 200, {'ETag': '"{:s}"'.format(person_etag(person.version))}
\ No newline at end of file
@@ -1,17 +1,15 @@
-import random, hashlib
-
 from flask import Response, request, current_app
 from flask_restful import Resource
 
 from hub.exts import db
-from hub.models.membership import EmailAddress, VerifyToken
-from hub.models.messaging import Email
+from hub.models.membership import EmailAddress
+from hub.services.verification import request_code
 
 
 class VerifyApi(Resource):
 
     def get(self, address_text):
-        addr = EmailAddress.query.filter(EmailAddress.email == address_text).first()
+        addr = EmailAddress.find(address_text).first()
 
         if addr is None:
             return {}, 404
@@ -19,19 +17,13 @@ class VerifyApi(Resource):
         if addr.verified:
             return {}, 204
         
-        code = random.randint(10000,99999)
-        token = VerifyToken(addr.email, code)
-
-        db.session.add(token)
-        db.session.commit()
-        
-        self._send_verification_email(addr, code)
+        request_code(addr)
 
         return {}, 204
 
 
     def post(self, address_text):
-        addr = EmailAddress.query.filter(EmailAddress.email == address_text).first()
+        addr = EmailAddress.find(address_text).first()
 
         if addr is None:
             return {}, 404
@@ -51,39 +43,14 @@ class VerifyApi(Resource):
                 "errors": ["Please provide a verification code."]
             }, 400
 
-        if not addr.verify(data["code"]):
+        verified = addr.verify(data["code"])
+
+        # Save the verification, or the wrong guess
+        db.session.commit()
+
+        if not verified:
              return {
                 "errors": ["That verification code was not recognised."]
             }, 400
 
-        #db.session.commit()
-
         return {}, 204
-
-
-    def _send_verification_email(self, address, code):
-        if address.verified:
-            return
-
-        email = Email(
-            None,
-            'Email verification code',
-            """Your email verification code is:
-
-# {:d}
-
-Enter this on the website to continue.
-
-If you were not expecting this code, please delete this email.""".format(code)
-        )
-
-        email.preview_text = 'Verification code is {:d}'.format(code)
-        email.type_code = 'TRN'
-
-        db.session.add(email)
-
-        email.recipients.append(address.person)
-
-        db.session.commit()
-
-        email.send()
\ No newline at end of file
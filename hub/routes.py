@@ -17,8 +17,11 @@ def load_routes(api):
 
     # Auth routes
     api.add_resource(auth.LoginApi, '/api/login')
+    api.add_resource(auth.RefreshApi, '/api/refresh', endpoint='refresh')
     api.add_resource(verify.VerifyApi, '/api/verify/<string:address_text>')
 
     # Person
     api.add_resource(person.PeopleApi, '/api/people')
+    api.add_resource(person.PeopleExportApi, '/api/people/export')
+    api.add_resource(person.PeopleImportApi, '/api/people/import')
     api.add_resource(person.PersonApi, '/api/people/<string:person_id>')
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+Shared schema instances.
+
+Building a schema works out its fields every time, so schemas are built once
+per worker for each set of fields and reused. Clients choose the fields, so
+only the SCHEMA_CACHE_SIZE most recently used sets are kept. Each one also gets a compiled
+dump: a flat list of getters and serialisers that skips marshmallow's
+per-call setup. Schemas with pre/post dump hooks use the normal dump.
+"""
+
+from operator import attrgetter
+
+from flask import current_app as app, request
+from marshmallow import missing
+from marshmallow.decorators import PRE_DUMP, POST_DUMP
+
+from hub.services.cache import LRUCache, MISSING
+from hub.services.errors import InvalidValueError
+
+
+# (schema, dump) by (schema class, only, exclude, other options), for this worker
+_schemas = None
+
+
+def get_cache():
+    global _schemas
+
+    if _schemas is None:
+        _schemas = LRUCache(app.config['SCHEMA_CACHE_SIZE'])
+
+    return _schemas
+
+
+def _key(schema_class, only, exclude, kwargs):
+    return (
+        schema_class,
+        None if only is None else frozenset(only),
+        frozenset(exclude),
+        tuple(sorted(kwargs.items()))
+    )
+
+
+def compile_dump(schema):
+    """
+    Make a function that dumps one object the way schema.dump would.
+    Fields that need the whole object or have a default fall back to the
+    field's own serialize.
+    """
+    if schema._has_processors(PRE_DUMP) or schema._has_processors(POST_DUMP):
+        return schema.dump
+
+    steps = []
+    for name, field in schema.dump_fields.items():
+        key = field.data_key or name
+
+        if field._CHECK_ATTRIBUTE and field.default is missing:
+            steps.append((key, attrgetter(field.attribute or name), field._serialize, name))
+        else:
+            steps.append((key, None, field, name))
+
+    accessor = schema.get_attribute
+
+    def dump(obj):
+        data = {}
+
+        for key, getter, serialize, name in steps:
+            if getter is None:
+                value = serialize.serialize(name, obj, accessor=accessor)
+
+                if value is not missing:
+                    data[key] = value
+
+                continue
+
+            try:
+                value = getter(obj)
+            except AttributeError:
+                continue
+
+            data[key] = serialize(value, name, obj)
+
+        return data
+
+    return dump
+
+
+def _get(schema_class, only=None, exclude=(), **kwargs):
+    key   = _key(schema_class, only, exclude, kwargs)
+    cache = get_cache()
+    found = cache.get(key)
+
+    if found is MISSING:
+        schema = schema_class(only=only, exclude=exclude, **kwargs)
+        found  = (schema, compile_dump(schema))
+        cache.set(key, found)
+
+    return found
+
+
+def get_schema(schema_class, only=None, exclude=(), **kwargs):
+    """Get the shared schema for a class and set of fields"""
+    return _get(schema_class, only, exclude, **kwargs)[0]
+
+
+def dump(schema_class, obj, only=None, exclude=(), many=False):
+    """Dump an object, or a list of them if many, with a shared schema"""
+    f = _get(schema_class, only, exclude)[1]
+
+    if many:
+        return [f(o) for o in obj]
+
+    return f(obj)
+
+
+def requested_fields(schema_class, default=None):
+    """
+    Get the fields asked for with ?fields=a,b,c, checked against the
+    fields the schema can dump. Returns default if none were asked for.
+    """
+    if 'fields' not in request.args:
+        return default
+
+    fields  = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+    allowed = get_schema(schema_class).dump_fields
+
+    for field in fields:
+        if field not in allowed:
+            raise InvalidValueError('fields', "'{:s}' is not a field".format(field))
+
+    return fields or default
@@ -13,7 +13,8 @@ class PersonSchema(ma.SQLAlchemyAutoSchema):
             "stripe_customer_id",
             "stripe_payment_id",
             "password_hash",
-            "created_at"
+            "created_at",
+            "version"
         )
 
     id              = ma.auto_field(dump_only=True)
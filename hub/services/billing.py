@@ -0,0 +1,349 @@
+"""
+Monthly billing.
+
+A run charges everyone with a priced role for the month, off-session,
+using the card saved against their Stripe customer:
+- members due are selected with one query and priced from the rate index
+- members with a card but no Stripe customer get one, and their ids are
+  committed a batch at a time
+- a PENDING Payment is written for each member BILLING_BATCH_SIZE at a time,
+  with one insert per batch, before Stripe is called
+- PaymentIntents are created by a pool of BILLING_WORKERS threads, within STRIPE_MAX_RATE
+- the batch's Payments are then updated with their intents, in one statement
+
+There is at most one Payment per person a month, so nobody is charged twice
+for a period. A run that dies part way can be started again, however much
+later: PENDING Payments are reconciled first, by looking for the intent
+they may have got in the customer's PaymentIntents, and only charged if
+there isn't one. Charges also carry an idempotency key made from the person
+and the month, for retries within Stripe's 24 hours.
+"""
+
+import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, ROUND_HALF_UP
+
+import stripe
+from flask import current_app as app
+
+from hub.exts import db
+from hub.models.finance import Payment
+from hub.models.membership import Person, Role, EmailAddress
+from hub.services import pricing
+from hub.services.payments import configure, dispatch, get_rate_limiter, customer_params, new_customer
+
+
+# Payment statuses for the PaymentIntent statuses a confirmed charge can end in
+STATUSES = {
+    'succeeded': 'SUCCEEDED',
+    'processing': 'PROCESSING',
+    'requires_action': 'REQUIRES_ACTION',
+    'requires_payment_method': 'FAILED',
+}
+
+Charge = namedtuple('Charge', ('person_id', 'customer_id', 'payment_method_id', 'amount'))
+
+
+class BillingResult:
+
+    def __init__(self, period):
+        self.period  = period
+        self.charged = 0
+        self.failed  = 0
+        self.errors  = []
+
+    def error(self, person_id, error):
+        self.errors.append({"person_id": person_id, "error": error})
+
+
+def billing_period(on):
+    return on.strftime('%Y-%m')
+
+
+def idempotency_key(person_id, period):
+    return 'billing-{:s}-{:s}'.format(person_id, period)
+
+
+def to_pence(amount):
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def due(on, period):
+    """
+    Everyone to charge for a period, with one query: people with a saved card,
+    a role active on the date, and no Payment for the period yet.
+    Their Stripe customer ids are None where they still need one.
+    Returns a Charge per person, for the total of their roles' prices.
+    """
+    rows = db.session.query(Person.id, Person.stripe_customer_id, Person.stripe_payment_id, Role.role_type_id) \
+                     .join(Role, Role.person_id == Person.id) \
+                     .outerjoin(Payment, db.and_(Payment.person_id == Person.id, Payment.period == period)) \
+                     .filter(Payment.id == None) \
+                     .filter(Person.stripe_payment_id != None) \
+                     .filter(Role.starts_on <= on) \
+                     .filter(db.or_(Role.ends_on == None, Role.ends_on >= on)) \
+                     .order_by(Person.id)
+
+    people = {}
+    for person_id, customer_id, payment_method_id, role_type_id in rows:
+        people.setdefault(person_id, (customer_id, payment_method_id, set()))[2].add(role_type_id)
+
+    prices = pricing.quote_many(
+        (((person_id, role_type_id), role_type_id, None)
+         for person_id, (customer_id, payment_method_id, role_type_ids) in people.items()
+         for role_type_id in role_type_ids),
+        on
+    )
+
+    charges = []
+    for person_id, (customer_id, payment_method_id, role_type_ids) in people.items():
+        amounts = [prices[(person_id, role_type_id)] for role_type_id in role_type_ids]
+        amount  = sum((amount for amount in amounts if amount is not None), Decimal(0))
+
+        if amount > 0:
+            charges.append(Charge(person_id, customer_id, payment_method_id, amount))
+
+    return charges
+
+
+def charge(item, period, limiter, retries, delay):
+    """
+    Create and confirm an off-session PaymentIntent for a Charge.
+    Returns (payment intent id, Payment status). Declines are a FAILED
+    Payment rather than an error, so they aren't retried in the same period.
+    Runs in a worker thread, so it doesn't touch the app or database.
+    """
+    try:
+        intent = dispatch(
+            lambda: stripe.PaymentIntent.create(
+                amount=to_pence(item.amount),
+                currency='gbp',
+                customer=item.customer_id,
+                payment_method=item.payment_method_id,
+                off_session=True,
+                confirm=True,
+                description='Membership {:s}'.format(period),
+                metadata={'person_id': item.person_id, 'period': period},
+                idempotency_key=idempotency_key(item.person_id, period)
+            ),
+            limiter, retries, delay
+        )
+    except stripe.error.CardError as e:
+        intent = getattr(e.error, 'payment_intent', None)
+        return (intent['id'] if intent else None), 'FAILED'
+
+    return intent['id'], STATUSES.get(intent['status'], 'CREATED')
+
+
+def find_charge(item, period, limiter, retries, delay):
+    """
+    Look for the PaymentIntent a Charge got in an earlier run, by its metadata.
+    Returns (payment intent id, Payment status), or None if it wasn't charged.
+    Runs in a worker thread, so it doesn't touch the app or database.
+    """
+    intents = dispatch(
+        lambda: stripe.PaymentIntent.list(customer=item.customer_id, limit=100),
+        limiter, retries, delay
+    )
+
+    for intent in intents.auto_paging_iter():
+        metadata = intent.get('metadata') or {}
+
+        if metadata.get('person_id') == item.person_id and metadata.get('period') == period:
+            return intent['id'], STATUSES.get(intent['status'], 'CREATED')
+
+    return None
+
+
+def reconcile(item, period, limiter, retries, delay):
+    """Settle a PENDING Payment left by an earlier run, charging it only if that run didn't"""
+    return find_charge(item, period, limiter, retries, delay) or charge(item, period, limiter, retries, delay)
+
+
+def pending(period):
+    """A Charge for each PENDING Payment in a period, left by a run that didn't finish"""
+    rows = db.session.query(Payment.person_id, Person.stripe_customer_id, Person.stripe_payment_id, Payment.amount) \
+                     .join(Person, Person.id == Payment.person_id) \
+                     .filter(Payment.period == period) \
+                     .filter(Payment.status == 'PENDING') \
+                     .order_by(Payment.person_id)
+
+    return [Charge(*row) for row in rows]
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def create_customers(batch, pool, limiter, retries, delay, result):
+    """
+    Create Stripe customers, with their card attached, for the Charges in a
+    batch that don't have one. The new ids are committed with one statement.
+    Returns the batch with customer ids filled in, less anyone whose create errored.
+    """
+    missing = [item.person_id for item in batch if item.customer_id is None]
+
+    if len(missing) == 0:
+        return batch
+
+    cards = {item.person_id: item.payment_method_id for item in batch}
+    rows  = db.session.query(Person.id, Person.first_name, Person.last_name, EmailAddress.email) \
+                      .outerjoin(EmailAddress, db.and_(EmailAddress.person_id == Person.id,
+                                                       EmailAddress.type_code == 'PRIMARY')) \
+                      .filter(Person.id.in_(missing))
+
+    futures = {
+        person_id: pool.submit(
+            new_customer,
+            customer_params(person_id, '{:s} {:s}'.format(first_name, last_name), email, cards[person_id]),
+            limiter, retries, delay
+        )
+        for person_id, first_name, last_name, email in rows
+    }
+
+    created = {}
+    for person_id, future in futures.items():
+        try:
+            created[person_id] = future.result()['id']
+        except stripe.error.StripeError as e:
+            app.logger.warning('Customer for %s failed: %s', person_id, e)
+            result.error(person_id, str(e))
+
+    if len(created) > 0:
+        person = Person.__table__
+
+        db.session.execute(
+            person.update()
+                  .where(person.c.id == db.bindparam('person_id'))
+                  .values(stripe_customer_id=db.bindparam('customer_id')),
+            [{'person_id': person_id, 'customer_id': customer_id} for person_id, customer_id in created.items()]
+        )
+        db.session.commit()
+
+    return [
+        item if item.customer_id is not None else item._replace(customer_id=created[item.person_id])
+        for item in batch if item.customer_id is not None or item.person_id in created
+    ]
+
+
+def _bump_versions(person_ids):
+    person = Person.__table__
+
+    db.session.execute(
+        person.update()
+              .where(person.c.id.in_(person_ids))
+              .values(version=person.c.version + 1)
+    )
+
+
+def begin(batch, period):
+    """
+    Write a PENDING Payment for each Charge in a batch, with one insert.
+    This is committed before Stripe is called, so a charge is never made
+    without a Payment to show for it.
+    """
+    now = datetime.datetime.now()
+
+    db.session.execute(Payment.__table__.insert().values([
+        {
+            'timestamp': now,
+            'person_id': item.person_id,
+            'amount': item.amount,
+            'status': 'PENDING',
+            'period': period
+        } for item in batch
+    ]))
+    _bump_versions([item.person_id for item in batch])
+    db.session.commit()
+
+
+def record(rows, period):
+    """Update a batch of PENDING Payments with their intents, in one statement"""
+    if len(rows) == 0:
+        return
+
+    payment = Payment.__table__
+
+    db.session.execute(
+        payment.update()
+               .where(payment.c.person_id == db.bindparam('_person_id'))
+               .where(payment.c.period == period)
+               .values(
+                   status=db.bindparam('_status'),
+                   payment_intent_id=db.bindparam('_intent_id'),
+                   timestamp=db.bindparam('_timestamp')
+               ),
+        rows
+    )
+    _bump_versions([row['_person_id'] for row in rows])
+    db.session.commit()
+
+
+def settle(batch, period, pool, func, limiter, retries, delay, result):
+    """
+    Run func (charge or reconcile) for a batch of Charges in the pool, and
+    record the outcomes. Charges that errored are left PENDING.
+    """
+    futures = [
+        (item, pool.submit(func, item, period, limiter, retries, delay))
+        for item in batch
+    ]
+
+    rows = []
+    for item, future in futures:
+        try:
+            intent_id, status = future.result()
+        except stripe.error.StripeError as e:
+            app.logger.warning('Charge for %s failed: %s', item.person_id, e)
+            result.error(item.person_id, str(e))
+            continue
+
+        if status == 'FAILED':
+            result.failed += 1
+        else:
+            result.charged += 1
+
+        rows.append({
+            '_person_id': item.person_id,
+            '_status': status,
+            '_intent_id': intent_id,
+            '_timestamp': datetime.datetime.now()
+        })
+
+    record(rows, period)
+
+
+def run(on=None, workers=None, batch_size=None):
+    """
+    Charge everyone due for the month a date falls in, today by default,
+    after settling any charges an earlier run for the month left PENDING.
+    Returns a BillingResult. Charges that errored are left PENDING, so the
+    next run settles them.
+    """
+    on         = pricing.to_date(on) or datetime.date.today()
+    period     = billing_period(on)
+    workers    = workers or app.config['BILLING_WORKERS']
+    batch_size = batch_size or app.config['BILLING_BATCH_SIZE']
+    retries    = app.config['STRIPE_MAX_RETRIES']
+    delay      = app.config['STRIPE_RETRY_DELAY']
+    limiter    = get_rate_limiter()
+    result     = BillingResult(period)
+
+    configure(app.config)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hub-billing') as pool:
+        for batch in _batches(pending(period), batch_size):
+            settle(batch, period, pool, reconcile, limiter, retries, delay, result)
+
+        for batch in _batches(due(on, period), batch_size):
+            batch = create_customers(batch, pool, limiter, retries, delay, result)
+
+            if len(batch) == 0:
+                continue
+
+            begin(batch, period)
+            settle(batch, period, pool, charge, limiter, retries, delay, result)
+
+    return result
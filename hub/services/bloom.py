@@ -0,0 +1,53 @@
+import hashlib, math, threading
+
+
+class BloomFilter:
+    """
+    A set that can say "definitely not here" or "probably here".
+    Sized for capacity items at roughly error_rate false positives.
+    Items can't be removed, so rebuild the filter to forget them.
+    """
+
+    def __init__(self, capacity=10000, error_rate=0.001):
+        self.capacity = max(1, capacity)
+        self.size     = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes   = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits     = bytearray((self.size + 7) // 8)
+        self.count    = 0
+        self.lock     = threading.Lock()
+
+    def _positions(self, item):
+        # Double hashing: two 64 bit halves of one digest make every position
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], 'little')
+        b = int.from_bytes(digest[8:], 'little') | 1
+
+        return [(a + i * b) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        """
+        Add an item, returning False if it was (probably) already here.
+        Only new items count towards capacity.
+        """
+        positions = self._positions(item)
+
+        with self.lock:
+            added = False
+            for p in positions:
+                mask = 1 << (p & 7)
+                if not self.bits[p >> 3] & mask:
+                    self.bits[p >> 3] |= mask
+                    added = True
+
+            if added:
+                self.count += 1
+
+        return added
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
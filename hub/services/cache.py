@@ -0,0 +1,54 @@
+import threading, time
+from collections import OrderedDict
+
+
+# Returned by LRUCache.get when a key is not cached, so None can be cached
+MISSING = object()
+
+
+class LRUCache:
+    """
+    A bounded least-recently-used cache with optional expiry (ttl, in seconds).
+    Caches are per process, so each uWSGI worker keeps its own.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self.data    = OrderedDict()
+        self.lock    = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            try:
+                expires, value = self.data[key]
+            except KeyError:
+                return default
+
+            if expires is not None and expires < time.monotonic():
+                del self.data[key]
+                return default
+
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+
+        with self.lock:
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
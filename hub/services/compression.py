@@ -0,0 +1,79 @@
+"""
+Response compression.
+
+gzip is always available. brotli is used when the brotli package is
+installed and the client accepts it.
+
+A compressed body is a different representation, so a strong ETag gets the
+encoding added, e.g. "v12" becomes "v12-gzip". Compare If-None-Match tags
+with strip_encoding to accept either.
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError as error:
+    brotli = None
+
+
+def negotiate(accept_encodings):
+    """Pick the best encoding the client accepts, or None"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+
+    if accept_encodings['gzip']:
+        return 'gzip'
+
+    return None
+
+
+ENCODINGS = ('br', 'gzip')
+
+
+def encode_etag(etag, encoding):
+    """Mark a strong ETag header value with the encoding of its body"""
+    if etag.startswith('W/') or not etag.endswith('"'):
+        return etag
+
+    return '{:s}-{:s}"'.format(etag[:-1], encoding)
+
+
+def strip_encoding(tag):
+    """The tag an encoded ETag was made from, e.g. 'v12' for 'v12-gzip'"""
+    for encoding in ENCODINGS:
+        if tag.endswith('-' + encoding):
+            return tag[:-len(encoding) - 1]
+
+    return tag
+
+
+def _gzip():
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def compress(data, encoding):
+    """Compress bytes with an encoding from negotiate"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+
+    compressor = _gzip()
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress a stream of bytes without holding more than a chunk of it"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = _gzip()
+        compress, finish = compressor.compress, compressor.flush
+
+    for chunk in chunks:
+        data = compress(chunk)
+
+        if data:
+            yield data
+
+    yield finish()
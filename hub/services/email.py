@@ -1,31 +1,157 @@
 from flask import current_app as app
 
-import boto3, os
+import boto3, json, os, random, time
 from botocore.exceptions import ClientError
+from chevron.tokenizer import tokenize
 
 from hub.exts import db
+from hub.services.ratelimit import TokenBucket
+from hub.services.tasks import task
+
+
+CHARSET = "UTF-8"
+
+# Most destinations SES accepts in a single bulk send
+BULK_DESTINATION_LIMIT = 50
+
+# Compiled templates, keyed by path: (mtime, tokens)
+_templates = {}
+
+# Error codes SES uses when we go over the send rate
+THROTTLING_CODES = ('Throttling', 'ThrottlingException', 'TooManyRequestsException')
+
+# SES client for this worker: ((pid, region, endpoint), client)
+_client = None
+
+# Send rate limiter for this worker: ((pid, rate), bucket)
+_bucket = None
+
+
+def compile_template(text):
+    """
+    Tokenize a mustache template once so it can be rendered many times.
+    The result can be passed to chevron.render in place of the template text.
+    """
+    return list(tokenize(text))
 
 
 def get_email_template(name):
+    """
+    Get the compiled tokens for an email template.
+    Templates are parsed once per process and only re-read when the file changes.
+    """
     path = app.config['TEMPLATE_PATH']
     path = os.path.join(path, 'email', name)
 
+    mtime  = os.stat(path).st_mtime_ns
+    cached = _templates.get(path)
+
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
     with open(path, 'r') as file:
-        return file.read()
+        tokens = compile_template(file.read())
 
+    _templates[path] = (mtime, tokens)
 
-def _send_email(recipient, subject, body_html, body_text, sender_name=None):
-    AWS_REGION = "eu-west-1"
-    CHARSET = "UTF-8"
-    client = boto3.client('ses', region_name=AWS_REGION)
+    return tokens
+
+
+def get_ses_client():
+    """
+    Get the SES client for this worker.
+    The client is built once per process (uWSGI forks workers, so the pid is
+    checked) and reused, keeping its connection pool warm between sends.
+    """
+    global _client
+
+    # A blank SES_ENDPOINT_URL, as example.env ships it, means AWS
+    endpoint_url = app.config['SES_ENDPOINT_URL'] or None
+    key = (os.getpid(), app.config['SES_REGION'], endpoint_url)
+
+    if _client is None or _client[0] != key:
+        client = boto3.client(
+            'ses',
+            region_name=app.config['SES_REGION'],
+            endpoint_url=endpoint_url
+        )
+        _client = (key, client)
+
+    return _client[1]
+
+
+def get_rate_limiter():
+    """
+    Get the token bucket that keeps this process within SES_MAX_SEND_RATE.
+    Under uWSGI all sends go through the spooler, so this is the only sender
+    as long as there is one spooler process (spooler-processes, 1 by default).
+    More would each send at the full rate: divide SES_MAX_SEND_RATE between them.
+    """
+    global _bucket
+
+    key = (os.getpid(), app.config['SES_MAX_SEND_RATE'])
+
+    if _bucket is None or _bucket[0] != key:
+        _bucket = (key, TokenBucket(app.config['SES_MAX_SEND_RATE']))
+
+    return _bucket[1]
+
+
+def _dispatch(call, messages=1):
+    """
+    Make an SES call once the rate limit allows it.
+    Throttled calls are retried with exponential backoff, other errors are raised.
+    """
+    retries = app.config['SES_MAX_RETRIES']
+    delay   = app.config['SES_RETRY_DELAY']
+
+    for attempt in range(retries + 1):
+        get_rate_limiter().take(messages)
+
+        try:
+            return call()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_CODES or attempt == retries:
+                raise
+
+            time.sleep(delay * (2 ** attempt) + random.uniform(0, delay))
+
+
+def dead_letter(recipient, subject, body_html, body_text, sender_name, error_code, error_message=None):
+    """
+    Keep a record of an email that could not be sent.
+    It's added to the session for the caller to commit.
+    """
+    from hub.models.messaging import DeadLetter
+
+    letter = DeadLetter(recipient, subject, body_html, body_text, sender_name)
+    letter.error_code    = error_code
+    letter.error_message = error_message
 
+    db.session.add(letter)
+
+    return letter
+
+
+def _get_source(sender_name=None):
     if sender_name is None:
         sender_name = 'Peterborough Tenants\'s Union'
 
+    return '{:s} <{:s}>'.format(sender_name, app.config['GLOBAL_FROM_ADDR'])
+
+
+def deliver(recipient, subject, body_html, body_text, sender_name=None):
+    """
+    Send an email now, within the SES send rate.
+    Returns a result like send_bulk_email's. A refused email is kept as a
+    dead letter, added to the session for the caller to commit.
+    """
+    client = get_ses_client()
+
     # Try to send the email.
     try:
         # Provide the contents of the email.
-        response = client.send_email(
+        response = _dispatch(lambda: client.send_email(
             Destination={
                 'ToAddresses': [
                     recipient,
@@ -47,22 +173,104 @@ def _send_email(recipient, subject, body_html, body_text, sender_name=None):
                     'Data': subject,
                 },
             },
-            Source='{:s} <{:s}>'.format(sender_name, app.config['GLOBAL_FROM_ADDR']),
-        )
+            Source=_get_source(sender_name),
+        ))
+    except ClientError as e:
+        dead_letter(recipient, subject, body_html, body_text, sender_name,
+                    e.response['Error']['Code'], e.response['Error'].get('Message'))
+
+        return {'recipient': recipient, 'status': 'Failed', 'message_id': None, 'error': e.response['Error']['Code']}
+
+    return {'recipient': recipient, 'status': 'Success', 'message_id': response.get('MessageId'), 'error': None}
+
+
+@task
+def _send_email(recipient, subject, body_html, body_text, sender_name=None):
+    result = deliver(recipient, subject, body_html, body_text, sender_name)
+
+    if result['status'] != 'Success':
+        db.session.commit()
+        return False
+
+    return result
+
+
+def create_template(name, subject, body_html, body_text):
+    """
+    Store a template with SES for use with send_bulk_email.
+    An existing template with the same name is replaced.
+    """
+    client   = get_ses_client()
+    template = {
+        'TemplateName': name,
+        'SubjectPart': subject,
+        'HtmlPart': body_html,
+        'TextPart': body_text
+    }
+
+    try:
+        client.create_template(Template=template)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'AlreadyExists':
+            raise
+        client.update_template(Template=template)
+
+
+def delete_template(name):
+    try:
+        get_ses_client().delete_template(TemplateName=name)
     except ClientError as e:
         return False
-    else:
-        return response
 
+    return True
+
+
+def send_bulk_email(template_name, destinations, sender_name=None, default_data=None):
+    """
+    Send a stored template to many recipients, BULK_DESTINATION_LIMIT per API call.
+
+    destinations is a list of (address, data) pairs, where data fills in the
+    template for that address. Returns one result per destination, in order:
+    {'recipient', 'status', 'message_id', 'error'}
+    """
+    client  = get_ses_client()
+    results = []
+
+    for i in range(0, len(destinations), BULK_DESTINATION_LIMIT):
+        batch = destinations[i:i + BULK_DESTINATION_LIMIT]
+
+        try:
+            response = _dispatch(lambda: client.send_bulk_templated_email(
+                Source=_get_source(sender_name),
+                Template=template_name,
+                DefaultTemplateData=json.dumps(default_data or {}),
+                Destinations=[
+                    {
+                        'Destination': {'ToAddresses': [address]},
+                        'ReplacementTemplateData': json.dumps(data)
+                    } for address, data in batch
+                ]
+            ), messages=len(batch))
+        except ClientError as e:
+            error = e.response['Error']['Code']
+            statuses = [{'Status': 'Failed', 'Error': error}] * len(batch)
+        else:
+            statuses = response['Status']
+
+        for (address, data), status in zip(batch, statuses):
+            results.append({
+                'recipient': address,
+                'status': status['Status'],
+                'message_id': status.get('MessageId'),
+                'error': status.get('Error')
+            })
 
-# Wrap send email function so it will run async when server is running under uWSGI.
-try:
-    from uwsgidecorators import *
+    return results
 
-    @spool(pass_arguments=True)
-    def send_email(*args, **kwargs):
-        _send_email(*args, **kwargs)
 
-except ImportError as error:
-    def send_email(*args, **kwargs):
-        _send_email(*args, **kwargs)
\ No newline at end of file
+def send_email(*args, **kwargs):
+    """
+    Send an email off-request, within the SES send rate.
+    Failures that retrying won't fix are kept as dead letters.
+    """
+    return _send_email.delay(*args, **kwargs)
@@ -59,4 +59,28 @@ class EmptyBodyError(Error):
     def __init__(self):
         self.code = 400
         self.message = "No values were supplied."
-        super().__init__(self.message, self.code)
\ No newline at end of file
+        super().__init__(self.message, self.code)
+
+
+class ServiceUnavailableError(Error):
+    """The server is too busy to handle the request right now."""
+    def __init__(self):
+        self.code = 503
+        self.message = "The server is busy, please try again shortly"
+        super().__init__(self.message, self.code)
+
+
+class PreconditionFailedError(Error):
+    """The resource changed since the client last saw it."""
+    def __init__(self):
+        self.code = 412
+        self.message = "This has been changed since you loaded it, please reload and try again"
+        super().__init__(self.message, self.code)
+
+
+class ConflictError(Error):
+    """The value is already taken by another record."""
+    def __init__(self, field):
+        self.code = 409
+        self.message = f"The supplied value for '{field}' is already in use"
+        super().__init__(self.message, self.code)
@@ -0,0 +1,128 @@
+"""
+Membership exports.
+
+Rows are read through a server-side cursor and written out as they arrive,
+so an export uses the same memory for ten members as for ten thousand.
+"""
+
+import csv, datetime, io, json
+
+from flask import current_app as app
+
+from hub.exts import db
+from hub.models.membership import Person, EmailAddress
+from hub.services.compression import compress_stream
+
+
+# Columns in an export, in order
+COLUMNS = (
+    'id',
+    'first_name',
+    'last_name',
+    'email',
+    'created_at',
+    'ward_id',
+    'district_id',
+    'constituency_id',
+)
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Rows written per chunk of output
+CHUNK_ROWS = 500
+
+
+def export_rows(batch_size=None):
+    """Yield every person as a tuple of COLUMNS, in signup order"""
+    batch_size = batch_size or app.config['EXPORT_BATCH_SIZE']
+
+    query = db.session.query(
+                Person.id,
+                Person.first_name,
+                Person.last_name,
+                EmailAddress.email,
+                Person.created_at,
+                Person.ward_id,
+                Person.district_id,
+                Person.constituency_id
+            ) \
+            .outerjoin(EmailAddress, db.and_(
+                EmailAddress.person_id == Person.id,
+                EmailAddress.type_code == 'PRIMARY'
+            )) \
+            .order_by(Person.created_at, Person.id) \
+            .yield_per(batch_size)
+
+    for row in query:
+        yield tuple(row)
+
+
+def _value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+
+    return value
+
+
+def _chunks(rows):
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) >= CHUNK_ROWS:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def write_csv(rows):
+    """Yield CSV text for rows, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(COLUMNS)
+
+    for chunk in _chunks(rows):
+        for row in chunk:
+            writer.writerow([_value(value) for value in row])
+
+        yield buffer.getvalue()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_ndjson(rows):
+    """Yield one JSON object per line for rows"""
+    for chunk in _chunks(rows):
+        yield ''.join(
+            json.dumps(dict(zip(COLUMNS, map(_value, row)))) + '\n' for row in chunk
+        )
+
+
+WRITERS = {
+    'csv': write_csv,
+    'ndjson': write_ndjson,
+}
+
+
+def export(format, encoding=None):
+    """
+    Yield the whole membership as bytes, compressed if an encoding
+    from hub.services.compression.negotiate is given
+    """
+    output = (text.encode('utf-8') for text in WRITERS[format](export_rows()))
+
+    if encoding is not None:
+        output = compress_stream(output, encoding)
+
+    return output
@@ -1,13 +1,42 @@
+from flask import current_app as app
+from sqlalchemy.exc import IntegrityError
+
 import requests
 import urllib
 
+from hub.exts import db
+from hub.services.cache import LRUCache, MISSING
+from hub.services.postcode_index import get_index
+from hub.services.tasks import periodic
 
-def post_code_check(post_code):
-    if post_code is None:
-        return
-        
+# Most postcodes postcodes.io accepts in one bulk lookup
+BULK_LOOKUP_LIMIT = 100
+
+
+# Lookups made by this worker, by normalised postcode
+_cache = None
+
+
+def normalise_post_code(post_code):
+    return ''.join(post_code.split()).upper()
+
+
+def get_cache():
+    global _cache
+
+    if _cache is None:
+        _cache = LRUCache(app.config['POSTCODE_CACHE_SIZE'], app.config['POSTCODE_CACHE_TTL'])
+
+    return _cache
+
+
+def fetch_post_code(post_code):
+    """Look up a postcode with postcodes.io"""
     pc = urllib.parse.quote(post_code)
-    r = requests.get('https://api.postcodes.io/postcodes/{:s}'.format(pc))
+    r = requests.get(
+        '{:s}/postcodes/{:s}'.format(app.config['POSTCODES_API_URL'], pc),
+        timeout=app.config['POSTCODES_API_TIMEOUT']
+    )
 
     if r.status_code == 404:
         return None
@@ -17,4 +46,183 @@ def post_code_check(post_code):
 
     json = r.json()
     return json['result']['codes']
-    
\ No newline at end of file
+
+
+def fetch_post_codes(post_codes):
+    """
+    Look up many postcodes with postcodes.io, BULK_LOOKUP_LIMIT per call.
+    Returns a dict of postcode to codes (None if not found).
+    """
+    post_codes = list(post_codes)
+    results    = {}
+
+    for i in range(0, len(post_codes), BULK_LOOKUP_LIMIT):
+        batch = post_codes[i:i + BULK_LOOKUP_LIMIT]
+        r = requests.post(
+            '{:s}/postcodes'.format(app.config['POSTCODES_API_URL']),
+            json={'postcodes': batch},
+            timeout=app.config['POSTCODES_API_TIMEOUT']
+        )
+
+        if r.status_code != 200:
+            raise Exception
+
+        for item in r.json()['result']:
+            result = item['result']
+            results[item['query']] = None if result is None else result['codes']
+
+    return results
+
+
+def _load_stored(key):
+    from hub.models.geo import PostCode
+
+    with db.session.no_autoflush:
+        stored = PostCode.query.get(key)
+
+    if stored is None or not stored.is_fresh(app.config['POSTCODE_CACHE_TTL']):
+        return stored, MISSING
+
+    return stored, stored.codes
+
+
+def _store(key, stored, codes):
+    from hub.models.geo import PostCode
+
+    if stored is not None:
+        stored.codes = codes
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(PostCode(key, codes))
+    except IntegrityError as e:
+        # Another worker stored it first
+        pass
+
+
+def cached_post_code(post_code):
+    """
+    Get the codes for a postcode if this worker already knows them.
+    Returns MISSING rather than doing any I/O.
+    """
+    if post_code is None:
+        return MISSING
+
+    index = get_index()
+    if index is not None and (codes := index.get(post_code, MISSING)) is not MISSING:
+        return codes
+
+    return get_cache().get(normalise_post_code(post_code))
+
+
+def post_code_check(post_code):
+    """
+    Get the ward, district and constituency codes for a postcode.
+    Answers come from the offline index, this worker's cache, then the
+    database, and only then the API.
+    """
+    if post_code is None:
+        return
+
+    index = get_index()
+    if index is not None and (codes := index.get(post_code, MISSING)) is not MISSING:
+        return codes
+
+    key   = normalise_post_code(post_code)
+    cache = get_cache()
+    codes = cache.get(key)
+
+    if codes is not MISSING:
+        return codes
+
+    stored, codes = _load_stored(key)
+
+    if codes is MISSING:
+        codes = fetch_post_code(post_code)
+        _store(key, stored, codes)
+
+    cache.set(key, codes)
+    return codes
+
+
+def post_code_check_many(post_codes):
+    """
+    Get the codes for many postcodes at once, keyed by normalised postcode.
+    Uses the same cache layers as post_code_check, with one query and as few
+    API calls as possible for the misses.
+    """
+    from hub.models.geo import PostCode
+
+    cache   = get_cache()
+    index   = get_index()
+    results = {}
+    missing = set()
+
+    for key in {normalise_post_code(pc) for pc in post_codes if pc is not None}:
+        codes = MISSING if index is None else index.get(key, MISSING)
+        if codes is MISSING:
+            codes = cache.get(key)
+        if codes is MISSING:
+            missing.add(key)
+        else:
+            results[key] = codes
+
+    if len(missing) == 0:
+        return results
+
+    ttl = app.config['POSTCODE_CACHE_TTL']
+    with db.session.no_autoflush:
+        stored = {row.post_code: row for row in PostCode.query.filter(PostCode.post_code.in_(missing))}
+
+    for key, row in stored.items():
+        if row.is_fresh(ttl):
+            results[key] = row.codes
+            cache.set(key, row.codes)
+            missing.discard(key)
+
+    fetched = fetch_post_codes(missing) if len(missing) > 0 else {}
+
+    for key in missing:
+        codes = fetched.get(key)
+        _store(key, stored.get(key), codes)
+        results[key] = codes
+        cache.set(key, codes)
+
+    return results
+
+
+@periodic('GEO_ENRICH_INTERVAL')
+def enrich_addresses(batch_size=BULK_LOOKUP_LIMIT):
+    """
+    Fill in ward, district and constituency for addresses saved with a
+    pending lookup, a batch at a time.
+    """
+    from hub.models.membership import Address, Person
+
+    while True:
+        pending = Address.query.filter(Address.geo_pending == True).limit(batch_size).all()
+
+        if len(pending) == 0:
+            return
+
+        codes  = post_code_check_many(a.post_code for a in pending)
+        people = {}
+
+        for address in pending:
+            found = None
+            if address.post_code is not None:
+                found = codes.get(normalise_post_code(address.post_code))
+
+            if found is not None:
+                people[address.person_id] = {
+                    'id': address.person_id,
+                    'ward_id': found['admin_ward'],
+                    'district_id': found['admin_district'],
+                    'constituency_id': found['parliamentary_constituency']
+                }
+
+            address.geo_pending = False
+
+        db.session.bulk_update_mappings(Person, list(people.values()))
+        db.session.commit()
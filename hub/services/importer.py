@@ -0,0 +1,242 @@
+"""
+Bulk membership imports.
+
+Rows are read a chunk at a time. Each chunk is validated with PersonSchema,
+gets a block of ids, and is written with one multi-row insert per table.
+Geocoding is left to enrich_addresses, which runs once the import is done.
+A bad row is reported and skipped, the rest of the file is still imported.
+"""
+
+import csv, datetime, json
+
+from flask import current_app as app
+from marshmallow import EXCLUDE
+from marshmallow.exceptions import ValidationError
+
+from hub.exts import db
+from hub.models.membership import Person, EmailAddress, EmailSubscription, Address, normalise_email
+from hub.schemas.cache import get_schema
+from hub.schemas.membership import PersonSchema
+from hub.services.geo import enrich_addresses
+
+
+# Person fields an import can set
+FIELDS = (
+    'first_name',
+    'last_name',
+    'email',
+    'date_of_birth',
+    'landlord',
+    'own_house',
+    'pays_rent',
+    'restricted_job',
+)
+
+# Columns for the person's home address
+ADDRESS_FIELDS = (
+    'line_1',
+    'district',
+    'city',
+    'post_code',
+)
+
+FORMATS = ('csv', 'ndjson')
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.imported = 0
+        self.errors   = []
+
+    def error(self, row, errors):
+        self.errors.append({"row": row, "errors": errors})
+
+    def dump(self):
+        return {
+            "imported": self.imported,
+            "failed": len(self.errors),
+            "errors": self.errors
+        }
+
+
+def read_csv(stream):
+    """Yield (row number, row) from CSV text, leaving out blank values"""
+    for number, row in enumerate(csv.DictReader(stream), start=1):
+        yield number, {key: value for key, value in row.items() if key and value not in (None, '')}
+
+
+def read_ndjson(stream):
+    """Yield (row number, row) from NDJSON text. Rows that don't parse are None"""
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+
+        yield number, row if isinstance(row, dict) else None
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+def _chunks(rows, size):
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def validate(chunk, result, seen_emails):
+    """
+    Validate a chunk of (row number, row), reporting bad rows on result.
+    Returns [(row number, person data, address data or None)] for the good ones.
+    """
+    schema = get_schema(PersonSchema, only=FIELDS, unknown=EXCLUDE)
+    valid  = []
+
+    for number, row in chunk:
+        if row is None:
+            result.error(number, {"_row": ["Not a JSON object."]})
+            continue
+
+        address = {key: row.pop(key) for key in ADDRESS_FIELDS if key in row}
+
+        try:
+            data   = schema.load(row)
+            errors = {}
+        except ValidationError as e:
+            data   = None
+            errors = e.messages
+
+        email = None
+        if 'email' in row and 'email' not in errors:
+            email = normalise_email(row['email'])
+
+            if email in seen_emails:
+                errors['email'] = ["Appears earlier in the file."]
+
+        if address and 'post_code' not in address:
+            errors['post_code'] = ["Missing data for required field."]
+
+        if errors:
+            result.error(number, errors)
+            continue
+
+        if email is not None:
+            seen_emails.add(email)
+
+        valid.append((number, data, address or None))
+
+    # Emails that already belong to someone
+    taken = EmailAddress.resolve_many(data['primary_email'] for n, data, a in valid if 'primary_email' in data)
+
+    for number, data, address in valid:
+        if data.get('primary_email') in taken:
+            result.error(number, {"email": ["Already belongs to a member."]})
+
+    return [row for row in valid if row[1].get('primary_email') not in taken]
+
+
+def write(rows, source):
+    """Insert a chunk of validated rows, one statement per table"""
+    now = datetime.datetime.now()
+    ids = Person.reserve_ids(len(rows))
+
+    people, emails, subscriptions, addresses = [], [], [], []
+    trn = EmailSubscription.SubscriptionType('TRN', EmailSubscription.TYPES)
+
+    for id, (number, data, address) in zip(ids, rows):
+        people.append({
+            'id': id,
+            'first_name': data['first_name'].title(),
+            'last_name': data['last_name'].title(),
+            'date_of_birth': data.get('date_of_birth'),
+            'created_at': now,
+            'landlord': data.get('landlord'),
+            'own_house': data.get('own_house'),
+            'pays_rent': data.get('pays_rent'),
+            'restricted_job': data.get('restricted_job'),
+        })
+
+        if 'primary_email' in data:
+            emails.append({
+                'person_id': id,
+                'type_code': 'PRIMARY',
+                'email': data['primary_email'],
+                'canonical_email': normalise_email(data['primary_email']),
+                'verified': False,
+                'hard_bounce': False,
+            })
+
+            subscriptions.append({
+                'person_id': id,
+                'type_code': trn.code,
+                'created_at': now,
+                'source': source,
+                'text_shown': trn.description,
+            })
+
+        if address is not None:
+            addresses.append({
+                'person_id': id,
+                'type_code': 'HOME',
+                'line_1': address.get('line_1'),
+                'district': address.get('district'),
+                'city': address.get('city'),
+                'post_code': address['post_code'],
+                'geo_pending': True,
+            })
+
+    for model, values in ((Person, people), (EmailAddress, emails),
+                          (EmailSubscription, subscriptions), (Address, addresses)):
+        if values:
+            db.session.execute(model.__table__.insert().values(values))
+
+
+def import_people(stream, format, source='import'):
+    """
+    Import people from a text stream of CSV or NDJSON.
+    source is recorded against their email consent.
+    """
+    result      = ImportResult()
+    seen_emails = set()
+    source      = source[:EmailSubscription.source.type.length]
+
+    for chunk in _chunks(READERS[format](stream), app.config['IMPORT_CHUNK_SIZE']):
+        rows = validate(chunk, result, seen_emails)
+
+        if len(rows) == 0:
+            continue
+
+        try:
+            write(rows, source)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('Import of rows %d to %d failed', chunk[0][0], chunk[-1][0])
+
+            for number, data, address in rows:
+                result.error(number, {"_row": ["Could not be saved."]})
+
+            continue
+
+        result.imported += len(rows)
+
+    if result.imported:
+        enrich_addresses.delay()
+
+    return result
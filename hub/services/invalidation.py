@@ -0,0 +1,117 @@
+"""
+Dropping cached authorisation data, in every worker.
+
+Writes are only forgotten once their transaction commits, so a rolled back
+write leaves the cache alone. Writes that other workers need to see also
+bump a named CacheStamp ('permissions' by default) in the same transaction.
+Each worker reads a stamp at most every CACHE_STAMP_INTERVAL seconds, and
+clears the caches registered for it when another worker has bumped it.
+"""
+
+import threading, time
+
+from flask import current_app as app
+from sqlalchemy.orm import Session
+
+from hub.exts import db
+
+
+STAMP = 'permissions'
+
+# Functions that clear a cache when a stamp changes, by stamp name
+_clearers = {}
+
+# The stamp versions this worker last saw, and when it looked
+_seen = {}
+_lock = threading.Lock()
+
+
+def on_stamp_change(clear, stamp=STAMP):
+    """Register a function to clear a cache when another worker bumps a stamp"""
+    _clearers.setdefault(stamp, []).append(clear)
+
+
+def forget_on_commit(target, forget, key=None):
+    """Call forget(key) once the transaction writing target commits"""
+    session = db.object_session(target)
+
+    if session is None:
+        forget(key)
+        return
+
+    session.info.setdefault('forget', set()).add((forget, key))
+
+
+def forget_pending(forget, session=None):
+    """
+    Whether the session has uncommitted writes that forget is waiting on.
+    Anything built from the database meanwhile may hold them, so shouldn't be cached.
+    """
+    session = session or db.session
+    return any(pending is forget for pending, key in session.info.get('forget', ()))
+
+
+def bump_on_commit(target, stamp=STAMP):
+    """Bump a stamp in the transaction writing target"""
+    session = db.object_session(target)
+
+    if session is not None:
+        session.info.setdefault('bump_stamps', set()).add(stamp)
+
+
+def _bump(connection, stamp):
+    from hub.models.auth import CacheStamp
+
+    table  = CacheStamp.__table__
+    result = connection.execute(
+        table.update().where(table.c.name == stamp).values(version=table.c.version + 1)
+    )
+
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(name=stamp, version=1))
+
+
+def check_stamp(stamp=STAMP):
+    """Clear the caches registered for a stamp if it has moved since this worker last looked"""
+    from hub.models.auth import CacheStamp
+
+    now = time.monotonic()
+
+    with _lock:
+        seen = _seen.setdefault(stamp, {'version': None, 'checked_at': None})
+
+        checked_at = seen['checked_at']
+        if checked_at is not None and now - checked_at < app.config['CACHE_STAMP_INTERVAL']:
+            return
+
+        seen['checked_at'] = now
+
+    version = db.session.query(CacheStamp.version).filter(CacheStamp.name == stamp).scalar()
+
+    with _lock:
+        changed = version != seen['version']
+        seen['version'] = version
+
+    if changed:
+        for clear in _clearers.get(stamp, ()):
+            clear()
+
+
+def _after_flush(session, flush_context):
+    for stamp in sorted(session.info.pop('bump_stamps', ())):
+        _bump(session.connection(), stamp)
+
+
+def _after_commit(session):
+    for forget, key in session.info.pop('forget', ()):
+        forget(key)
+
+
+def _after_rollback(session):
+    session.info.pop('forget', None)
+    session.info.pop('bump_stamps', None)
+
+
+db.event.listen(Session, 'after_flush', _after_flush)
+db.event.listen(Session, 'after_commit', _after_commit)
+db.event.listen(Session, 'after_rollback', _after_rollback)
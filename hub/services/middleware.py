@@ -3,22 +3,42 @@ Anything that is run before or after the flask request
 """
 
 from flask import g, current_app, request
-from flask_jwt_extended import verify_jwt_in_request_optional
+from flask_jwt_extended import (
+    verify_jwt_in_request_optional,
+    verify_jwt_refresh_token_in_request,
+    get_raw_jwt
+)
 from werkzeug.exceptions import HTTPException
 
 from hub.exts import jwt
-from hub.models.membership import Person
 from hub.services.errors import Error, TokenError
+from hub.services.principal import load_principal
+from hub.services.revocation import is_revoked
+
+
+# Endpoints that take a refresh token instead of an access token
+REFRESH_ENDPOINTS = ('refresh',)
 
 
 @jwt.user_loader_callback_loader
 def user_loader(identity):
-    return Person.query.get(identity)
+    return load_principal(identity)
 
 
-@current_app.before_request
 def get_user_from_token():
     try:
-        verify_jwt_in_request_optional()
+        if request.endpoint in REFRESH_ENDPOINTS:
+            verify_jwt_refresh_token_in_request()
+        else:
+            verify_jwt_in_request_optional()
     except:
-        raise TokenError
\ No newline at end of file
+        raise TokenError
+
+    token = get_raw_jwt()
+
+    if token and is_revoked(token):
+        raise TokenError
+
+
+def init_app(app):
+    app.before_request(get_user_from_token)
@@ -0,0 +1,137 @@
+"""
+Password hashing, off the request thread.
+
+Argon2 is deliberately slow, so hashing and verifying run on a small thread
+pool per worker (argon2 releases the GIL). Only a bounded number of jobs may
+wait for the pool; once it's full, callers get a 503 straight away instead
+of tying up the worker.
+
+The bound is per process, so it only sheds load when a process handles more
+requests at once than it allows: uWSGI has to run with `threads` above
+PASSWORD_WORKERS + PASSWORD_QUEUE_DEPTH. The rest of the threads are left
+for requests that don't hash.
+"""
+
+import os, statistics, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app as app
+from passlib.hash import argon2
+
+from hub.services.errors import ServiceUnavailableError
+
+
+# Pool for this worker: (pid, executor, slots)
+_pool = None
+_lock = threading.Lock()
+
+
+def get_hasher(config=None):
+    """The argon2 handler for the current ARGON2_* policy"""
+    config = config or app.config
+
+    return argon2.using(
+        rounds=config['ARGON2_TIME_COST'],
+        memory_cost=config['ARGON2_MEMORY_COST'],
+        parallelism=config['ARGON2_PARALLELISM']
+    )
+
+
+def _request_threads():
+    """Requests each uWSGI process handles at once, or None outside uWSGI"""
+    try:
+        import uwsgi
+    except ImportError as error:
+        return None
+
+    return int(uwsgi.opt.get('threads', 1))
+
+
+def _get_pool():
+    global _pool
+
+    with _lock:
+        if _pool is None or _pool[0] != os.getpid():
+            workers = app.config['PASSWORD_WORKERS']
+            slots   = workers + app.config['PASSWORD_QUEUE_DEPTH']
+            threads = _request_threads()
+
+            if threads is not None and slots >= threads:
+                app.logger.warning(
+                    'Password hashing allows %d jobs but uWSGI runs %d threads, so it will never shed load',
+                    slots, threads
+                )
+
+            _pool = (
+                os.getpid(),
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hub-passwords'),
+                threading.BoundedSemaphore(slots)
+            )
+
+    return _pool[1], _pool[2]
+
+
+def _run(f, *args):
+    executor, slots = _get_pool()
+
+    if not slots.acquire(blocking=False):
+        raise ServiceUnavailableError()
+
+    try:
+        future = executor.submit(f, *args)
+    except:
+        slots.release()
+        raise
+
+    future.add_done_callback(lambda f: slots.release())
+    return future.result()
+
+
+def hash_password(password_raw):
+    return _run(get_hasher().hash, password_raw)
+
+
+def verify_password(password_raw, password_hash):
+    """
+    Check a password against a stored hash.
+    Returns (matches, new_hash), where new_hash is set when the password
+    matched but the stored hash doesn't follow the current policy.
+    """
+    hasher = get_hasher()
+
+    def verify():
+        if not hasher.verify(password_raw, password_hash):
+            return False, None
+
+        if hasher.needs_update(password_hash):
+            return True, hasher.hash(password_raw)
+
+        return True, None
+
+    return _run(verify)
+
+
+def calibrate(target_ms, memory_cost, parallelism, samples=5):
+    """
+    Find the lowest time cost that takes at least target_ms to verify on this
+    host, with the given memory cost (KiB) and parallelism.
+    Returns (time_cost, median_ms).
+    """
+    time_cost = 1
+
+    while True:
+        hasher = argon2.using(rounds=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        hashed = hasher.hash('calibration')
+
+        timings = []
+        for i in range(samples):
+            start = time.perf_counter()
+            hasher.verify('calibration', hashed)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        median = statistics.median(timings)
+
+        if median >= target_ms:
+            return time_cost, median
+
+        time_cost += 1
@@ -1,45 +1,156 @@
+import os, random, time
+
 import stripe
 
 from flask import current_app as app
 from hub.exts import db
 from hub.models.finance import Payment
 from hub.models.membership import Person
+from hub.services.cache import LRUCache, MISSING
+from hub.services.ratelimit import TokenBucket
 
-stripe.api_key = app.config['STRIPE_SECRET']
 
+# Where the Stripe client sends requests unless STRIPE_API_BASE says otherwise
+DEFAULT_API_BASE = stripe.api_base
 
-def create_customer(person):
+
+def configure(config):
+    """Point the Stripe client at the configured key and API"""
+    stripe.api_key  = config['STRIPE_SECRET']
+    stripe.api_base = config['STRIPE_API_BASE'] or DEFAULT_API_BASE
+
+
+configure(app.config)
+
+# Errors worth another try. Writes carry idempotency keys, so retrying can't double up.
+RETRYABLE = (stripe.error.RateLimitError, stripe.error.APIConnectionError, stripe.error.APIError)
+
+# (pid, rate), token bucket for this process
+_bucket = None
+
+# Fetched customers for this worker, by customer id
+_customers = None
+
+
+def get_rate_limiter():
+    """Get the token bucket that keeps this process within STRIPE_MAX_RATE"""
+    global _bucket
+
+    key = (os.getpid(), app.config['STRIPE_MAX_RATE'])
+
+    if _bucket is None or _bucket[0] != key:
+        _bucket = (key, TokenBucket(app.config['STRIPE_MAX_RATE']))
+
+    return _bucket[1]
+
+
+def dispatch(call, limiter, retries=0, delay=0):
     """
-    Generate a Stripe customer to use for reccuring payments.
+    Make a Stripe call once the rate limit allows it.
+    Rate limited and connection errors are retried with exponential backoff,
+    other errors are raised. Needs no app context, so it can run in a worker thread.
     """
+    for attempt in range(retries + 1):
+        limiter.take()
 
-    if person.stripe_customer_id is not None:
-        return stripe.Customer.retrieve(person.stripe_customer_id)
-    
-    customer = stripe.Customer.create(
-        name=person.full_name,
-        description=person.id,
-        email=person.primary_email
-    )
+        try:
+            return call()
+        except RETRYABLE as e:
+            if attempt == retries:
+                raise
 
-    person.stripe_customer_id = customer['id']
-    db.session.commit()
+            time.sleep(delay * (2 ** attempt) + random.uniform(0, delay))
+
+
+def get_customer_cache():
+    global _customers
+
+    if _customers is None:
+        _customers = LRUCache(app.config['STRIPE_CUSTOMER_CACHE_SIZE'], app.config['STRIPE_CUSTOMER_CACHE_TTL'])
+
+    return _customers
+
+
+def customer_key(person_id):
+    return 'customer-{:s}'.format(person_id)
+
+
+def customer_params(person_id, name, email, payment_method_id=None):
+    """Customer.create arguments, attaching a saved card if given"""
+    params = {
+        'name': name,
+        'description': person_id,
+        'email': email,
+        'metadata': {'person_id': person_id},
+        'idempotency_key': customer_key(person_id)
+    }
+
+    if payment_method_id is not None:
+        params['payment_method'] = payment_method_id
+        params['invoice_settings'] = {'default_payment_method': payment_method_id}
+
+    return params
+
+
+def new_customer(params, limiter, retries=0, delay=0):
+    """Create a Stripe customer. Needs no app context, so it can run in a worker thread."""
+    return dispatch(lambda: stripe.Customer.create(**params), limiter, retries, delay)
+
+
+def get_customer(customer_id):
+    """A Stripe customer, fetched at most once per STRIPE_CUSTOMER_CACHE_TTL in this worker"""
+    cache    = get_customer_cache()
+    customer = cache.get(customer_id)
+
+    if customer is MISSING:
+        customer = dispatch(
+            lambda: stripe.Customer.retrieve(customer_id),
+            get_rate_limiter(), app.config['STRIPE_MAX_RETRIES'], app.config['STRIPE_RETRY_DELAY']
+        )
+        cache.set(customer_id, customer)
 
     return customer
 
 
+def get_customer_id(person):
+    """
+    A person's Stripe customer id. The stored id is trusted, so this only
+    calls Stripe when the customer has to be created. That isn't committed
+    here, it goes in with the caller's next commit.
+    """
+    if person.stripe_customer_id is None:
+        customer = new_customer(
+            customer_params(person.id, person.full_name, person.primary_email),
+            get_rate_limiter(), app.config['STRIPE_MAX_RETRIES'], app.config['STRIPE_RETRY_DELAY']
+        )
+        get_customer_cache().set(customer['id'], customer)
+
+        person.stripe_customer_id = customer['id']
+
+    return person.stripe_customer_id
+
+
+def create_customer(person):
+    """
+    Get the Stripe customer to use for reccuring payments, creating it if the
+    person doesn't have one yet. The new id is left for the caller to commit.
+    """
+    return get_customer(get_customer_id(person))
+
+
 def generate_payment(person, amount):
     """
     Generates a payment intent with Stripe and a local payment object.
     This function is only to be used with on-session payments to be
     collected immediately after card capture.
+    A new customer id is committed along with the payment.
     """
     
     intent = stripe.PaymentIntent.create(
         amount=amount,
         currency='gbp',
         setup_future_usage='off_session',
-        customer=person.stripe_customer_id
+        customer=get_customer_id(person)
     )
 
     payment = Payment(
@@ -1,7 +1,15 @@
+import datetime
+
 from flask import current_app as app
 from flask_jwt_extended import current_user
 from hub.exts import db
+from hub.services.cache import LRUCache, MISSING
 from hub.services.errors import UserNotAuthenticated, ActionNotAllowed
+from hub.services.invalidation import forget_on_commit, forget_pending, bump_on_commit, on_stamp_change, check_stamp
+
+
+# Permission indexes for this worker, by person id
+_cache = None
 
 
 class Gate:
@@ -14,10 +22,10 @@ class Gate:
         """
         gate = Gate()
 
-        try: 
+        try:
             id = current_user.id
             gate.person = current_user
-        except: 
+        except:
             raise UserNotAuthenticated
 
         if "roles" in kwargs:
@@ -30,29 +38,40 @@ class Gate:
         else:
             abilities = None
 
+        # With no gate functions, the abilities and roles decide
+        if len(args) == 0 and (roles is not None or abilities is not None):
+            if not person_has(gate.person, abilities, roles, kwargs):
+                raise ActionNotAllowed
+
+            return True
+
         try:
             for f in args:
                 if hasattr(gate, f) and callable(func := getattr(gate, f)):
                     func(**kwargs)
         except:
-            if not person_has(gate.person, abilities, roles) or (roles is None and abilities is None):
+            if (roles is None and abilities is None) or not person_has(gate.person, abilities, roles, kwargs):
                 raise ActionNotAllowed
-        
+
         return True
 
     @staticmethod
-    def run(ability, **kwargs):
+    def run(gate_func, user, context=None):
         """
         Run an ability's gate function, specified in it's table row.
+        Returns True if the gate lets the user through.
         """
         gate = Gate()
-        gate.ability = ability
-        gate.role    = ability.role
-        gate.person  = ability.role.person
+        gate.person = user
+
+        if hasattr(gate, gate_func) and callable(func := getattr(gate, gate_func)):
+            try:
+                func(**(context or {}))
+            except ActionNotAllowed:
+                return False
+
+            return True
 
-        if hasattr(gate, ability.gate_func) and callable(func := getattr(gate, ability.gate_func)):
-            return func(**kwargs)
-        
         return False
 
     def user_logged_on(self, **kwargs):
@@ -68,29 +87,163 @@ class Gate:
             raise ActionNotAllowed
 
 
-def person_has(person, abilities, roles):
-    can_user = False
+class PermissionIndex:
+    """
+    Everything a person is allowed to do today: the ids of their active role
+    types, and their ability keys mapped to the gate functions guarding them
+    (None means no gate).
+    """
+
+    def __init__(self, person_id, role_type_ids, abilities, on):
+        self.person_id     = person_id
+        self.role_type_ids = role_type_ids
+        self.abilities     = abilities
+        self.on            = on
+
+    def has_role(self, role_type):
+        return getattr(role_type, 'id', role_type) in self.role_type_ids
+
+    def can(self, key, user=None, context=None):
+        """
+        Check an ability. Gate functions only run when every role granting
+        the ability has one.
+        """
+        gates = self.abilities.get(key)
+
+        if gates is None:
+            return False
+
+        if None in gates:
+            return True
+
+        return any(Gate.run(gate_func, user, context) for gate_func in gates)
+
+
+def get_cache():
+    global _cache
+
+    if _cache is None:
+        _cache = LRUCache(app.config['PERMISSION_CACHE_SIZE'], app.config['PERMISSION_CACHE_TTL'])
+
+    return _cache
+
+
+def _build_index(person_id, today):
+    from hub.models.membership import Role, Ability
+
+    rows = db.session.query(Role.role_type_id, Ability.key, Ability.gate_func) \
+                     .outerjoin(Ability, Ability.role_type_id == Role.role_type_id) \
+                     .filter(Role.person_id == person_id) \
+                     .filter(Role.starts_on <= today) \
+                     .filter(db.or_(Role.ends_on == None, Role.ends_on >= today)) \
+                     .all()
+
+    abilities = {}
+    for role_type_id, key, gate_func in rows:
+        if key is not None:
+            abilities.setdefault(key, set()).add(gate_func)
+
+    return PermissionIndex(
+        person_id,
+        frozenset(row.role_type_id for row in rows),
+        {key: frozenset(gates) for key, gates in abilities.items()},
+        today
+    )
+
+
+def get_permissions(person_id):
+    """
+    Get the permission index for a person, built with one query and cached
+    in this worker until their roles or any abilities change, here or in
+    another worker.
+    """
+    check_stamp()
+
+    today = datetime.date.today()
+    cache = get_cache()
+    index = cache.get(person_id)
+
+    if index is MISSING or index.on != today:
+        index = _build_index(person_id, today)
+
+        # Built from writes that haven't committed, and may yet roll back
+        if not (forget_pending(_forget) or forget_pending(_clear)):
+            cache.set(person_id, index)
+
+    return index
+
+
+def _forget(person_id):
+    if _cache is not None:
+        _cache.pop(person_id)
+
+
+def _clear(key=None):
+    if _cache is not None:
+        _cache.clear()
+
+
+def _forget_person(mapper, connection, target):
+    forget_on_commit(target, _forget, target.id)
+
+
+def _forget_deleted_person(mapper, connection, target):
+    forget_on_commit(target, _forget, target.id)
+    bump_on_commit(target)
+
+
+def _forget_role(mapper, connection, target):
+    forget_on_commit(target, _forget, target.person_id)
+    bump_on_commit(target)
+
+
+def _forget_all(mapper, connection, target):
+    forget_on_commit(target, _clear)
+    bump_on_commit(target)
+
+
+def watch_permissions(person_model, role_model, ability_model):
+    """
+    Drop cached indexes when people, roles or abilities are written: here
+    once the write commits, and in other workers when they next check the stamp
+    """
+    db.event.listen(person_model, 'after_insert', _forget_person)
+    db.event.listen(person_model, 'after_delete', _forget_deleted_person)
+
+    for event in ('after_insert', 'after_update', 'after_delete'):
+        db.event.listen(role_model, event, _forget_role)
+        db.event.listen(ability_model, event, _forget_all)
+
+
+on_stamp_change(_clear)
+
+
+def _check_iterable(values, name):
+    try:
+        iter(values)
+    except TypeError:
+        raise ValueError("{:s} must be None, list or tuple".format(name))
+
+
+def person_has(person, abilities, roles, context=None):
+    """
+    Check whether a person has any of the abilities or role types given.
+    context is passed to the gate functions of abilities that have one.
+    """
+    index = get_permissions(person.id)
 
     if abilities is not None:
-        pa = []
-        for pr in person.roles:
-            pa.append(*pr.abilities)
+        _check_iterable(abilities, "abilities")
+
+        for a in abilities:
+            if index.can(a, person, context):
+                return True
 
-        try:
-            i = iter(abilities)
-            for a in abilities:
-                if a in pa and pa.run_gate():
-                    can_user = True
-        except:
-            raise ValueError("abilities must be None, list or tuple")
-    
     if roles is not None:
-        try:
-            i = iter(roles)
-            for r in roles:
-                if r in person.roles:
-                    can_user = True
-        except:
-            raise ValueError("roles must be None, list or tuple")
+        _check_iterable(roles, "roles")
+
+        for r in roles:
+            if index.has_role(r):
+                return True
 
-    return can_user
+    return False
@@ -0,0 +1,162 @@
+"""
+An offline postcode index, built from an ONS Postcode Directory CSV.
+
+Records are fixed width and sorted by normalised postcode, so lookups are a
+binary search over a memory-mapped file. The file is opened read-only and
+its pages are shared between every worker on the host.
+
+$ flask geo load-directory ONSPD.csv --prefix PE
+"""
+
+import csv, mmap, os, struct
+
+from flask import current_app as app
+
+
+MAGIC = b'HUBPCIX1'
+HEADER = struct.Struct('<8sQ')
+
+KEY_LENGTH  = 7
+CODE_LENGTH = 9
+RECORD_LENGTH = KEY_LENGTH + 3 * CODE_LENGTH
+
+# Index for this worker: ((pid, path), index)
+_index = None
+
+
+def _key(post_code):
+    return ''.join(post_code.split()).upper().encode('ascii', 'replace')
+
+
+class PostCodeIndex:
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count = HEADER.unpack_from(self.map, 0)
+
+        if magic != MAGIC or len(self.map) != HEADER.size + self.count * RECORD_LENGTH:
+            raise ValueError('{:s} is not a postcode index'.format(path))
+
+    def __len__(self):
+        return self.count
+
+    def _key_at(self, i):
+        start = HEADER.size + i * RECORD_LENGTH
+        return self.map[start:start + KEY_LENGTH]
+
+    def find(self, post_code):
+        """Get the record number for a postcode, or None"""
+        key = _key(post_code)
+        if len(key) > KEY_LENGTH:
+            return None
+
+        key = key.ljust(KEY_LENGTH)
+        low, high = 0, self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.count and self._key_at(low) == key:
+            return low
+
+        return None
+
+    def __contains__(self, post_code):
+        return self.find(post_code) is not None
+
+    def get(self, post_code, default=None):
+        """Get the codes for a postcode, in the same shape as postcodes.io"""
+        i = self.find(post_code)
+        if i is None:
+            return default
+
+        start = HEADER.size + i * RECORD_LENGTH + KEY_LENGTH
+        codes = [
+            self.map[start + n * CODE_LENGTH:start + (n + 1) * CODE_LENGTH].decode('ascii').strip() or None
+            for n in range(3)
+        ]
+
+        return {
+            'admin_ward': codes[0],
+            'admin_district': codes[1],
+            'parliamentary_constituency': codes[2]
+        }
+
+
+def build_index(records, path):
+    """
+    Write an index from (postcode, ward, district, constituency) tuples.
+    The file is replaced atomically, so workers reading the old one are unaffected.
+    """
+    rows = {}
+    for post_code, ward, district, constituency in records:
+        key = _key(post_code)
+        if len(key) > KEY_LENGTH:
+            continue
+
+        rows[key] = b''.join(
+            (code or '').encode('ascii', 'replace')[:CODE_LENGTH].ljust(CODE_LENGTH)
+            for code in (ward, district, constituency)
+        )
+
+    temp_path = '{:s}.tmp'.format(path)
+
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(rows)))
+        for key in sorted(rows):
+            file.write(key.ljust(KEY_LENGTH))
+            file.write(rows[key])
+
+    os.replace(temp_path, path)
+
+    return len(rows)
+
+
+def load_directory(csv_path, path, prefixes=None):
+    """
+    Build an index from an ONS Postcode Directory CSV, using the pcds (postcode),
+    osward, oslaua and pcon columns.
+    Terminated postcodes are skipped, and prefixes limits it to matching postcodes.
+    """
+    prefixes = tuple(p.upper() for p in prefixes) if prefixes else None
+
+    def records():
+        with open(csv_path, newline='', encoding='utf-8-sig') as file:
+            for row in csv.DictReader(file):
+                if row.get('doterm'):
+                    continue
+
+                post_code = row['pcds'] or row.get('pcd', '')
+                if prefixes is not None and not post_code.upper().startswith(prefixes):
+                    continue
+
+                yield post_code, row.get('osward'), row.get('oslaua'), row.get('pcon')
+
+    return build_index(records(), path)
+
+
+def get_index():
+    """Get this worker's index, or None when POSTCODE_INDEX_PATH isn't set up"""
+    global _index
+
+    path = app.config['POSTCODE_INDEX_PATH']
+    if not path:
+        return None
+
+    key = (os.getpid(), path)
+
+    if _index is None or _index[0] != key:
+        if not os.path.exists(path):
+            return None
+
+        _index = (key, PostCodeIndex(path))
+
+    return _index[1]
@@ -0,0 +1,245 @@
+"""
+Membership pricing.
+
+Every rate and band is loaded once per worker into an interval index, so
+pricing a role type on a date is a couple of bisects rather than queries.
+The index is dropped once a write to a rate or band commits, here and, via
+the 'prices' cache stamp, in other workers when they next check it. It is
+also rebuilt every PRICING_INDEX_TTL seconds regardless.
+
+Rates and bands are in effect from starts_on up to, but not including,
+ends_on. Amounts are Decimals throughout.
+"""
+
+import bisect, datetime, threading, time
+from decimal import Decimal
+
+from flask import current_app as app
+
+from hub.exts import db
+from hub.services.invalidation import forget_on_commit, forget_pending, bump_on_commit, on_stamp_change, check_stamp
+
+
+STAMP = 'prices'
+
+# The index for this worker
+_index = None
+_lock = threading.Lock()
+
+
+def to_decimal(value):
+    if value is None:
+        return Decimal(0)
+
+    if isinstance(value, Decimal):
+        return value
+
+    # Via str, so 0.1 is 0.1 rather than the float nearest to it
+    return Decimal(str(value))
+
+
+def to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+
+    return value
+
+
+def in_effect(starts_on, ends_on, on=None):
+    """Check whether [starts_on, ends_on) covers a date, today by default"""
+    on = to_date(on) or datetime.date.today()
+
+    if starts_on is None or to_date(starts_on) > on:
+        return False
+
+    return ends_on is None or to_date(ends_on) > on
+
+
+def rate_amount(amount, multiplier, charge):
+    return to_decimal(amount) * to_decimal(multiplier) + to_decimal(charge)
+
+
+def band_amount(amount, multiplier, charge, band_multiplier):
+    return to_decimal(amount) * to_decimal(band_multiplier) * to_decimal(multiplier) + to_decimal(charge)
+
+
+class Intervals:
+    """Values with [starts_on, ends_on) periods, found by date"""
+
+    def __init__(self, items):
+        # (starts_on, ends_on, value), latest start last
+        self.items  = sorted(items, key=lambda item: item[0])
+        self.starts = [item[0] for item in self.items]
+
+    def at(self, on):
+        """The value in effect on a date, preferring the one that started latest"""
+        i = bisect.bisect_right(self.starts, on)
+
+        while i > 0:
+            i -= 1
+            starts_on, ends_on, value = self.items[i]
+
+            if ends_on is None or ends_on > on:
+                return value
+
+        return None
+
+
+class RatePrice:
+
+    def __init__(self, amount, multiplier, charge, bands):
+        self.amount     = to_decimal(amount)
+        self.multiplier = to_decimal(multiplier)
+        self.charge     = to_decimal(charge)
+        self.bands      = bands  # Intervals of band multipliers, by band code
+
+    @property
+    def net_amount(self):
+        return rate_amount(self.amount, self.multiplier, self.charge)
+
+    def band_amount(self, code, on):
+        intervals = self.bands.get(code)
+        band_multiplier = None if intervals is None else intervals.at(on)
+
+        if band_multiplier is None:
+            return None
+
+        return band_amount(self.amount, self.multiplier, self.charge, band_multiplier)
+
+
+class PriceIndex:
+
+    def __init__(self, rates, built_at):
+        self.rates    = rates  # Intervals of RatePrice, by role type id
+        self.built_at = built_at
+
+    def quote(self, role_type_id, band_code=None, on=None):
+        """
+        The price of a role type on a date, or None if it has no rate then.
+        With a band code, None if that band isn't in effect either.
+        """
+        on        = to_date(on) or datetime.date.today()
+        intervals = self.rates.get(role_type_id)
+        rate      = None if intervals is None else intervals.at(on)
+
+        if rate is None:
+            return None
+
+        if band_code is None:
+            return rate.net_amount
+
+        return rate.band_amount(str(band_code).upper(), on)
+
+
+def _build_index():
+    from hub.models.finance import Rate, Band
+
+    bands = {}
+    for rate_id, code, multiplier, starts_on, ends_on in db.session.query(
+            Band.rate_id, Band.code, Band.multiplier, Band.starts_on, Band.ends_on):
+        if starts_on is None:
+            continue
+
+        bands.setdefault(rate_id, {}).setdefault(code, []).append(
+            (to_date(starts_on), to_date(ends_on), to_decimal(multiplier))
+        )
+
+    rates = {}
+    for rate in db.session.query(Rate.id, Rate.role_type_id, Rate.starts_on, Rate.ends_on,
+                                 Rate.amount, Rate.multiplier, Rate.charge):
+        price = RatePrice(
+            rate.amount,
+            rate.multiplier,
+            rate.charge,
+            {code: Intervals(items) for code, items in bands.get(rate.id, {}).items()}
+        )
+
+        rates.setdefault(rate.role_type_id, []).append(
+            (to_date(rate.starts_on), to_date(rate.ends_on), price)
+        )
+
+    return PriceIndex(
+        {role_type_id: Intervals(items) for role_type_id, items in rates.items()},
+        time.monotonic()
+    )
+
+
+def get_index():
+    global _index
+
+    check_stamp(STAMP)
+
+    with _lock:
+        index = _index
+
+    if index is None or time.monotonic() - index.built_at > app.config['PRICING_INDEX_TTL']:
+        index = _build_index()
+
+        # Built from writes that haven't committed, and may yet roll back
+        if forget_pending(_forget):
+            return index
+
+        with _lock:
+            _index = index
+
+    return index
+
+
+def quote(role_type_id, band_code=None, on=None):
+    """The price of a role type, in a band if given, on a date (today by default)"""
+    return get_index().quote(role_type_id, band_code, on)
+
+
+def quote_many(items, on=None):
+    """
+    Price many (key, role type id, band code or None) at once.
+    Returns {key: price or None}.
+    """
+    index = get_index()
+    return {key: index.quote(role_type_id, band_code, on) for key, role_type_id, band_code in items}
+
+
+def quote_members(on=None, bands=None):
+    """
+    Price every active role on a date, in one query.
+    bands optionally maps person ids to band codes.
+    Returns {(person id, role type id): price or None}.
+    """
+    from hub.models.membership import Role
+
+    on    = to_date(on) or datetime.date.today()
+    bands = bands or {}
+
+    roles = db.session.query(Role.person_id, Role.role_type_id) \
+                      .filter(Role.starts_on <= on) \
+                      .filter(db.or_(Role.ends_on == None, Role.ends_on >= on))
+
+    return quote_many(
+        (((person_id, role_type_id), role_type_id, bands.get(person_id)) for person_id, role_type_id in roles),
+        on
+    )
+
+
+def _forget(key=None):
+    global _index
+
+    with _lock:
+        _index = None
+
+
+def _forget_all(mapper, connection, target):
+    forget_on_commit(target, _forget)
+    bump_on_commit(target, STAMP)
+
+
+def watch_prices(rate_model, band_model):
+    """
+    Drop the index when rates or bands are written: here once the write
+    commits, and in other workers when they next check the stamp
+    """
+    for event in ('after_insert', 'after_update', 'after_delete'):
+        db.event.listen(rate_model, event, _forget_all)
+        db.event.listen(band_model, event, _forget_all)
+
+
+on_stamp_change(_forget, STAMP)
@@ -0,0 +1,120 @@
+"""
+The logged in user, as loaded for every authenticated request.
+"""
+
+from flask import current_app as app
+
+from hub.exts import db
+from hub.models.membership import Person
+from hub.services.cache import LRUCache, MISSING
+from hub.services.invalidation import forget_on_commit, forget_pending, bump_on_commit, on_stamp_change, check_stamp
+from hub.services.permissions import get_permissions
+
+
+# Principal data for this worker, by person id
+_cache = None
+
+
+class Principal:
+    """
+    The id, name, active role types and abilities of the current user.
+    The full Person is only loaded if something asks for it, either through
+    .person or by using an attribute the principal doesn't have.
+    """
+
+    def __init__(self, id, first_name, last_name, permissions):
+        self.id          = id
+        self.first_name  = first_name
+        self.last_name   = last_name
+        self.permissions = permissions
+        self._person     = None
+
+    def __repr__(self):
+        return '<Principal [{:s}]>'.format(self.id)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return getattr(self.person, name)
+
+    @property
+    def role_type_ids(self):
+        return self.permissions.role_type_ids
+
+    @property
+    def abilities(self):
+        return frozenset(self.permissions.abilities)
+
+    @property
+    def full_name(self):
+        return '{:s} {:s}'.format(self.first_name.title(), self.last_name.title())
+
+    @property
+    def person(self):
+        if self._person is None:
+            self._person = Person.query.get(self.id)
+
+        return self._person
+
+
+def get_cache():
+    global _cache
+
+    if _cache is None:
+        _cache = LRUCache(app.config['PRINCIPAL_CACHE_SIZE'], app.config['PRINCIPAL_CACHE_TTL'])
+
+    return _cache
+
+
+def load_principal(person_id):
+    """
+    Load the principal for a person id, or None if they don't exist.
+    Names are cached for PRINCIPAL_CACHE_TTL seconds and roles and abilities
+    come from the cached permission index, so most requests need no queries.
+    Deleting a person clears the cache in every worker.
+    """
+    check_stamp()
+
+    cache = get_cache()
+    data  = cache.get(person_id)
+
+    if data is MISSING:
+        data = db.session.query(Person.id, Person.first_name, Person.last_name) \
+                         .filter(Person.id == person_id) \
+                         .first()
+
+        # Built from writes that haven't committed, and may yet roll back
+        if not forget_pending(_forget):
+            cache.set(person_id, data)
+
+    if data is None:
+        return None
+
+    return Principal(*data, get_permissions(person_id))
+
+
+def _forget(person_id):
+    if _cache is not None:
+        _cache.pop(person_id)
+
+
+def _clear():
+    if _cache is not None:
+        _cache.clear()
+
+
+def _forget_person(mapper, connection, target):
+    forget_on_commit(target, _forget, target.id)
+
+
+def _forget_deleted_person(mapper, connection, target):
+    forget_on_commit(target, _forget, target.id)
+    bump_on_commit(target)
+
+
+db.event.listen(Person, 'after_insert', _forget_person)
+db.event.listen(Person, 'after_update', _forget_person)
+db.event.listen(Person, 'after_delete', _forget_deleted_person)
+
+on_stamp_change(_clear)
@@ -0,0 +1,46 @@
+import threading, time
+
+
+class TokenBucket:
+    """
+    Allow `rate` actions per second, with bursts of up to `capacity`.
+    Safe to share between threads in one process.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate     = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens   = self.capacity
+        self.updated  = time.monotonic()
+        self.lock     = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, tokens=1):
+        """Take tokens if they are available now, without waiting"""
+        with self.lock:
+            self._refill()
+
+            if self.tokens < tokens:
+                return False
+
+            self.tokens -= tokens
+            return True
+
+    def take(self, tokens=1):
+        """
+        Wait until tokens are available and take them.
+        Requests larger than the capacity are allowed, and leave the bucket in debt.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
@@ -0,0 +1,70 @@
+"""
+How resources are written out.
+
+JSON is encoded with orjson when it's installed, falling back to the
+standard library. Either way Decimals (money) are written as strings and
+dates as ISO 8601. Bodies over COMPRESS_MIN_SIZE bytes are compressed if the
+client accepts it.
+"""
+
+import datetime, decimal, json
+
+from flask import make_response, current_app, request
+
+from hub.services.compression import negotiate, compress, encode_etag
+
+try:
+    import orjson
+except ImportError as error:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def dumps(data, debug=False):
+    """Encode data as JSON bytes"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+        if debug:
+            option |= orjson.OPT_INDENT_2
+
+        return orjson.dumps(data, default=_default, option=option)
+
+    return (json.dumps(data, default=_default, indent=4 if debug else None) + '\n').encode('utf-8')
+
+
+def output_json(data, code, headers=None):
+    """Make a JSON response, compressed if it's worth it"""
+    body     = dumps(data, current_app.debug)
+    encoding = None
+
+    negotiated = len(body) >= current_app.config['COMPRESS_MIN_SIZE']
+    if negotiated:
+        encoding = negotiate(request.accept_encodings)
+
+    if encoding is not None:
+        body = compress(body, encoding)
+
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    response.mimetype = 'application/json'
+
+    # Whether or not it was compressed, the body depended on Accept-Encoding
+    if negotiated:
+        response.vary.add('Accept-Encoding')
+
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = encode_etag(response.headers['ETag'], encoding)
+
+    return response
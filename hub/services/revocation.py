@@ -0,0 +1,123 @@
+"""
+Revoked tokens.
+
+Revocations are stored in the database. Each worker keeps a bloom filter of
+the unexpired ones, so checking a token that was never revoked (nearly all
+of them) doesn't touch the database. A hit is confirmed against the table,
+since the filter can give false positives.
+
+Tokens revoked by other workers are picked up every REVOCATION_SYNC_INTERVAL
+seconds, by loading rows revoked since the last sync. The window reaches
+REVOCATION_SYNC_OVERLAP seconds further back, so a revocation whose
+transaction commits late (or was timed by a host with a slow clock) is
+still seen. Tokens already in the filter set no new bits, so re-reading the
+overlap doesn't count towards the filter's capacity.
+
+A full filter is rebuilt from the unexpired rows, sized for at least twice
+as many as there are, so it isn't full again as soon as it's built.
+"""
+
+import datetime, threading, time
+
+from flask import current_app as app
+
+from hub.exts import db
+from hub.models.auth import RevokedToken
+from hub.services.bloom import BloomFilter
+from hub.services.tasks import periodic
+
+
+# The denylist for this worker
+_denylist = None
+_lock = threading.Lock()
+
+
+class Denylist:
+
+    def __init__(self, capacity, error_rate):
+        self.filter       = BloomFilter(capacity, error_rate)
+        self.loaded_since = None
+        self.synced_at    = None
+
+    def add(self, jti):
+        self.filter.add(jti)
+
+    def sync(self, interval, overlap):
+        """
+        Load tokens revoked since the last sync, less overlap seconds, at most
+        every interval seconds. The first sync loads every unexpired token.
+        """
+        now = time.monotonic()
+
+        if self.synced_at is not None and now - self.synced_at < interval:
+            return
+
+        started = datetime.datetime.now()
+        query   = db.session.query(RevokedToken.jti) \
+                            .filter(RevokedToken.expires_at > started)
+
+        if self.loaded_since is not None:
+            query = query.filter(RevokedToken.revoked_at >= self.loaded_since)
+
+        for jti, in query:
+            self.filter.add(jti)
+
+        self.loaded_since = started - datetime.timedelta(seconds=overlap)
+        self.synced_at    = now
+
+    def __contains__(self, jti):
+        if jti not in self.filter:
+            return False
+
+        return db.session.query(
+            RevokedToken.query.filter(RevokedToken.jti == jti).exists()
+        ).scalar()
+
+
+def get_denylist():
+    global _denylist
+
+    with _lock:
+        # Start again once full, which also drops tokens that have since expired
+        if _denylist is None or _denylist.filter.is_full:
+            live = RevokedToken.query.filter(RevokedToken.expires_at > datetime.datetime.now()).count()
+            _denylist = Denylist(max(app.config['REVOCATION_CAPACITY'], live * 2),
+                                 app.config['REVOCATION_ERROR_RATE'])
+
+    _denylist.sync(app.config['REVOCATION_SYNC_INTERVAL'], app.config['REVOCATION_SYNC_OVERLAP'])
+    return _denylist
+
+
+def is_revoked(token):
+    """Check a decoded token against the denylist"""
+    return token['jti'] in get_denylist()
+
+
+def revoke(token):
+    """Add a decoded token to the denylist"""
+    if is_revoked(token):
+        return
+
+    # Tokens made without an expiry have to be kept for good
+    if 'exp' in token:
+        expires_at = datetime.datetime.fromtimestamp(token['exp'])
+    else:
+        expires_at = datetime.datetime.max
+
+    db.session.add(RevokedToken(
+        token['jti'],
+        token['type'],
+        token.get(app.config['JWT_IDENTITY_CLAIM']),
+        expires_at
+    ))
+    db.session.commit()
+
+    get_denylist().add(token['jti'])
+
+
+@periodic('REVOCATION_PRUNE_INTERVAL')
+def prune_revoked():
+    """Delete revocations for tokens that have expired"""
+    RevokedToken.query.filter(RevokedToken.expires_at <= datetime.datetime.now()) \
+                      .delete(synchronize_session=False)
+    db.session.commit()
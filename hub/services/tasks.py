@@ -0,0 +1,151 @@
+"""
+Run work outside of the request.
+
+Under uWSGI tasks are handed to the spooler. Without it they are queued for a
+worker thread in the current process. Either way the task runs inside an app
+context, so it can use the database and config like a request would.
+
+Periodic tasks run on a uWSGI timer in the spooler, or on a scheduler thread
+started with the first request.
+"""
+
+import queue, threading, time
+
+from flask import current_app
+
+
+# Registered task functions, by name
+_registry = {}
+
+# Periodic tasks: (config key holding the interval in seconds, task name)
+_periodic = []
+
+# The app tasks run against, set by init_app
+_app = None
+
+
+def init_app(app):
+    global _app
+    _app = app
+
+    _start_periodic(app)
+
+
+def _name(f):
+    return '{:s}.{:s}'.format(f.__module__, f.__name__)
+
+
+def task(f):
+    """
+    Register a function as a task.
+    Call f.delay(*args, **kwargs) to run it off-request.
+    """
+    name = _name(f)
+    _registry[name] = f
+
+    def delay(*args, **kwargs):
+        if current_app.config['TASKS_EAGER']:
+            return f(*args, **kwargs)
+
+        _defer(name, args, kwargs)
+
+    f.delay = delay
+    return f
+
+
+def periodic(interval_key):
+    """
+    Register a task to run every app.config[interval_key] seconds.
+    A falsy interval turns it off.
+    """
+    def decorator(f):
+        f = task(f)
+        _periodic.append((interval_key, _name(f)))
+        return f
+
+    return decorator
+
+
+def _run(name, args, kwargs):
+    with _app.app_context():
+        try:
+            _registry[name](*args, **kwargs)
+        except Exception as e:
+            _app.logger.exception('Task %s failed', name)
+
+
+try:
+    from uwsgidecorators import spool, timer
+
+    @spool(pass_arguments=True)
+    def _spooled(name, args, kwargs):
+        _run(name, args, kwargs)
+
+    def _defer(name, args, kwargs):
+        _spooled(name, args, kwargs)
+
+    def _start_periodic(app):
+        # Timers have to be registered in the master, before workers fork
+        for interval_key, name in _periodic:
+            if app.config[interval_key]:
+                timer(app.config[interval_key], target='spooler')(
+                    lambda signum, name=name: _run(name, (), {})
+                )
+
+except ImportError as error:
+    _queue     = queue.Queue()
+    _worker    = None
+    _scheduler = None
+    _lock      = threading.Lock()
+
+    def _work():
+        while True:
+            name, args, kwargs = _queue.get()
+            _run(name, args, kwargs)
+            _queue.task_done()
+
+    def _defer(name, args, kwargs):
+        global _worker
+
+        with _lock:
+            if _worker is None or not _worker.is_alive():
+                _worker = threading.Thread(target=_work, name='hub-tasks', daemon=True)
+                _worker.start()
+
+        _queue.put((name, args, kwargs))
+
+    def _schedule(intervals):
+        due = {name: time.monotonic() + interval for name, interval in intervals}
+
+        while True:
+            now = time.monotonic()
+
+            for name, interval in intervals:
+                if due[name] <= now:
+                    _defer(name, (), {})
+                    due[name] = now + interval
+
+            time.sleep(max(0, min(due.values()) - time.monotonic()))
+
+    def _start_periodic(app):
+        def start():
+            global _scheduler
+
+            if app.config['TASKS_EAGER']:
+                return
+
+            intervals = [
+                (name, app.config[interval_key])
+                for interval_key, name in _periodic if app.config[interval_key]
+            ]
+
+            with _lock:
+                if len(intervals) == 0 or _scheduler is not None:
+                    return
+
+                _scheduler = threading.Thread(
+                    target=_schedule, args=(intervals,), name='hub-scheduler', daemon=True
+                )
+                _scheduler.start()
+
+        app.before_first_request(start)
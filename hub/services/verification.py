@@ -0,0 +1,77 @@
+"""
+Email verification codes.
+
+Asking for a code saves the token and a queued message in one transaction.
+The message is rendered and sent by a task, so the request doesn't wait on
+markdown, templates or SES.
+"""
+
+import secrets
+
+from flask import current_app as app
+
+from hub.exts import db
+from hub.models.membership import Person, EmailAddress, VerifyToken
+from hub.models.messaging import Email
+from hub.services.tasks import task, periodic
+
+
+BODY = """Your email verification code is:
+
+# {:d}
+
+Enter this on the website to continue.
+
+If you were not expecting this code, please delete this email."""
+
+
+def new_code():
+    """A random five digit code"""
+    return 10000 + secrets.randbelow(90000)
+
+
+def request_code(address):
+    """
+    Make a code for an email address and queue the email with it.
+    Commits, then hands the email to a worker.
+    """
+    code = new_code()
+    VerifyToken.issue(address.email, code)
+
+    message = Email(None, 'Email verification code', BODY.format(code))
+    message.preview_text = 'Verification code is {:d}'.format(code)
+    message.type_code = 'TRN'
+    message.status = 'QUEUED'
+    message.recipients.append(address.person)
+
+    db.session.add(message)
+    db.session.commit()
+
+    send_verification_email.delay(message.id, address.person_id, address.email)
+
+
+@task
+def send_verification_email(email_id, person_id, address):
+    """Render and send a queued verification email"""
+    message = Email.query.get(email_id)
+
+    if message is None or message.status != 'QUEUED':
+        return
+
+    # Already verified while this was waiting
+    if EmailAddress.find(address).filter(EmailAddress.verified == True).count():
+        message.status = 'ARCHIVED'
+    else:
+        message.send_to(Person.query.get(person_id), address)
+        message.status = 'SENT'
+
+    db.session.commit()
+
+
+@periodic('VERIFY_SWEEP_INTERVAL')
+def sweep_verify_tokens():
+    """Delete expired verification tokens"""
+    deleted = VerifyToken.sweep(app.config['VERIFY_SWEEP_BATCH_SIZE'])
+
+    if deleted:
+        app.logger.info('Swept %d verification tokens', deleted)
@@ -0,0 +1,4 @@
+"""
+Local stand-ins for the external APIs the hub talks to.
+These let sends, lookups and payment runs be tested and timed offline.
+"""
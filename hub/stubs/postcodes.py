@@ -0,0 +1,99 @@
+"""
+A fake postcodes.io.
+
+Point POSTCODES_API_URL at it to geocode without the network:
+$ flask stub postcodes --port 9002
+$ export POSTCODES_API_URL=http://localhost:9002
+
+Well-formed postcodes get made-up (but stable) codes, except those listed in
+KNOWN, which return their real codes.
+"""
+
+import hashlib, re, time
+
+from flask import Flask, request
+
+
+POST_CODE = re.compile(r'^[A-Z]{1,2}[0-9][A-Z0-9]?[0-9][A-Z]{2}$')
+
+KNOWN = {
+    'PE78JY': {
+        'admin_ward': 'E05010815',
+        'admin_district': 'E06000031',
+        'parliamentary_constituency': 'E14000855'
+    }
+}
+
+
+def lookup(post_code):
+    key = ''.join(post_code.split()).upper()
+
+    if key in KNOWN:
+        return KNOWN[key]
+
+    if not POST_CODE.match(key):
+        return None
+
+    number = int(hashlib.md5(key.encode('UTF-8')).hexdigest(), 16)
+
+    return {
+        'admin_ward': 'E05{:06d}'.format(number % 1000000),
+        'admin_district': 'E06{:06d}'.format(number % 100),
+        'parliamentary_constituency': 'E14{:06d}'.format(number % 1000)
+    }
+
+
+def create_stub(latency=0):
+    """
+    Create the stub app.
+    latency is added to every call (seconds), to stand in for the real round trip.
+    """
+
+    app = Flask(__name__)
+    app.stats = {
+        'calls': 0,
+        'lookups': 0
+    }
+
+    def result(post_code):
+        codes = lookup(post_code)
+        if codes is None:
+            return None
+
+        return {
+            'postcode': post_code.upper(),
+            'codes': codes
+        }
+
+    @app.before_request
+    def count():
+        if latency:
+            time.sleep(latency)
+
+        app.stats['calls'] += 1
+
+    @app.route('/postcodes/<string:post_code>', methods=['GET'])
+    def get_post_code(post_code):
+        app.stats['lookups'] += 1
+        found = result(post_code)
+
+        if found is None:
+            return {'status': 404, 'error': 'Invalid postcode'}, 404
+
+        return {'status': 200, 'result': found}
+
+    @app.route('/postcodes', methods=['POST'])
+    def bulk_lookup():
+        post_codes = request.get_json()['postcodes']
+        app.stats['lookups'] += len(post_codes)
+
+        return {
+            'status': 200,
+            'result': [{'query': pc, 'result': result(pc)} for pc in post_codes]
+        }
+
+    @app.route('/stats', methods=['GET'])
+    def get_stats():
+        return app.stats
+
+    return app
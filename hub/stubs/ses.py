@@ -0,0 +1,137 @@
+"""
+A fake Amazon SES endpoint.
+
+Point SES_ENDPOINT_URL at it to send email without touching AWS:
+$ flask stub ses --port 9001
+$ export SES_ENDPOINT_URL=http://localhost:9001
+
+Addresses starting with "reject@" are refused, and --max-rate makes it
+throttle like SES does when the send rate is exceeded.
+"""
+
+import re, time, uuid
+
+from flask import Flask, request, Response
+
+from hub.services.ratelimit import TokenBucket
+
+
+NAMESPACE = 'http://ses.amazonaws.com/doc/2010-12-01/'
+
+DESTINATION_KEY = re.compile(r'^Destinations\.member\.(\d+)\.Destination\.ToAddresses\.member\.1$')
+
+
+def create_stub(latency=0, max_rate=None):
+    """
+    Create the stub app.
+    latency is added to every call (seconds), to stand in for the real round trip.
+    max_rate is the number of messages per second accepted before throttling.
+    """
+
+    app = Flask(__name__)
+    app.stats = {
+        'calls': 0,
+        'messages': 0,
+        'throttled': 0,
+        'templates': {}
+    }
+
+    bucket = TokenBucket(max_rate) if max_rate else None
+
+    def throttled(count):
+        if bucket is None or bucket.try_take(count):
+            return False
+
+        app.stats['throttled'] += 1
+        return True
+
+    def respond(action, result=''):
+        body = (
+            '<{0}Response xmlns="{1}">'
+            '<{0}Result>{2}</{0}Result>'
+            '<ResponseMetadata><RequestId>{3}</RequestId></ResponseMetadata>'
+            '</{0}Response>'
+        ).format(action, NAMESPACE, result, uuid.uuid4())
+
+        return Response(body, mimetype='text/xml')
+
+    def error(code, message, status=400):
+        body = (
+            '<ErrorResponse xmlns="{0}">'
+            '<Error><Type>Sender</Type><Code>{1}</Code><Message>{2}</Message></Error>'
+            '<RequestId>{3}</RequestId>'
+            '</ErrorResponse>'
+        ).format(NAMESPACE, code, message, uuid.uuid4())
+
+        return Response(body, status=status, mimetype='text/xml')
+
+    def message_id():
+        return '<MessageId>{:s}</MessageId>'.format(uuid.uuid4().hex)
+
+    @app.route('/', methods=['POST'])
+    def action():
+        if latency:
+            time.sleep(latency)
+
+        form   = request.form
+        name   = form.get('Action')
+        stats  = app.stats
+        stats['calls'] += 1
+
+        if name == 'SendEmail':
+            if throttled(1):
+                return error('Throttling', 'Maximum sending rate exceeded.')
+
+            if form.get('Destination.ToAddresses.member.1', '').startswith('reject@'):
+                return error('MessageRejected', 'Email address is not verified.')
+
+            stats['messages'] += 1
+            return respond(name, message_id())
+
+        if name == 'SendBulkTemplatedEmail':
+            if form.get('Template') not in stats['templates']:
+                return error('TemplateDoesNotExist', 'Template does not exist')
+
+            addresses = sorted(
+                (int(match.group(1)), form[key])
+                for key in form.keys() if (match := DESTINATION_KEY.match(key))
+            )
+            count = len(addresses)
+            if throttled(count):
+                return error('Throttling', 'Maximum sending rate exceeded.')
+
+            statuses = ''
+            for number, address in addresses:
+                if address.startswith('reject@'):
+                    statuses += '<member><Status>MessageRejected</Status>' \
+                                '<Error>Email address is not verified.</Error></member>'
+                    continue
+
+                stats['messages'] += 1
+                statuses += '<member><Status>Success</Status>{:s}</member>'.format(message_id())
+
+            return respond(name, '<Status>{:s}</Status>'.format(statuses))
+
+        if name in ('CreateTemplate', 'UpdateTemplate'):
+            template = form.get('Template.TemplateName')
+            if name == 'CreateTemplate' and template in stats['templates']:
+                return error('AlreadyExists', 'Template already exists')
+
+            stats['templates'][template] = form.get('Template.HtmlPart')
+            return respond(name)
+
+        if name == 'DeleteTemplate':
+            stats['templates'].pop(form.get('TemplateName'), None)
+            return respond(name)
+
+        return error('InvalidAction', 'Unsupported action')
+
+    @app.route('/stats', methods=['GET'])
+    def get_stats():
+        return {
+            'calls': app.stats['calls'],
+            'messages': app.stats['messages'],
+            'throttled': app.stats['throttled']
+        }
+
+    return app
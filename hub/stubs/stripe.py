@@ -0,0 +1,163 @@
+"""
+A fake Stripe API.
+
+Point STRIPE_API_BASE at it to take payments without touching Stripe:
+$ flask stub stripe --port 9003
+$ export STRIPE_API_BASE=http://localhost:9003
+
+Idempotency keys are honoured like Stripe does, by replaying the first
+response, so a billing run can be killed and resumed against it. Clear
+app.idempotency_keys to act as if Stripe had forgotten them.
+Payment methods starting with "pm_card_chargeDeclined" are declined, and
+--max-rate makes it answer 429 like Stripe does past its rate limit.
+"""
+
+import threading, time, uuid
+
+from flask import Flask, request
+
+from hub.services.ratelimit import TokenBucket
+
+
+DECLINED = 'pm_card_chargeDeclined'
+
+
+def create_stub(latency=0, max_rate=None):
+    """
+    Create the stub app.
+    latency is added to every call (seconds), to stand in for the real round trip.
+    max_rate is the number of requests per second accepted before rate limiting.
+    """
+
+    app = Flask(__name__)
+    app.stats = {
+        'calls': 0,
+        'customers': 0,
+        'intents': 0,
+        'declined': 0,
+        'replayed': 0,
+        'limited': 0
+    }
+    app.objects = {}
+    app.idempotency_keys = {}
+
+    bucket  = TokenBucket(max_rate) if max_rate else None
+    lock    = threading.Lock()
+
+    def new_id(prefix):
+        return '{:s}_{:s}'.format(prefix, uuid.uuid4().hex[:24])
+
+    def metadata(form):
+        return {
+            key[len('metadata['):-1]: value
+            for key, value in form.items() if key.startswith('metadata[')
+        }
+
+    def error(type, message, status=400, **fields):
+        return dict(error=dict(type=type, message=message, **fields)), status
+
+    def create_customer(form):
+        customer = {
+            'id': new_id('cus'),
+            'object': 'customer',
+            'name': form.get('name'),
+            'email': form.get('email'),
+            'description': form.get('description'),
+            'metadata': metadata(form)
+        }
+
+        app.objects[customer['id']] = customer
+        app.stats['customers'] += 1
+        return customer, 200
+
+    def create_intent(form):
+        customer = form.get('customer')
+        if customer is not None and customer not in app.objects:
+            return error('invalid_request_error', 'No such customer', 404, code='resource_missing')
+
+        intent = {
+            'id': new_id('pi'),
+            'object': 'payment_intent',
+            'amount': int(form.get('amount', 0)),
+            'currency': form.get('currency'),
+            'customer': customer,
+            'payment_method': form.get('payment_method'),
+            'description': form.get('description'),
+            'metadata': metadata(form),
+            'status': 'requires_payment_method',
+            'client_secret': new_id('secret')
+        }
+
+        app.objects[intent['id']] = intent
+        app.stats['intents'] += 1
+
+        if form.get('confirm', '').lower() != 'true':
+            return intent, 200
+
+        if (intent['payment_method'] or '').startswith(DECLINED):
+            app.stats['declined'] += 1
+            return error('card_error', 'Your card was declined.', 402,
+                         code='card_declined', payment_intent=intent)
+
+        intent['status'] = 'succeeded'
+        return intent, 200
+
+    def idempotent(create):
+        """Replay the first response for a repeated Idempotency-Key"""
+        key = request.headers.get('Idempotency-Key')
+
+        with lock:
+            if key is not None and key in app.idempotency_keys:
+                app.stats['replayed'] += 1
+                return app.idempotency_keys[key]
+
+            reply = create(request.form)
+
+            if key is not None:
+                app.idempotency_keys[key] = reply
+
+        return reply
+
+    @app.before_request
+    def before():
+        if latency:
+            time.sleep(latency)
+
+        app.stats['calls'] += 1
+
+        if bucket is not None and not bucket.try_take():
+            app.stats['limited'] += 1
+            return error('rate_limit_error', 'Too many requests hit the API too quickly.', 429)
+
+    @app.route('/v1/customers', methods=['POST'])
+    def customers():
+        return idempotent(create_customer)
+
+    @app.route('/v1/payment_intents', methods=['POST'])
+    def payment_intents():
+        return idempotent(create_intent)
+
+    @app.route('/v1/payment_intents', methods=['GET'])
+    def list_payment_intents():
+        customer = request.args.get('customer')
+        intents  = [
+            intent for intent in app.objects.values()
+            if intent['object'] == 'payment_intent' and customer in (None, intent['customer'])
+        ]
+
+        return {'object': 'list', 'url': '/v1/payment_intents', 'has_more': False, 'data': intents}
+
+    @app.route('/v1/customers/<id>', methods=['GET'])
+    @app.route('/v1/payment_intents/<id>', methods=['GET'])
+    def retrieve(id):
+        if id not in app.objects:
+            return error('invalid_request_error', 'No such object: {:s}'.format(id), 404,
+                         code='resource_missing')
+
+        return app.objects[id]
+
+    @app.route('/stats', methods=['GET'])
+    def get_stats():
+        return app.stats
+
+    return app
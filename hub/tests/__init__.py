@@ -1,12 +1,11 @@
 
 import os
 import tempfile
+import threading
 
 import pytest
 import hub
-from hub.exts import db as database
-
-from flask_restful import Api
+from hub.exts import db as database, make_api
 
 
 @pytest.fixture
@@ -22,6 +21,7 @@ def client():
         BCRYPT_LOG_ROUNDS=4,
         WTF_CSRF_ENABLED=False,
         SQLALCHEMY_DATABASE_URI='sqlite:///test.db',
+        TASKS_EAGER=True,
         STRIPE_SECRET=os.environ.get('STRIPE_TEST_SECRET'),
         STRIPE_PUBLIC=os.environ.get('STRIPE_TEST_PUBLIC')
     )
@@ -30,7 +30,7 @@ def client():
         with app.app_context():
             yield client
 
-    hub.api = Api()
+    hub.api = make_api()
 
 
 @pytest.fixture
@@ -41,4 +41,70 @@ def db():
 
     yield database
 
-    database.drop_all()
\ No newline at end of file
+    database.session.remove()
+    database.drop_all()
+
+
+def run_stub(stub):
+    """Serve a stub app on a free local port, returning (server, url)"""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, stub, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://127.0.0.1:{:d}'.format(server.server_port)
+
+
+@pytest.fixture
+def ses_stub(client):
+    """Point SES at a local fake endpoint"""
+    from flask import current_app
+    from hub.stubs.ses import create_stub
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    stub = create_stub()
+    server, url = run_stub(stub)
+    current_app.config['SES_ENDPOINT_URL'] = url
+
+    yield stub
+
+    server.shutdown()
+
+
+@pytest.fixture
+def postcodes_stub(client):
+    """Point postcode lookups at a local fake postcodes.io"""
+    from flask import current_app
+    from hub.services import geo
+    from hub.stubs.postcodes import create_stub
+
+    stub = create_stub()
+    server, url = run_stub(stub)
+    current_app.config['POSTCODES_API_URL'] = url
+    geo.get_cache().clear()
+
+    yield stub
+
+    server.shutdown()
+
+
+@pytest.fixture
+def stripe_stub(client):
+    """Point Stripe at a local fake API"""
+    import stripe
+    from flask import current_app
+    from hub.stubs.stripe import create_stub
+
+    stub = create_stub()
+    server, url = run_stub(stub)
+    current_app.config['STRIPE_API_BASE'] = url
+    current_app.config['STRIPE_SECRET'] = current_app.config['STRIPE_SECRET'] or 'sk_test_stub'
+
+    api_key, api_base = stripe.api_key, stripe.api_base
+
+    yield stub
+
+    stripe.api_key, stripe.api_base = api_key, api_base
+    server.shutdown()
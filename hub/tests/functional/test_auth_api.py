@@ -0,0 +1,158 @@
+import json
+
+from hub.tests import client, db
+
+
+def test_login(client, db):
+    """
+    GIVEN a person with a password
+    WHEN POST '/api/login'
+    THEN returns tokens for the right password only
+    """
+
+    from hub.models.membership import Person
+
+    person = Person('Test', 'Person')
+    person.primary_email = 'login@local.test'
+    person.password = 'correct horse'
+    db.session.add(person)
+    db.session.commit()
+
+    r = client.post('/api/login', data=json.dumps({
+        'email': 'login@local.test',
+        'password': 'correct horse'
+    }), content_type='application/json')
+
+    assert r.status_code == 200
+    assert 'auth_token' in r.json
+    assert 'refresh_token' in r.json
+    assert r.json['person'] == {'id': person.id, 'full_name': 'Test Person'}
+
+    # Email case doesn't matter
+    r = client.post('/api/login', data=json.dumps({
+        'email': 'Login@Local.Test',
+        'password': 'correct horse'
+    }), content_type='application/json')
+
+    assert r.status_code == 200
+
+    r = client.post('/api/login', data=json.dumps({
+        'email': 'login@local.test',
+        'password': 'wrong'
+    }), content_type='application/json')
+
+    assert r.status_code == 400
+    assert 'auth_token' not in r.json
+
+
+def test_login_rehashes_password(client, db):
+    """
+    GIVEN a person whose password was hashed under an older policy
+    WHEN they log in
+    THEN the stored hash is upgraded to the current policy
+    """
+
+    from passlib.hash import argon2
+    from hub.models.membership import Person
+
+    person = Person('Test', 'Person')
+    person.primary_email = 'rehash@local.test'
+    person.password_hash = argon2.using(rounds=1, memory_cost=1024, parallelism=1).hash('correct horse')
+    db.session.add(person)
+    db.session.commit()
+
+    old_hash = person.password_hash
+
+    r = client.post('/api/login', data=json.dumps({
+        'email': 'rehash@local.test',
+        'password': 'correct horse'
+    }), content_type='application/json')
+
+    assert r.status_code == 200
+
+    db.session.expire_all()
+    person = Person.query.get(person.id)
+
+    assert person.password_hash != old_hash
+    assert person.check_password('correct horse')
+
+
+def test_login_busy(client, db):
+    """
+    GIVEN the password pool has no free slots
+    WHEN POST '/api/login'
+    THEN returns 503 without waiting
+    """
+
+    from hub.models.membership import Person
+    from hub.services import passwords
+
+    person = Person('Test', 'Person')
+    person.primary_email = 'busy@local.test'
+    person.password = 'correct horse'
+    db.session.add(person)
+    db.session.commit()
+
+    with client.application.app_context():
+        executor, slots = passwords._get_pool()
+
+    taken = 0
+    while slots.acquire(blocking=False):
+        taken += 1
+
+    try:
+        r = client.post('/api/login', data=json.dumps({
+            'email': 'busy@local.test',
+            'password': 'correct horse'
+        }), content_type='application/json')
+    finally:
+        for i in range(taken):
+            slots.release()
+
+    assert r.status_code == 503
+
+
+def test_refresh(client, db):
+    """
+    GIVEN a refresh token from logging in
+    WHEN POST '/api/refresh', then DELETE '/api/refresh'
+    THEN returns a new auth token, then revokes the refresh token
+    """
+
+    from hub.models.membership import Person
+
+    person = Person('Test', 'Person')
+    person.primary_email = 'refresh@local.test'
+    person.password = 'correct horse'
+    db.session.add(person)
+    db.session.commit()
+
+    r = client.post('/api/login', data=json.dumps({
+        'email': 'refresh@local.test',
+        'password': 'correct horse'
+    }), content_type='application/json')
+
+    auth_token    = r.json['auth_token']
+    refresh_token = r.json['refresh_token']
+
+    # An auth token won't do
+    r = client.post('/api/refresh', headers={'Authorization': 'Bearer ' + auth_token})
+    assert r.status_code == 401
+
+    r = client.post('/api/refresh', headers={'Authorization': 'Bearer ' + refresh_token})
+    assert r.status_code == 200
+    assert 'auth_token' in r.json
+
+    r = client.get('/api/people/' + person.id, headers={'Authorization': 'Bearer ' + r.json['auth_token']})
+    assert r.status_code == 200
+
+    # Log out
+    r = client.delete('/api/refresh', headers={'Authorization': 'Bearer ' + refresh_token},
+                      data=json.dumps({'auth_token': auth_token}), content_type='application/json')
+    assert r.status_code == 204
+
+    r = client.post('/api/refresh', headers={'Authorization': 'Bearer ' + refresh_token})
+    assert r.status_code == 401
+
+    r = client.get('/api/people/' + person.id, headers={'Authorization': 'Bearer ' + auth_token})
+    assert r.status_code == 401
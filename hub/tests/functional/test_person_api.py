@@ -1,4 +1,4 @@
-from hub.tests import client, db
+from hub.tests import client, db, postcodes_stub
 from flask_jwt_extended import create_access_token
 
 
@@ -60,3 +60,274 @@ def test_get_person_logged_out_not_allowed(client, db):
     r2 = client.get(f'/api/people/{person.id}')
     assert r2.status_code == 401
     assert "person" not in r2.json
+
+
+def test_list_people(client, db):
+    """
+    GIVEN people, and an admin allowed to list them
+    WHEN GET '/api/people' a page at a time
+    THEN returns every person once, in signup order, with only the fields asked for
+    """
+
+    import datetime
+    from hub.models.membership import Person, Role, RoleType, Ability
+
+    admin = Person('Admin', 'Person')
+    admin.created_at = datetime.datetime(2020, 1, 1)
+    db.session.add(admin)
+
+    role_type = RoleType('Admin')
+    db.session.add(role_type)
+    db.session.commit()
+
+    db.session.add(Role(admin, role_type, starts_on=datetime.date(2000, 1, 1)))
+    db.session.add(Ability(role_type, 'people.list'))
+
+    people = []
+    for i in range(7):
+        person = Person('Listed', str(i))
+        person.created_at = datetime.datetime(2021, 1, 1 + i // 2)
+        person.ward_id = 'E05000001' if i % 2 else 'E05000002'
+        db.session.add(person)
+        people.append(person)
+
+    db.session.commit()
+
+    # Without the ability
+    token = create_access_token(identity=people[0].id)
+    r = client.get('/api/people', headers={"Authorization": f'Bearer {token}'})
+    assert r.status_code == 403
+
+    token = create_access_token(identity=admin.id)
+    headers = {"Authorization": f'Bearer {token}'}
+
+    seen = []
+    url = '/api/people?limit=3&fields=id,full_name&created_from=2021-01-01'
+    while True:
+        r = client.get(url, headers=headers)
+        assert r.status_code == 200
+        assert all(set(p) == {'id', 'full_name'} for p in r.json['people'])
+        seen += [p['id'] for p in r.json['people']]
+
+        if r.json['next'] is None:
+            break
+
+        url = '/api/people?limit=3&fields=id,full_name&created_from=2021-01-01&after=' + r.json['next']
+
+    assert seen == [p.id for p in sorted(people, key=lambda p: (p.created_at, p.id))]
+
+    r = client.get('/api/people?ward=E05000001', headers=headers)
+    assert sorted(p['id'] for p in r.json['people']) == sorted(p.id for p in people[1::2])
+
+    r = client.get(f'/api/people?role_type={role_type.id}', headers=headers)
+    assert [p['id'] for p in r.json['people']] == [admin.id]
+
+    r = client.get('/api/people?fields=password_hash', headers=headers)
+    assert r.status_code == 400
+
+
+def test_export_people(client, db):
+    """
+    GIVEN people, and an admin allowed to export them
+    WHEN GET '/api/people/export'
+    THEN streams every person as CSV or NDJSON, gzipped when accepted
+    """
+
+    import csv, datetime, gzip, io, json
+    from hub.models.membership import Person, Role, RoleType, Ability
+
+    admin = Person('Admin', 'Person')
+    admin.primary_email = 'export@local.test'
+    db.session.add(admin)
+
+    role_type = RoleType('Exporter')
+    db.session.add(role_type)
+    db.session.commit()
+
+    db.session.add(Role(admin, role_type, starts_on=datetime.date(2000, 1, 1)))
+    db.session.add(Ability(role_type, 'people.export'))
+
+    for i in range(5):
+        db.session.add(Person('Exported', str(i)))
+
+    db.session.commit()
+
+    headers = {"Authorization": f'Bearer {create_access_token(identity=admin.id)}'}
+
+    r = client.get('/api/people/export', headers=headers)
+    assert r.status_code == 200
+    assert r.mimetype == 'text/csv'
+
+    rows = list(csv.DictReader(io.StringIO(r.get_data(as_text=True))))
+    assert len(rows) == 6
+    assert rows[0]['id'] == admin.id
+    assert rows[0]['email'] == 'export@local.test'
+
+    r = client.get('/api/people/export?format=ndjson', headers={**headers, 'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+
+    lines = gzip.decompress(r.get_data()).decode('utf-8').splitlines()
+    assert [json.loads(line)['last_name'] for line in lines[1:]] == [str(i) for i in range(5)]
+
+    r = client.get('/api/people/export?format=xml', headers=headers)
+    assert r.status_code == 400
+
+
+def test_import_people(client, db, postcodes_stub):
+    """
+    GIVEN a CSV of people with some bad rows
+    WHEN POST '/api/people/import'
+    THEN imports the good rows, geocodes their addresses and reports the bad ones
+    """
+
+    import datetime
+    from hub.models.membership import Person, EmailAddress, Role, RoleType, Ability
+
+    admin = Person('Admin', 'Person')
+    admin.primary_email = 'taken@local.test'
+    db.session.add(admin)
+
+    role_type = RoleType('Importer')
+    db.session.add(role_type)
+    db.session.commit()
+
+    db.session.add(Role(admin, role_type, starts_on=datetime.date(2000, 1, 1)))
+    db.session.add(Ability(role_type, 'people.import'))
+    db.session.commit()
+
+    body = "\n".join([
+        "first_name,last_name,email,date_of_birth,line_1,post_code,notes",
+        "ada,lovelace,ada@local.test,1815-12-10,1 Some Street,PE7 8JY,",
+        "charles,babbage,not-an-email,,,,",
+        ",nameless,nameless@local.test,,,,",
+        "again,ada,Ada@Local.Test,,,,",
+        "already,here,taken@local.test,,,,",
+        "grace,hopper,grace@local.test,,,,anything",
+    ])
+
+    headers = {"Authorization": f'Bearer {create_access_token(identity=admin.id)}'}
+
+    r = client.post('/api/people/import?source=partner', data=body, headers=headers, content_type='text/csv')
+
+    assert r.status_code == 200
+    assert r.json['imported'] == 2
+    assert [e['row'] for e in r.json['errors']] == [2, 3, 4, 5]
+
+    ada = Person.query.get(EmailAddress.resolve('ada@local.test'))
+    assert ada.full_name == 'Ada Lovelace'
+    assert ada.date_of_birth == datetime.date(1815, 12, 10)
+    assert ada.email_sub[0].source == 'import:partner'
+    assert ada.addresses[0].geo_pending is False
+    assert ada.ward_id == 'E05010815'
+
+    assert EmailAddress.resolve('grace@local.test') is not None
+
+
+def test_get_person_fields(client, db):
+    """
+    GIVEN a valid person
+    WHEN GET '/api/people/<id>?fields=...'
+    THEN returns only the fields asked for
+    """
+
+    from hub.models.membership import Person
+
+    person = Person('Test', 'Person')
+    person.primary_email = 'fields@local.test'
+    db.session.add(person)
+    db.session.commit()
+
+    headers = {"Authorization": f'Bearer {create_access_token(identity=person.id)}'}
+
+    r = client.get(f'/api/people/{person.id}?fields=id,email', headers=headers)
+    assert r.status_code == 200
+    assert r.json['person'] == {'id': person.id, 'email': 'fields@local.test'}
+
+    r = client.get(f'/api/people/{person.id}?fields=nope', headers=headers)
+    assert r.status_code == 400
+
+
+def test_person_etag(client, db):
+    """
+    GIVEN a person
+    WHEN GET with If-None-Match, or PATCH with If-Match
+    THEN unchanged people answer 304, and stale updates are refused with 412
+    """
+
+    from hub.models.membership import Person, Address
+    import json
+
+    person = Person('Test', 'Person')
+    db.session.add(person)
+    db.session.commit()
+
+    headers = {"Authorization": f'Bearer {create_access_token(identity=person.id)}'}
+
+    r = client.get(f'/api/people/{person.id}', headers=headers)
+    etag = r.headers['ETag']
+
+    r = client.get(f'/api/people/{person.id}', headers={**headers, 'If-None-Match': etag})
+    assert r.status_code == 304
+
+    # Other fields are a different representation
+    r = client.get(f'/api/people/{person.id}?fields=id', headers={**headers, 'If-None-Match': etag})
+    assert r.status_code == 200
+
+    # Writing a child row changes the version
+    db.session.add(Address(person, '1 Some Street', 'ZZ1 1ZZ', 'HOME'))
+    db.session.commit()
+
+    r = client.get(f'/api/people/{person.id}', headers={**headers, 'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+
+    r = client.patch(f'/api/people/{person.id}', data=json.dumps({'first_name': 'Test', 'last_name': 'Person', 'landlord': True}),
+                     headers={**headers, 'If-Match': etag}, content_type='application/json')
+    assert r.status_code == 412
+
+    etag = client.get(f'/api/people/{person.id}', headers=headers).headers['ETag']
+
+    r = client.patch(f'/api/people/{person.id}', data=json.dumps({'first_name': 'Test', 'last_name': 'Person', 'landlord': True}),
+                     headers={**headers, 'If-Match': etag}, content_type='application/json')
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+
+
+def test_person_etag_is_per_encoding(client, db):
+    """
+    GIVEN a person whose response is compressed
+    WHEN GET with and without gzip
+    THEN each encoding has its own ETag, either revalidates, and every response varies on encoding
+    """
+
+    from hub.models.membership import Person
+
+    client.application.config['COMPRESS_MIN_SIZE'] = 0
+
+    person = Person('Test', 'Person')
+    db.session.add(person)
+    db.session.commit()
+
+    headers = {"Authorization": f'Bearer {create_access_token(identity=person.id)}'}
+    gzip    = {**headers, 'Accept-Encoding': 'gzip'}
+
+    r = client.get(f'/api/people/{person.id}', headers=headers)
+    plain_etag = r.headers['ETag']
+
+    assert r.headers['Vary'] == 'Accept-Encoding'
+
+    r = client.get(f'/api/people/{person.id}', headers=gzip)
+    gzip_etag = r.headers['ETag']
+
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert r.headers['Vary'] == 'Accept-Encoding'
+    assert gzip_etag == plain_etag[:-1] + '-gzip"'
+
+    r = client.get(f'/api/people/{person.id}', headers={**gzip, 'If-None-Match': gzip_etag})
+    assert r.status_code == 304
+    assert r.headers['ETag'] == gzip_etag
+    assert r.headers['Vary'] == 'Accept-Encoding'
+
+    r = client.get(f'/api/people/{person.id}', headers={**headers, 'If-None-Match': plain_etag})
+    assert r.status_code == 304
+    assert r.headers['ETag'] == plain_etag
@@ -1,19 +1,21 @@
 import urllib.parse, json
-from hub.tests import client, db
+from hub.tests import client, db, ses_stub
 
 
-def test_get_verify_code(client, db):
-
-    # @TODO Fix this test - db error
-    return
+def test_get_verify_code(client, db, ses_stub, monkeypatch):
+    """
+    GIVEN a person with an unverified email
+    WHEN GET '/api/verify/<email>', then POST the code
+    THEN the code is emailed by a worker, and the right code verifies the address
+    """
 
     from hub.models.membership import Person, EmailAddress
+    from hub.models.messaging import Email
+    from hub.services import verification
 
-    EMAIL = 'success@simulator.amazonses.com'
+    monkeypatch.setattr(verification, 'new_code', lambda: 12345)
 
-    q = EmailAddress.__table__.delete().where(EmailAddress.email == EMAIL)
-    db.session.execute(q)
-    db.session.commit()
+    EMAIL = 'success@simulator.amazonses.com'
 
     person = Person('anne', 'Person')
     person.primary_email = EMAIL
@@ -25,6 +27,8 @@ def test_get_verify_code(client, db):
     response = client.get('/api/verify/{:s}'.format(email_addr))
 
     assert response.status_code == 204
+    assert ses_stub.stats['messages'] == 1
+    assert Email.query.filter(Email.type_code == 'TRN').one().status == 'SENT'
 
     response = client.post(
         '/api/verify/{:s}'.format(email_addr), 
@@ -34,4 +38,15 @@ def test_get_verify_code(client, db):
         content_type='application/json'
     )
 
-    assert response.status_code == 400
\ No newline at end of file
+    assert response.status_code == 400
+
+    response = client.post(
+        '/api/verify/{:s}'.format(email_addr),
+        data=json.dumps({
+            'code': 12345
+        }),
+        content_type='application/json'
+    )
+
+    assert response.status_code == 204
+    assert EmailAddress.find(EMAIL).one().verified
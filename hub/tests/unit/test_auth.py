@@ -0,0 +1,115 @@
+from hub.tests import client, db
+
+
+def test_bloom_filter():
+    """
+    GIVEN a bloom filter
+    WHEN items are added, some of them twice
+    THEN they are always found, few others are, and repeats don't count towards capacity
+    """
+
+    from hub.services.bloom import BloomFilter
+
+    bloom = BloomFilter(1000, 0.01)
+
+    for i in range(1000):
+        bloom.add('in-{:d}'.format(i))
+
+    assert all('in-{:d}'.format(i) in bloom for i in range(1000))
+    assert sum('out-{:d}'.format(i) in bloom for i in range(10000)) < 300
+
+    # Items that set no new bits (repeats, or the odd false positive) aren't counted
+    count = bloom.count
+    assert count > 950
+    assert not bloom.add('in-0')
+    assert bloom.count == count
+
+    for i in range(1000, 1100):
+        bloom.add('in-{:d}'.format(i))
+
+    assert bloom.is_full
+
+
+def test_revoked_elsewhere(client, db):
+    """
+    GIVEN a token revoked by another worker
+    WHEN the denylist next syncs
+    THEN the token is revoked here too
+    """
+
+    import datetime, uuid
+    from hub.models.auth import RevokedToken
+    from hub.services import revocation
+
+    with client.application.app_context():
+        client.application.config['REVOCATION_SYNC_INTERVAL'] = 0
+        token = {'jti': str(uuid.uuid4()), 'type': 'access', 'identity': 'X'}
+
+        assert not revocation.is_revoked(token)
+
+        db.session.add(RevokedToken(token['jti'], 'access', 'X', datetime.datetime.now() + datetime.timedelta(hours=1)))
+        db.session.commit()
+
+        assert revocation.is_revoked(token)
+
+
+def test_late_revocations_are_synced(client, db):
+    """
+    GIVEN a revocation with a lower id and time than one already synced,
+          because its transaction committed later
+    WHEN the denylist next syncs
+    THEN the token is still picked up
+    """
+
+    import datetime, uuid
+    from hub.models.auth import RevokedToken
+    from hub.services import revocation
+
+    client.application.config['REVOCATION_SYNC_INTERVAL'] = 0
+    expires_at = datetime.datetime.now() + datetime.timedelta(hours=1)
+    token = {'jti': str(uuid.uuid4()), 'type': 'access', 'identity': 'X'}
+
+    first = RevokedToken(str(uuid.uuid4()), 'access', 'Y', expires_at)
+    first.id = 100
+    db.session.add(first)
+    db.session.commit()
+
+    assert not revocation.is_revoked(token)
+
+    late = RevokedToken(token['jti'], 'access', 'X', expires_at)
+    late.id = 1
+    late.revoked_at = datetime.datetime.now() - datetime.timedelta(seconds=10)
+    db.session.add(late)
+    db.session.commit()
+
+    assert revocation.is_revoked(token)
+
+
+def test_repeated_syncs_do_not_rebuild(client, db):
+    """
+    GIVEN more unexpired revocations than the configured capacity
+    WHEN the denylist syncs again and again over the same overlap window
+    THEN the filter is sized for them and isn't rebuilt
+    """
+
+    import datetime, uuid
+    from hub.models.auth import RevokedToken
+    from hub.services import revocation
+
+    client.application.config['REVOCATION_SYNC_INTERVAL'] = 0
+    client.application.config['REVOCATION_CAPACITY'] = 4
+    revocation._denylist = None
+
+    expires_at = datetime.datetime.now() + datetime.timedelta(hours=1)
+    for i in range(6):
+        db.session.add(RevokedToken(str(uuid.uuid4()), 'access', 'X', expires_at))
+    db.session.commit()
+
+    denylist = revocation.get_denylist()
+    assert denylist.filter.capacity == 12
+    assert denylist.filter.count == 6
+
+    for i in range(5):
+        assert revocation.get_denylist() is denylist
+
+    assert denylist.filter.count == 6
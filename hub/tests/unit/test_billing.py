@@ -0,0 +1,167 @@
+"""
+Tests for the monthly billing run
+"""
+from datetime import date
+from decimal import Decimal
+
+from hub.tests import client, db, stripe_stub
+
+
+def make_members(db, stub):
+
+    from hub.models.finance import Rate
+    from hub.models.membership import Person, Role, RoleType
+
+    member = RoleType('Billed Member')
+    db.session.add(member)
+    db.session.commit()
+
+    rate = Rate(Decimal('10'), date(2020, 1, 1))
+    rate.multiplier = Decimal('0.5')
+    rate.charge     = Decimal('0.25')
+    rate.role_type  = member
+    db.session.add(rate)
+
+    people = [Person('Billed', str(i)) for i in range(4)]
+    db.session.add_all(people)
+    db.session.commit()
+
+    for i, person in enumerate(people[:3]):
+        person.stripe_customer_id = 'cus_{:d}'.format(i)
+        person.stripe_payment_id  = 'pm_card_visa'
+        stub.objects[person.stripe_customer_id] = {'id': person.stripe_customer_id, 'object': 'customer'}
+
+    people[2].stripe_payment_id = 'pm_card_chargeDeclined'
+
+    for person in people:
+        db.session.add(Role(person, member, starts_on=date(2020, 1, 1)))
+
+    db.session.commit()
+
+    return people
+
+
+def test_billing_run(client, db, stripe_stub):
+    """
+    GIVEN members with saved cards, one of which is declined, and one without a card
+    WHEN a billing run is made twice for the same month
+    THEN each card is charged once, and declines are recorded as failed payments
+    """
+
+    from hub.models.finance import Payment
+    from hub.services.billing import run
+
+    people = make_members(db, stripe_stub)
+
+    result = run(on=date(2021, 6, 15), workers=2, batch_size=2)
+
+    assert result.period  == '2021-06'
+    assert result.charged == 2
+    assert result.failed  == 1
+    assert result.errors  == []
+
+    payments = {payment.person_id: payment for payment in Payment.query.all()}
+
+    assert set(payments) == {person.id for person in people[:3]}
+    assert payments[people[0].id].status == 'SUCCEEDED'
+    assert payments[people[0].id].amount == Decimal('5.25')
+    assert payments[people[0].id].period == '2021-06'
+    assert payments[people[2].id].status == 'FAILED'
+    assert stripe_stub.objects[payments[people[0].id].payment_intent_id]['amount'] == 525
+
+    # Nobody is due again this month
+    result = run(on=date(2021, 6, 20))
+
+    assert result.charged + result.failed == 0
+    assert stripe_stub.stats['intents'] == 3
+
+    # But they are next month
+    result = run(on=date(2021, 7, 1))
+
+    assert result.charged == 2
+    assert Payment.query.count() == 6
+
+
+def test_billing_run_resumes(client, db, stripe_stub):
+    """
+    GIVEN a run that charged a member but died before recording it
+    WHEN the run is started again after Stripe has forgotten its idempotency keys
+    THEN the charge is found rather than made again, and it is recorded
+    """
+
+    from flask import current_app
+    from hub.models.finance import Payment
+    from hub.services.billing import begin, charge, due, run
+    from hub.services.payments import configure, get_rate_limiter
+
+    make_members(db, stripe_stub)
+
+    configure(current_app.config)
+    first = due(date(2021, 6, 15), '2021-06')[0]
+    begin([first], '2021-06')
+    intent_id, status = charge(first, '2021-06', get_rate_limiter(), 0, 0)
+
+    stripe_stub.idempotency_keys.clear()
+
+    # The member with the pending charge is no longer due
+    assert first.person_id not in [item.person_id for item in due(date(2021, 6, 15), '2021-06')]
+
+    result = run(on=date(2021, 6, 15))
+
+    payment = Payment.query.filter_by(person_id=first.person_id).one()
+
+    assert result.charged == 2
+    assert result.failed  == 1
+    assert stripe_stub.stats['intents'] == 3
+    assert payment.payment_intent_id == intent_id
+    assert payment.status == 'SUCCEEDED'
+
+
+def test_billing_run_settles_uncharged_pending_payments(client, db, stripe_stub):
+    """
+    GIVEN a run that died after writing a pending payment, before charging it
+    WHEN the run is started again
+    THEN the member is charged once
+    """
+
+    from flask import current_app
+    from hub.models.finance import Payment
+    from hub.services.billing import begin, due, run
+    from hub.services.payments import configure
+
+    make_members(db, stripe_stub)
+
+    configure(current_app.config)
+    first = due(date(2021, 6, 15), '2021-06')[0]
+    begin([first], '2021-06')
+
+    result = run(on=date(2021, 6, 15))
+
+    assert result.charged == 2
+    assert stripe_stub.stats['intents'] == 3
+    assert Payment.query.filter_by(person_id=first.person_id).one().status == 'SUCCEEDED'
+
+
+def test_billing_run_creates_customers(client, db, stripe_stub):
+    """
+    GIVEN a member with a saved card but no Stripe customer
+    WHEN a billing run is made
+    THEN a customer is created for them, stored, and charged
+    """
+
+    from hub.models.finance import Payment
+    from hub.models.membership import Person
+    from hub.services.billing import run
+
+    people = make_members(db, stripe_stub)
+    people[3].stripe_payment_id = 'pm_card_visa'
+    db.session.commit()
+
+    result = run(on=date(2021, 6, 15))
+
+    customer_id = Person.query.get(people[3].id).stripe_customer_id
+
+    assert result.charged == 3
+    assert stripe_stub.stats['customers'] == 1
+    assert stripe_stub.objects[customer_id]['metadata'] == {'person_id': people[3].id}
+    assert Payment.query.filter_by(person_id=people[3].id).one().status == 'SUCCEEDED'
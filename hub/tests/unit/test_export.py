@@ -0,0 +1,54 @@
+from hub.tests import client, db
+
+
+def test_export_command(client, db, tmp_path):
+    """
+    GIVEN people
+    WHEN `flask people export --gzip` is run
+    THEN writes them all to a gzipped file
+    """
+
+    import gzip
+    from hub.models.membership import Person
+
+    for i in range(3):
+        db.session.add(Person('Exported', str(i)))
+
+    db.session.commit()
+
+    output = tmp_path / 'people.csv.gz'
+    result = client.application.test_cli_runner().invoke(
+        args=['people', 'export', '--gzip', '--output', str(output)]
+    )
+
+    assert result.exit_code == 0
+
+    lines = gzip.decompress(output.read_bytes()).decode('utf-8').splitlines()
+    assert lines[0].startswith('id,first_name,last_name,email')
+    assert len(lines) == 4
+
+
+def test_import_command(client, db, tmp_path):
+    """
+    GIVEN an NDJSON file of people, with a line that isn't JSON
+    WHEN `flask people import` is run
+    THEN imports the rest and reports the bad line
+    """
+
+    from hub.models.membership import EmailAddress
+
+    path = tmp_path / 'people.ndjson'
+    path.write_text(
+        '{"first_name": "one", "last_name": "person", "email": "one@local.test"}\n'
+        'not json\n'
+        '{"first_name": "two", "last_name": "person"}\n'
+    )
+
+    result = client.application.test_cli_runner(mix_stderr=False).invoke(
+        args=['people', 'import', str(path), '--format', 'ndjson']
+    )
+
+    assert result.exit_code == 0
+    assert 'Imported 2 people, 1 rows failed' in result.output
+    assert 'Row 2' in result.stderr
+    assert EmailAddress.resolve('one@local.test') is not None
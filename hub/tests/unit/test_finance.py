@@ -58,4 +58,161 @@ def test_bands_return_correct_amounts(client, db):
     db.session.add(band)
 
     assert band.net_amount == 5
-    assert len(rate.bands) == 1
\ No newline at end of file
+    assert len(rate.bands) == 1
+
+def test_is_active_with_dates(client, db):
+
+    from datetime import date
+    from hub.models.finance import Rate, Band
+
+    today = date.today()
+
+    rate = Rate(10, today)
+    assert rate.is_active == True
+
+    rate.ends_on = today
+    assert rate.is_active == False
+
+    band = Band('STD', rate)
+    band.starts_on = today + timedelta(days=1)
+    assert band.is_active == False
+
+
+def test_pricing_engine(client, db):
+    """
+    GIVEN rates and bands for a role type, changing over time
+    WHEN prices are quoted for dates, and in bulk for members
+    THEN the rate and band in effect on each date are used, in exact Decimals
+    """
+
+    from datetime import date
+    from decimal import Decimal
+    from hub.models.finance import Rate, Band
+    from hub.models.membership import Person, Role, RoleType
+    from hub.services import pricing
+
+    member = RoleType('Priced Member')
+    db.session.add(member)
+    db.session.commit()
+
+    old = Rate(Decimal('10'), date(2020, 1, 1))
+    old.ends_on    = date(2021, 1, 1)
+    old.multiplier = Decimal('0.5')
+    old.charge     = Decimal('0.1')
+    old.role_type  = member
+
+    new = Rate(Decimal('12'), date(2021, 1, 1))
+    new.multiplier = Decimal('0.5')
+    new.charge     = Decimal('0.2')
+    new.role_type  = member
+
+    low = Band('low', new)
+    low.starts_on  = date(2021, 1, 1)
+    low.multiplier = Decimal('0.333')
+
+    db.session.add_all([old, new, low])
+    db.session.commit()
+
+    assert pricing.quote(member.id, on=date(2019, 12, 31)) is None
+    assert pricing.quote(member.id, on=date(2020, 6, 1)) == Decimal('5.1')
+    assert pricing.quote(member.id, on=date(2021, 1, 1)) == Decimal('6.2')
+    assert pricing.quote(member.id, 'LOW', on=date(2021, 1, 1)) == Decimal('2.198')
+    assert pricing.quote(member.id, 'LOW', on=date(2020, 6, 1)) is None
+
+    # Writes drop the index
+    new.charge = Decimal('0.3')
+    db.session.commit()
+
+    assert pricing.quote(member.id, on=date(2021, 1, 1)) == Decimal('6.3')
+
+    people = [Person('Priced', str(i)) for i in range(3)]
+    db.session.add_all(people)
+    db.session.commit()
+
+    for person in people:
+        db.session.add(Role(person, member, starts_on=date(2020, 1, 1)))
+
+    db.session.commit()
+
+    quotes = pricing.quote_members(on=date(2021, 6, 1), bands={people[0].id: 'LOW'})
+
+    assert quotes == {
+        (people[0].id, member.id): Decimal('2.298'),
+        (people[1].id, member.id): Decimal('6.3'),
+        (people[2].id, member.id): Decimal('6.3'),
+    }
+
+
+def test_rolled_back_price_writes_keep_index(client, db):
+    """
+    GIVEN a built price index
+    WHEN a rate is changed and quoted before being rolled back, then changed and committed
+    THEN the uncommitted rate is never cached, and the index is dropped by the commit
+    """
+
+    from datetime import date
+    from decimal import Decimal
+    from hub.models.finance import Rate
+    from hub.models.membership import RoleType
+    from hub.services import pricing
+
+    member = RoleType('Rolled Back Priced Member')
+    db.session.add(member)
+    db.session.commit()
+
+    rate = Rate(Decimal('10'), date(2020, 1, 1))
+    rate.multiplier = Decimal('1')
+    rate.charge     = Decimal('0')
+    rate.role_type  = member
+    db.session.add(rate)
+    db.session.commit()
+
+    index = pricing.get_index()
+
+    rate.amount = Decimal('20')
+    db.session.flush()
+
+    # Still the committed index, and nothing built from the flush is kept
+    assert pricing.get_index() is index
+    pricing._forget()
+    assert pricing.quote(member.id, on=date(2021, 1, 1)) == Decimal('20')
+    assert pricing._index is None
+
+    db.session.rollback()
+
+    index = pricing.get_index()
+    assert pricing.quote(member.id, on=date(2021, 1, 1)) == Decimal('10')
+
+    rate.amount = Decimal('30')
+    db.session.commit()
+
+    assert pricing.get_index() is not index
+    assert pricing.quote(member.id, on=date(2021, 1, 1)) == Decimal('30')
+
+
+def test_other_workers_price_writes_clear_index(client, db):
+    """
+    GIVEN a built price index
+    WHEN another worker bumps the prices stamp
+    THEN the index is rebuilt on the next quote
+    """
+
+    from hub.models.auth import CacheStamp
+    from hub.services import pricing
+    from hub.services.invalidation import check_stamp
+
+    client.application.config['CACHE_STAMP_INTERVAL'] = 0
+
+    check_stamp(pricing.STAMP)
+    index = pricing.get_index()
+
+    assert pricing.get_index() is index
+
+    # As if written by another worker, without this one's session events
+    table = CacheStamp.__table__
+    with db.engine.begin() as connection:
+        if connection.execute(table.update().where(table.c.name == pricing.STAMP)
+                                           .values(version=table.c.version + 1)).rowcount == 0:
+            connection.execute(table.insert().values(name=pricing.STAMP, version=1))
+
+    assert pricing.get_index() is not index
@@ -0,0 +1,125 @@
+from hub.tests import client, db, postcodes_stub
+
+
+CODES = {
+    'admin_ward': 'E05010815',
+    'admin_district': 'E06000031',
+    'parliamentary_constituency': 'E14000855'
+}
+
+
+def test_post_code_check_is_cached(client, db, monkeypatch):
+
+    from hub.models.geo import PostCode
+    from hub.services import geo
+
+    calls = []
+
+    def fetch(post_code):
+        calls.append(post_code)
+        return CODES
+
+    monkeypatch.setattr(geo, 'fetch_post_code', fetch)
+    geo.get_cache().clear()
+
+    assert geo.post_code_check('pe7 8jy') == CODES
+    assert geo.post_code_check('PE7 8JY') == CODES
+    assert len(calls) == 1
+
+    db.session.commit()
+    assert PostCode.query.get('PE78JY').ward_id == 'E05010815'
+
+    # A new worker answers from the database
+    geo.get_cache().clear()
+    assert geo.post_code_check('PE78JY') == CODES
+    assert len(calls) == 1
+
+
+def test_post_code_check_caches_unknown_codes(client, db, monkeypatch):
+
+    from hub.services import geo
+
+    calls = []
+
+    def fetch(post_code):
+        calls.append(post_code)
+        return None
+
+    monkeypatch.setattr(geo, 'fetch_post_code', fetch)
+    geo.get_cache().clear()
+
+    assert geo.post_code_check('ZZ9 9ZZ') is None
+    assert geo.post_code_check('ZZ9 9ZZ') is None
+    assert len(calls) == 1
+
+    db.session.commit()
+
+
+def test_enrich_addresses_in_bulk(client, db, postcodes_stub):
+
+    from hub.models.membership import Person, Address
+    from hub.services.geo import enrich_addresses
+
+    post_codes = ['PE7 8JY', 'PE1 1AA', 'pe1 1aa', 'NOT A CODE']
+    people     = []
+
+    for post_code in post_codes:
+        person = Person('billy', 'nomates')
+        db.session.add(person)
+        db.session.flush()
+
+        db.session.add(Address(person, '1 Anystreet', post_code, 'HOME'))
+        people.append(person)
+
+    db.session.commit()
+
+    enrich_addresses()
+
+    assert postcodes_stub.stats['calls'] == 1
+    assert Address.query.filter(Address.geo_pending == True).count() == 0
+
+    assert people[0].ward_id == CODES['admin_ward']
+    assert people[1].ward_id is not None
+    assert people[1].ward_id == people[2].ward_id
+    assert people[3].ward_id is None
+
+    # Known postcodes are filled in straight away
+    person = Person('billy', 'nomates')
+    address = Address(person, '1 Anystreet', 'PE7 8JY', 'HOME')
+
+    assert not address.geo_pending
+    assert person.ward_id == CODES['admin_ward']
+
+
+def test_post_code_index(client, db, tmp_path, monkeypatch):
+
+    from flask import current_app
+    from hub.services import geo
+    from hub.services.postcode_index import load_directory, PostCodeIndex
+
+    csv_path = tmp_path / 'onspd.csv'
+    csv_path.write_text(
+        'pcds,doterm,osward,oslaua,pcon\n'
+        'PE7 8JY,,E05010815,E06000031,E14000855\n'
+        'PE1 1AA,,E05010800,E06000031,E14000855\n'
+        'PE2 2ZZ,199801,E05010801,E06000031,E14000855\n'
+        'CB1 1AA,,E05002700,E07000008,E14000617\n'
+    )
+
+    index_path = str(tmp_path / 'postcodes.idx')
+    assert load_directory(str(csv_path), index_path, prefixes=['PE']) == 2
+
+    index = PostCodeIndex(index_path)
+    assert len(index) == 2
+    assert index.get('pe78jy') == CODES
+    assert index.get('PE2 2ZZ') is None
+    assert 'CB1 1AA' not in index
+
+    def fetch(post_code):
+        raise AssertionError('should not fetch {:s}'.format(post_code))
+
+    monkeypatch.setattr(geo, 'fetch_post_code', fetch)
+    current_app.config['POSTCODE_INDEX_PATH'] = index_path
+
+    assert geo.post_code_check('PE7 8JY') == CODES
+    assert geo.post_code_check_many(['PE1 1AA'])['PE11AA']['admin_ward'] == 'E05010800'
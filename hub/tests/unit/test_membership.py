@@ -3,7 +3,7 @@ import random
 from datetime import timedelta
 from string import ascii_uppercase
 
-from hub.tests import client, db
+from hub.tests import client, db, postcodes_stub
 
 
 def test_person_returns_correct_names(client, db):
@@ -108,9 +108,10 @@ def test_sms_number(client, db):
     assert number_added.number == '07712345690'
 
 
-def test_get_address(client, db):
+def test_get_address(client, db, postcodes_stub):
 
     from hub.models.membership import Person, Address
+    from hub.services.geo import enrich_addresses
 
     person = Person('billy', 'nomates')
     person.date_of_birth = datetime.date(1990,10,11)
@@ -128,10 +129,285 @@ def test_get_address(client, db):
     assert len(person.addresses) == 1
     assert addr.line_1 == '11 Anystreet'
     assert addr.post_code == 'PE7 8JY'
+    assert addr.geo_pending
 
+    enrich_addresses()
+
+    assert not addr.geo_pending
     assert person.district_id == 'E06000031'
     assert person.constituency_id == 'E14000855'
     assert person.ward_id == 'E05010815'
 
     
 
+
+
+def test_person_ids_are_sequential(client, db):
+
+    from hub.models.membership import Person, PersonIdSequence
+
+    first  = Person('billy', 'nomates')
+    second = Person('billy', 'nomates')
+    block  = Person.reserve_ids(3)
+    after  = Person('billy', 'nomates', id=block[0])
+
+    ids = [first.id, second.id] + block
+
+    assert len(set(ids)) == 5
+    assert [int(i[3:-int(i[-1]) - 1]) for i in ids] == [1, 2, 3, 4, 5]
+    assert after.id == block[0]
+
+    prefix = Person.id_prefix()
+    assert PersonIdSequence.query.get(prefix).last_value == 5
+    assert Person.format_id(prefix, 1) == first.id
+
+    db.session.commit()
+
+
+def test_person_ids_do_not_wait_for_other_signups(client, db):
+    """
+    GIVEN a signup that has taken an id but not committed yet
+    WHEN another session takes an id for the same month
+    THEN it doesn't wait for the first, and the two ids differ
+    """
+
+    from sqlalchemy.orm import Session
+    from hub.models.membership import Person, PersonIdSequence
+
+    first = Person('billy', 'nomates')
+    db.session.add(first)
+
+    other = Session(bind=db.engine)
+    try:
+        table  = PersonIdSequence.__table__
+        prefix = Person.id_prefix()
+
+        # Fails with "database is locked" if the first signup still holds the counter
+        other.execute(
+            table.update().where(table.c.prefix == prefix).values(last_value=table.c.last_value + 1)
+        )
+        other.commit()
+    finally:
+        other.close()
+
+    db.session.commit()
+
+    second = Person('billy', 'nomates')
+
+    assert first.id == Person.format_id(prefix, 1)
+    assert second.id == Person.format_id(prefix, 3)
+
+
+def test_loading_profiles(client, db):
+
+    from hub.models.loading import profile
+    from hub.models.membership import Person, EmailAddress
+
+    person = Person('billy', 'nomates')
+    person.primary_email = 'profiles@local.test'
+    person.password = 'password'
+    db.session.add(person)
+    db.session.commit()
+
+    person_id = person.id
+    db.session.expunge_all()
+
+    person = Person.query.get(person_id)
+    assert 'email_addresses' not in person.__dict__
+
+    db.session.expunge_all()
+
+    person = Person.query.options(*profile('person.detail')).get(person_id)
+    assert 'email_addresses' in person.__dict__
+    assert 'addresses' in person.__dict__
+
+    db.session.expunge_all()
+
+    email = EmailAddress.query.options(*profile('email.login')) \
+                              .filter(EmailAddress.email == 'profiles@local.test').first()
+    assert email.person.full_name == 'Billy Nomates'
+    assert email.person.check_password('password')
+
+
+def test_summary_profile_raises_on_relationships(client, db):
+    """
+    GIVEN people loaded for a listing with the summary or login profile
+    WHEN their columns, then a relationship, are used
+    THEN the listing is one query, and the relationship raises rather than loading
+    """
+
+    import pytest
+    from sqlalchemy.exc import InvalidRequestError
+    from hub.models.loading import profile
+    from hub.models.membership import Person, EmailAddress
+
+    for i in range(3):
+        person = Person('Summary', str(i))
+        person.primary_email = 'summary.{:d}@local.test'.format(i)
+        db.session.add(person)
+    db.session.commit()
+    db.session.expunge_all()
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db.event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        people = Person.query.options(*profile('person.summary')) \
+                             .filter(Person.first_name == 'Summary').all()
+        names  = [person.full_name for person in people]
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', count)
+
+    assert len(names) == 3
+    assert len(statements) == 1
+
+    with pytest.raises(InvalidRequestError):
+        people[0].email_addresses
+
+    db.session.expunge_all()
+
+    email = EmailAddress.query.options(*profile('email.login')) \
+                              .filter(EmailAddress.email == 'summary.0@local.test').first()
+
+    with pytest.raises(InvalidRequestError):
+        email.person.roles
+
+
+def test_resolve_emails(client, db):
+    """
+    GIVEN people with email addresses
+    WHEN they're looked up in a different case
+    THEN the right person ids are found
+    """
+
+    from hub.models.membership import Person, EmailAddress
+
+    people = []
+    for i in range(3):
+        person = Person('Resolve', str(i))
+        person.primary_email = 'Resolve.{:d}@Local.Test'.format(i)
+        db.session.add(person)
+        people.append(person)
+
+    db.session.commit()
+
+    assert EmailAddress.resolve(' resolve.1@local.test') == people[1].id
+    assert EmailAddress.resolve('resolve.1@local.test', 'BACKUP') is None
+    assert EmailAddress.find('RESOLVE.2@LOCAL.TEST').first().person_id == people[2].id
+
+    assert EmailAddress.resolve_many([
+        'resolve.0@local.test',
+        'RESOLVE.2@local.test',
+        'nobody@local.test'
+    ]) == {
+        'resolve.0@local.test': people[0].id,
+        'RESOLVE.2@local.test': people[2].id
+    }
+
+
+def test_email_case_variants_are_taken(client, db):
+    """
+    GIVEN a person with an email address
+    WHEN someone else adds, or changes to, a case variant of it
+    THEN it's refused, while the owner can change its case
+    """
+
+    import pytest
+    from hub.models.membership import Person
+    from hub.services.errors import ConflictError
+
+    owner = Person('Owner', 'Person')
+    owner.primary_email = 'owner@local.test'
+    other = Person('Other', 'Person')
+    other.primary_email = 'other@local.test'
+    db.session.add_all([owner, other])
+    db.session.commit()
+
+    with pytest.raises(ConflictError):
+        Person('Copy', 'Cat').primary_email = 'Owner@Local.Test'
+
+    db.session.rollback()
+
+    with pytest.raises(ConflictError):
+        other.primary_email = 'OWNER@local.test'
+
+    db.session.rollback()
+
+    owner.primary_email = 'Owner@Local.Test'
+    db.session.commit()
+
+    assert owner.primary_email == 'Owner@Local.Test'
+
+
+def test_verify_tokens(client, db):
+    """
+    GIVEN verification codes sent to an address
+    WHEN codes are checked, and tokens swept
+    THEN only live codes work, guesses are limited, and dead tokens are deleted
+    """
+
+    from hub.models.membership import Person, VerifyToken
+
+    person = Person('Verify', 'Person')
+    person.primary_email = 'Verify@Local.Test'
+    db.session.add(person)
+    db.session.commit()
+
+    address = person.email_addresses[0]
+
+    # Only the newest few are kept
+    for code in range(10000, 10005):
+        VerifyToken.issue(address.email, code)
+        db.session.commit()
+
+    assert VerifyToken.active('verify@local.test').count() == VerifyToken.MAX_ACTIVE
+
+    # Wrong guesses use tokens up, and a new code doesn't reset them
+    for i in range(VerifyToken.MAX_ATTEMPTS - 1):
+        assert not address.verify(99999)
+        db.session.commit()
+
+    VerifyToken.issue(address.email, 12345)
+    db.session.commit()
+
+    assert not address.verify(99999)
+    db.session.commit()
+
+    assert not address.verify(12345)
+    assert not address.verified
+
+    # Once every code is used up, a new one is locked too, even after a sweep
+    for i in range(VerifyToken.MAX_ATTEMPTS):
+        address.verify(99999)
+        db.session.commit()
+
+    assert VerifyToken.active(address.email).count() == 0
+
+    VerifyToken.sweep()
+    VerifyToken.issue(address.email, 54321)
+    db.session.commit()
+
+    assert not address.verify(54321)
+    assert not address.verified
+
+    # A fresh, unguessed code works once
+    VerifyToken.query.delete()
+    VerifyToken.issue(address.email, 23456)
+    db.session.commit()
+
+    assert address.verify(23456)
+    assert address.verified
+    assert VerifyToken.query.count() == 0
+
+    # Sweeping deletes expired tokens
+    expired = VerifyToken(address.email, 34567)
+    expired.expires_at = datetime.datetime.now() - timedelta(minutes=1)
+    db.session.add(expired)
+    VerifyToken.issue(address.email, 45678)
+    db.session.commit()
+
+    assert VerifyToken.sweep(batch_size=1) == 1
+    assert VerifyToken.query.count() == 1
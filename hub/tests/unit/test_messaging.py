@@ -1,4 +1,4 @@
-from hub.tests import client, db
+from hub.tests import client, db, ses_stub
 
 
 def test_email_send(client, db):
@@ -55,4 +55,260 @@ def test_email_bounce(client, db):
         body_text='This is an email testing the email PeTU email system.' 
     )
 
-    assert r != False
\ No newline at end of file
+    assert r != False
+
+def test_resolve_recipients(client, db):
+
+    from hub.models.membership import Person, EmailAddress
+    from hub.models.messaging import Email
+
+    people = []
+    for i in range(5):
+        person = Person('recipient', 'Number{:d}'.format(i))
+        db.session.add(person)
+        db.session.flush()
+
+        address = EmailAddress(person, 'recipient{:d}@local.test'.format(i))
+        address.verified = True
+        db.session.add(address)
+        people.append(person)
+
+    people[3].email_addresses[0].verified    = False
+    people[4].email_addresses[0].hard_bounce = True
+    db.session.commit()
+
+    email = Email(None, 'Test Message', 'Hello {{ to.first_name }}')
+    email.type_code = 'TRN'
+    email.recipients.extend(people[1:])
+    db.session.add(email)
+    db.session.commit()
+
+    chunks = list(email.resolve_recipients(chunk_size=1))
+    pairs  = [pair for chunk in chunks for pair in chunk]
+
+    assert len(chunks) == 2
+    assert [person.id for person, address in pairs] == sorted([people[1].id, people[2].id])
+    assert [address for person, address in pairs] == sorted(['recipient1@local.test', 'recipient2@local.test'])
+
+    email.to_all_members = True
+    db.session.commit()
+
+    pairs = [pair for chunk in email.resolve_recipients() for pair in chunk]
+    assert len(pairs) == 3
+
+
+def test_email_render_uses_compiled_templates(client, db):
+
+    from hub.models.membership import Person
+    from hub.models.messaging import Email
+    from hub.services.email import get_email_template
+
+    anne = Person('anne', 'Person')
+    bill = Person('bill', 'Person')
+
+    email = Email(None, 'Test Message', 'Dear {{ to.first_name }},\n\n## Heading')
+    email.preview_text = 'Preview'
+
+    assert email.compile()[0] is email.compile()[0]
+    assert get_email_template('base.html.mustache') is get_email_template('base.html.mustache')
+
+    html = email.get_html(anne)
+    assert '<p>Dear Anne,</p>' in html
+    assert '<h2>Heading</h2>' in html
+    assert 'Peterborough Tenants Union <br>' in html
+
+    assert '<p>Dear Bill,</p>' in email.get_html(bill)
+    assert email.get_text(bill) == 'Dear Bill,\n\n## Heading'
+
+    email.body = 'Changed {{ to.first_name }}'
+    assert email.get_text(anne) == 'Changed Anne'
+
+
+def test_email_markdown_is_converted_once(client, db, monkeypatch):
+    """
+    GIVEN an email body in markdown, with a field that holds markdown
+    WHEN it is rendered for several recipients
+    THEN the body is converted once, and the field is inserted as text
+    """
+
+    from hub.models import messaging
+    from hub.models.membership import Person
+    from hub.models.messaging import Email
+
+    calls   = []
+    convert = messaging.markdown
+
+    def markdown(text):
+        calls.append(text)
+        return convert(text)
+
+    monkeypatch.setattr(messaging, 'markdown', markdown)
+
+    email = Email(None, 'Test Message', '## Agenda\n\n{{ agenda }}')
+
+    for name in ('anne', 'bill', 'cath'):
+        html = email.get_html(Person(name, 'Person'), {'agenda': '* Rent <b>'})
+
+    assert len(calls) == 1
+    assert '<h2>Agenda</h2>' in html
+    assert '<p>* Rent &lt;b&gt;</p>' in html
+
+    assert email.get_text(Person('anne', 'Person'), {'agenda': '* Rent'}) == '## Agenda\n\n* Rent'
+
+
+def test_bulk_send_records_deliveries(client, db, ses_stub):
+
+    from hub.models.membership import Person, EmailAddress
+    from hub.models.messaging import Email, EmailDelivery
+    from hub.services.email import get_ses_client
+
+    for i in range(12):
+        person = Person('bulk', 'Number{:d}'.format(i))
+        db.session.add(person)
+        db.session.flush()
+
+        address = EmailAddress(person, 'bulk{:d}@local.test'.format(i))
+        address.verified = True
+        db.session.add(address)
+
+    email = Email(None, 'Test Message', 'Dear {{ to.first_name }} {{ to.full_name }}')
+    email.type_code      = 'TRN'
+    email.to_all_members = True
+    db.session.add(email)
+    db.session.commit()
+
+    (subject, html, text), fields = email.get_bulk_template()
+    assert fields == {'id', 'first_name', 'full_name'}
+    assert text == 'Dear {{to.first_name}} {{to.full_name}}'
+
+    email.send()
+    db.session.commit()
+
+    deliveries = EmailDelivery.query.with_parent(email).all()
+
+    assert email.status == 'SENT'
+    assert len(deliveries) == 12
+    assert all(d.status == 'SUCCESS' and d.message_id for d in deliveries)
+    assert ses_stub.stats['messages'] == 12
+    assert ses_stub.stats['templates'] == {}
+    assert get_ses_client() is get_ses_client()
+
+
+def test_bulk_send_dead_letters_refused_addresses(client, db, ses_stub):
+
+    from hub.models.membership import Person, EmailAddress
+    from hub.models.messaging import Email, EmailDelivery, DeadLetter
+
+    for i in range(12):
+        person = Person('bulk', 'Number{:d}'.format(i))
+        db.session.add(person)
+        db.session.flush()
+
+        local = 'reject' if i == 3 else 'bulk{:d}'.format(i)
+        address = EmailAddress(person, '{:s}@local.test'.format(local))
+        address.verified = True
+        db.session.add(address)
+
+    email = Email(None, 'Test Message', 'Dear {{ to.first_name }}')
+    email.type_code      = 'TRN'
+    email.to_all_members = True
+    db.session.add(email)
+    db.session.commit()
+
+    email.send()
+
+    letters    = DeadLetter.query.all()
+    deliveries = EmailDelivery.query.with_parent(email).all()
+
+    assert email.status == 'SENT'
+    assert len(deliveries) == 12
+    assert ses_stub.stats['messages'] == 11
+    assert [letter.recipient for letter in letters] == ['reject@local.test']
+    assert letters[0].error_code == 'MessageRejected'
+    assert 'Dear Bulk' in letters[0].body_text
+
+
+def test_small_send_records_deliveries(client, db, ses_stub):
+
+    from hub.models.membership import Person, EmailAddress
+    from hub.models.messaging import Email, EmailDelivery, DeadLetter
+
+    for i in range(3):
+        person = Person('small', 'Number{:d}'.format(i))
+        db.session.add(person)
+        db.session.flush()
+
+        local = 'reject' if i == 1 else 'small{:d}'.format(i)
+        address = EmailAddress(person, '{:s}@local.test'.format(local))
+        address.verified = True
+        db.session.add(address)
+
+    email = Email(None, 'Test Message', 'Dear {{ to.first_name }}')
+    email.type_code      = 'TRN'
+    email.to_all_members = True
+    db.session.add(email)
+    db.session.commit()
+
+    email.send()
+
+    deliveries = {d.address: d for d in EmailDelivery.query.with_parent(email)}
+
+    assert email.status == 'SENT'
+    assert len(deliveries) == 3
+    assert deliveries['small0@local.test'].status == 'SUCCESS'
+    assert deliveries['small0@local.test'].message_id
+    assert deliveries['reject@local.test'].status == 'FAILED'
+    assert deliveries['reject@local.test'].error == 'MessageRejected'
+    assert ses_stub.stats['templates'] == {}
+    assert [letter.recipient for letter in DeadLetter.query] == ['reject@local.test']
+
+
+def test_blank_ses_endpoint_uses_aws(client):
+
+    from flask import current_app
+    from hub.services.email import get_ses_client
+
+    current_app.config['SES_ENDPOINT_URL'] = ''
+
+    assert get_ses_client().meta.endpoint_url.endswith('.amazonaws.com')
+
+
+def test_send_email_retries_when_throttled(client, db):
+
+    from flask import current_app
+    from hub.stubs.ses import create_stub
+    from hub.services.email import send_email
+    from hub.tests import run_stub
+
+    stub = create_stub(max_rate=2)
+    server, url = run_stub(stub)
+
+    current_app.config.update(
+        SES_ENDPOINT_URL=url,
+        SES_MAX_SEND_RATE=100,
+        SES_RETRY_DELAY=0.05
+    )
+
+    for i in range(6):
+        r = send_email('throttle{:d}@local.test'.format(i), 'Subject', '<p>Body</p>', 'Body')
+        assert r != False
+
+    server.shutdown()
+
+    assert stub.stats['messages'] == 6
+    assert stub.stats['throttled'] > 0
+
+
+def test_rejected_email_is_dead_lettered(client, db, ses_stub):
+
+    from hub.models.messaging import DeadLetter
+    from hub.services.email import send_email
+
+    r = send_email('reject@local.test', 'Subject', '<p>Body</p>', 'Body')
+
+    letter = DeadLetter.query.filter(DeadLetter.recipient == 'reject@local.test').first()
+
+    assert r == False
+    assert letter is not None
+    assert letter.error_code == 'MessageRejected'
+    assert ses_stub.stats['messages'] == 0
@@ -1,4 +1,4 @@
-from hub.tests import client, db
+from hub.tests import client, db, stripe_stub
 
 def test_create_customer_service(client, db):
 
@@ -32,8 +32,41 @@ def test_create_payment_intent_service(client, db):
     customer        = create_customer(person)
     intent, payment = generate_payment(person, 500)
 
-    assert person.stripe_customer_id is not None
+    assert person.stripe_customer_id == customer['id']
+    assert intent['customer'] == customer['id']
     assert Payment.query.with_parent(person).count() > 0
     assert payment.payment_intent_id == intent['id']
 
 
+
+
+def test_customers_are_resolved_lazily(client, db, stripe_stub):
+    """
+    GIVEN a person without a Stripe customer
+    WHEN they check out, and their customer is fetched afterwards
+    THEN one customer is created, and nothing else is fetched from Stripe
+    """
+
+    from hub.models.membership import Person
+    from hub.models.finance import Payment
+    from hub.services.payments import configure, create_customer, generate_payment, get_customer_cache
+
+    configure(client.application.config)
+    get_customer_cache().clear()
+
+    person = Person('anne', 'Person')
+    db.session.add(person)
+    db.session.commit()
+
+    intent, payment = generate_payment(person, 500)
+
+    assert stripe_stub.stats['calls'] == 2
+    assert Person.query.get(person.id).stripe_customer_id == intent['customer']
+
+    # The stored id is trusted, and the created customer is cached
+    customer = create_customer(person)
+    intent, payment = generate_payment(person, 500)
+
+    assert customer['id'] == person.stripe_customer_id
+    assert stripe_stub.stats['calls'] == 3
+    assert Payment.query.with_parent(person).count() == 2
@@ -0,0 +1,196 @@
+import datetime
+
+from hub.tests import client, db
+
+
+def test_load_principal(client, db):
+
+    from hub.models.membership import Person, Role, RoleType, Ability
+    from hub.services.principal import load_principal, get_cache
+
+    person = Person('billy', 'nomates')
+    person.primary_email = 'principal@local.test'
+    db.session.add(person)
+
+    role_type = RoleType('Principal Member')
+    db.session.add(role_type)
+    db.session.commit()
+
+    principal = load_principal(person.id)
+
+    assert principal.id == person.id
+    assert principal.full_name == 'Billy Nomates'
+    assert principal.role_type_ids == frozenset()
+    assert get_cache().get(person.id) is not None
+
+    db.session.add(Role(person, role_type, starts_on=datetime.date(2000, 1, 1)))
+    db.session.add(Ability(role_type, 'people.list'))
+    db.session.commit()
+
+    principal = load_principal(person.id)
+
+    assert principal.role_type_ids == frozenset([role_type.id])
+    assert principal.abilities == frozenset(['people.list'])
+    assert principal._person is None
+
+    # Anything else loads the full person
+    assert principal.primary_email == 'principal@local.test'
+    assert principal.person is not None
+
+    assert load_principal('X0000') is None
+
+
+def test_person_has_uses_permission_index(client, db):
+
+    from hub.models.membership import Person, Role, RoleType, Ability
+    from hub.services.permissions import person_has, get_permissions
+
+    person = Person('billy', 'nomates')
+    other  = Person('other', 'person')
+    db.session.add(person)
+    db.session.add(other)
+
+    member = RoleType('Indexed Member')
+    admin  = RoleType('Indexed Admin')
+    db.session.add(member)
+    db.session.add(admin)
+    db.session.commit()
+
+    db.session.add(Role(person, member, starts_on=datetime.date(2000, 1, 1)))
+    db.session.add(Ability(member, 'people.list'))
+
+    own_profile = Ability(member, 'people.edit')
+    own_profile.gate_func = 'user_is_person'
+    db.session.add(own_profile)
+    db.session.commit()
+
+    index = get_permissions(person.id)
+    assert get_permissions(person.id) is index
+
+    assert person_has(person, ['people.list'], None)
+    assert not person_has(person, ['people.delete'], None)
+    assert person_has(person, None, [member])
+    assert person_has(person, None, [member.id])
+    assert not person_has(person, None, [admin])
+
+    # Gated abilities run their gate function
+    assert person_has(person, ['people.edit'], None, {'person': person})
+    assert not person_has(person, ['people.edit'], None, {'person': other})
+
+    # Role changes rebuild the index
+    db.session.add(Role(person, admin, starts_on=datetime.date(2000, 1, 1)))
+    db.session.commit()
+
+    assert get_permissions(person.id) is not index
+    assert person_has(person, None, [admin])
+
+
+def test_rolled_back_writes_keep_cache(client, db):
+    """
+    GIVEN a cached permission index
+    WHEN a role is added and rolled back, then added and committed
+    THEN nothing built before the rollback is cached, and the index is only dropped by the commit
+    """
+
+    from hub.models.membership import Person, Role, RoleType
+    from hub.services.permissions import get_permissions
+
+    person = Person('billy', 'nomates')
+    member = RoleType('Rolled Back Member')
+    db.session.add(person)
+    db.session.add(member)
+    db.session.commit()
+
+    index = get_permissions(person.id)
+
+    db.session.add(Role(person, member, starts_on=datetime.date(2000, 1, 1)))
+    db.session.flush()
+
+    # Indexes built from the uncommitted role aren't kept
+    assert get_permissions(person.id) is index
+    assert get_permissions('X0000') is not get_permissions('X0000')
+
+    db.session.rollback()
+
+    assert get_permissions(person.id) is index
+
+    db.session.add(Role(person, member, starts_on=datetime.date(2000, 1, 1)))
+    db.session.commit()
+
+    assert get_permissions(person.id) is not index
+
+
+def test_other_workers_writes_clear_cache(client, db):
+    """
+    GIVEN cached principals and permission indexes
+    WHEN another worker bumps the cache stamp
+    THEN the caches are cleared on the next lookup
+    """
+
+    from flask import current_app
+    from hub.models.auth import CacheStamp
+    from hub.models.membership import Person
+    from hub.services.invalidation import STAMP, check_stamp
+    from hub.services.permissions import get_permissions
+    from hub.services.cache import MISSING
+    from hub.services.principal import load_principal, get_cache
+
+    current_app.config['CACHE_STAMP_INTERVAL'] = 0
+
+    person = Person('billy', 'nomates')
+    db.session.add(person)
+    db.session.commit()
+
+    check_stamp()
+    index = get_permissions(person.id)
+    load_principal(person.id)
+
+    # As if written by another worker, without this one's session events
+    table = CacheStamp.__table__
+    with db.engine.begin() as connection:
+        if connection.execute(table.update().where(table.c.name == STAMP)
+                                           .values(version=table.c.version + 1)).rowcount == 0:
+            connection.execute(table.insert().values(name=STAMP, version=1))
+
+    assert get_permissions(person.id) is not index
+    assert get_cache().get(person.id) is MISSING
+
+
+def test_gate_without_gate_functions_checks_abilities(client, db):
+    """
+    GIVEN a logged in person without an ability, then with it
+    WHEN Gate.check is called with abilities or roles but no gate functions
+    THEN it refuses, then allows. It used to let everyone through.
+    """
+
+    import pytest
+    from flask_jwt_extended import create_access_token, verify_jwt_in_request
+    from hub.models.membership import Person, Role, RoleType, Ability
+    from hub.services.errors import ActionNotAllowed
+    from hub.services.permissions import Gate
+
+    person = Person('billy', 'nomates')
+    member = RoleType('Gated Member')
+    db.session.add(person)
+    db.session.add(member)
+    db.session.commit()
+
+    def check(**kwargs):
+        token = create_access_token(identity=person.id)
+
+        with client.application.test_request_context(headers={'Authorization': 'Bearer ' + token}):
+            verify_jwt_in_request()
+            return Gate.check(**kwargs)
+
+    with pytest.raises(ActionNotAllowed):
+        check(abilities=['people.list'])
+
+    with pytest.raises(ActionNotAllowed):
+        check(roles=[member])
+
+    db.session.add(Role(person, member, starts_on=datetime.date(2000, 1, 1)))
+    db.session.add(Ability(member, 'people.list'))
+    db.session.commit()
+
+    assert check(abilities=['people.list'])
+    assert check(roles=[member])
@@ -0,0 +1,53 @@
+import datetime, decimal, gzip, json
+
+from hub.tests import client, db
+
+
+def test_dumps():
+    """
+    GIVEN data with money and dates in it
+    WHEN encoded
+    THEN Decimals are exact strings and dates are ISO 8601
+    """
+
+    from hub.services.representations import dumps
+
+    data = json.loads(dumps({
+        'amount': decimal.Decimal('4.500'),
+        'on': datetime.date(2020, 11, 1),
+        'at': datetime.datetime(2020, 11, 1, 12, 30)
+    }))
+
+    assert data == {'amount': '4.500', 'on': '2020-11-01', 'at': '2020-11-01T12:30:00'}
+
+
+def test_compressed_response(client, db):
+    """
+    GIVEN a client that accepts gzip
+    WHEN a resource responds
+    THEN large bodies are compressed and small ones aren't
+    """
+
+    from flask_jwt_extended import create_access_token
+    from hub.models.membership import Person
+
+    person = Person('Test', 'Person')
+    db.session.add(person)
+    db.session.commit()
+
+    headers = {
+        'Authorization': 'Bearer ' + create_access_token(identity=person.id),
+        'Accept-Encoding': 'gzip'
+    }
+
+    client.application.config['COMPRESS_MIN_SIZE'] = 10
+    r = client.get(f'/api/people/{person.id}', headers=headers)
+
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(r.get_data()))['person']['id'] == person.id
+
+    client.application.config['COMPRESS_MIN_SIZE'] = 1024 * 1024
+    r = client.get(f'/api/people/{person.id}', headers=headers)
+
+    assert 'Content-Encoding' not in r.headers
+    assert r.json['person']['id'] == person.id
@@ -0,0 +1,55 @@
+import datetime
+
+from hub.tests import client, db
+
+
+def test_compiled_dump(client, db):
+    """
+    GIVEN a person with relationships
+    WHEN dumped through the schema cache
+    THEN the output matches a fresh schema's, and the schema is reused
+    """
+
+    from hub.models.membership import Person, Address
+    from hub.schemas.cache import get_schema, dump
+    from hub.schemas.membership import PersonSchema
+
+    person = Person('Schema', 'Person')
+    person.primary_email = 'schema@local.test'
+    person.date_of_birth = datetime.date(1990, 5, 1)
+    db.session.add(person)
+    db.session.add(Address(person, '1 Some Street', 'ZZ1 1ZZ', 'HOME'))
+    db.session.commit()
+
+    assert dump(PersonSchema, person) == PersonSchema().dump(person)
+    assert dump(PersonSchema, person, only=('id', 'full_name')) == {
+        'id': person.id,
+        'full_name': 'Schema Person'
+    }
+    assert dump(PersonSchema, [person], many=True) == PersonSchema(many=True).dump([person])
+
+    assert get_schema(PersonSchema, only=('id', 'full_name')) is get_schema(PersonSchema, only=('full_name', 'id'))
+    assert get_schema(PersonSchema) is not get_schema(PersonSchema, only=('id',))
+
+
+def test_schema_cache_is_bounded(client):
+    """
+    GIVEN a small schema cache
+    WHEN many different field sets are asked for
+    THEN only the most recent are kept
+    """
+
+    import itertools
+    from hub.schemas import cache
+    from hub.schemas.membership import PersonSchema
+
+    client.application.config['SCHEMA_CACHE_SIZE'] = 4
+    cache._schemas = None
+
+    fields = ('id', 'first_name', 'last_name', 'full_name', 'email')
+    for only in itertools.chain.from_iterable(itertools.combinations(fields, n) for n in range(1, 6)):
+        cache.get_schema(PersonSchema, only=only)
+
+    assert len(cache.get_cache()) == 4
+
+    cache._schemas = None
@@ -0,0 +1,37 @@
+import threading
+
+from hub.tests import client
+
+
+def test_task_runs_off_request(client):
+
+    from flask import current_app
+    from hub.services.tasks import task
+
+    done   = threading.Event()
+    result = {}
+
+    @task
+    def record_thread(value):
+        result['value']  = value
+        result['thread'] = threading.current_thread().name
+        done.set()
+
+    current_app.config['TASKS_EAGER'] = False
+    record_thread.delay('hello')
+
+    assert done.wait(5)
+    assert result['value'] == 'hello'
+    assert result['thread'] != threading.current_thread().name
+
+
+def test_token_bucket_limits_rate():
+
+    from hub.services.ratelimit import TokenBucket
+
+    bucket = TokenBucket(10, capacity=2)
+
+    assert bucket.try_take()
+    assert bucket.try_take()
+    assert not bucket.try_take()
+    assert bucket.take() > 0
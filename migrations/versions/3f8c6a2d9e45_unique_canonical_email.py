@@ -0,0 +1,57 @@
+"""Unique canonical email
+
+Revision ID: 3f8c6a2d9e45
+Revises: 6e4b1d9f3a27
+Create Date: 2026-10-18 18:24:51.603117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8c6a2d9e45'
+down_revision = '6e4b1d9f3a27'
+branch_labels = None
+depends_on = None
+
+
+email_address = sa.table('email_address',
+    sa.column('person_id', sa.String),
+    sa.column('type_code', sa.String),
+    sa.column('email', sa.String),
+    sa.column('canonical_email', sa.String)
+)
+
+
+def find_collisions():
+    """Addresses that only differ by case, and who has them"""
+    connection = op.get_bind()
+
+    duplicated = sa.select([email_address.c.canonical_email]) \
+                   .group_by(email_address.c.canonical_email) \
+                   .having(sa.func.count() > 1)
+
+    return connection.execute(
+        sa.select([email_address.c.canonical_email, email_address.c.person_id,
+                   email_address.c.type_code, email_address.c.email])
+          .where(email_address.c.canonical_email.in_(duplicated))
+          .order_by(email_address.c.canonical_email, email_address.c.person_id)
+    ).fetchall()
+
+
+def upgrade():
+    collisions = find_collisions()
+
+    if len(collisions) > 0:
+        raise RuntimeError(
+            'These addresses belong to more than one person, or appear twice for one. '
+            'Remove or change all but one of each, then upgrade again:\n' +
+            '\n'.join('{0.canonical_email}: {0.person_id} {0.type_code} {0.email}'.format(row) for row in collisions)
+        )
+
+    op.create_index('uq_email_address_canonical_email', 'email_address', ['canonical_email'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_email_address_canonical_email', table_name='email_address')
@@ -0,0 +1,30 @@
+"""Added prices cache stamp
+
+Revision ID: d41e8a6c0b93
+Revises: 5c9a7e3b2f18
+Create Date: 2026-10-18 21:12:40.517309
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41e8a6c0b93'
+down_revision = '5c9a7e3b2f18'
+branch_labels = None
+depends_on = None
+
+
+cache_stamp = sa.table('cache_stamp',
+    sa.column('name', sa.String),
+    sa.column('version', sa.Integer)
+)
+
+
+def upgrade():
+    op.bulk_insert(cache_stamp, [{'name': 'prices', 'version': 0}])
+
+
+def downgrade():
+    op.execute(cache_stamp.delete().where(cache_stamp.c.name == 'prices'))